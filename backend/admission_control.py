@@ -0,0 +1,146 @@
+# C:\llm_service\backend\admission_control.py
+# LLM 生成的准入控制: 有界並發 + 優先權佇列 + 排隊逾時
+
+import heapq
+import itertools
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Any, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_INTERACTIVE = "interactive"
+PRIORITY_BATCH = "batch"
+_PRIORITY_RANK = {PRIORITY_INTERACTIVE: 0, PRIORITY_BATCH: 1}
+
+
+class AdmissionRejectedError(Exception):
+    """請求未被准入；status_code 與 retry_after 供 API 層回傳 429/503 與 Retry-After 標頭"""
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFullError(AdmissionRejectedError):
+    status_code = 429
+
+
+class QueueTimeoutError(AdmissionRejectedError):
+    status_code = 503
+
+
+class _Waiter:
+    __slots__ = ("event", "granted", "cancelled")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+        self.cancelled = False
+
+
+class GenerationQueue:
+    """
+    限制同時送往 Ollama 的生成數量。
+    - 容量 = 每個後端的最大並發數 x 目前健康的後端數 (由 backend_count_fn 提供)
+    - 超出容量的請求依優先權 (interactive 先於 batch)、再依到達順序排隊
+    - 佇列已滿時立即拋出 QueueFullError (429)；排隊超過該優先權的時限則拋出 QueueTimeoutError (503)
+    """
+
+    def __init__(self,
+                 max_concurrency_per_backend: int = 2,
+                 backend_count_fn: Optional[Callable[[], int]] = None,
+                 max_queue_size: int = 32,
+                 queue_timeouts: Optional[Dict[str, float]] = None):
+        self.max_concurrency_per_backend = max_concurrency_per_backend
+        self.backend_count_fn = backend_count_fn or (lambda: 1)
+        self.max_queue_size = max_queue_size
+        self.queue_timeouts = {PRIORITY_INTERACTIVE: 30.0, PRIORITY_BATCH: 300.0}
+        self.queue_timeouts.update(queue_timeouts or {})
+
+        self._lock = threading.Lock()
+        self._heap = []
+        self._seq = itertools.count()
+        self._running = 0
+        self._queued = 0
+        self._avg_service_s = None
+        self._stats = {"admitted": 0, "rejected_full": 0, "timed_out": 0, "total_wait_ms": 0.0, "max_wait_ms": 0.0}
+
+    @property
+    def capacity(self) -> int:
+        return self.max_concurrency_per_backend * max(1, self.backend_count_fn())
+
+    def _retry_after(self) -> int:
+        service_s = self._avg_service_s or 10.0
+        return max(1, math.ceil(service_s * (self._queued + 1) / max(1, self.capacity)))
+
+    def _grant_next(self):
+        # 呼叫端須持有 self._lock
+        while self._heap and self._running < self.capacity:
+            _, _, waiter = heapq.heappop(self._heap)
+            if waiter.cancelled:
+                continue
+            waiter.granted = True
+            self._queued -= 1
+            self._running += 1
+            waiter.event.set()
+
+    def _acquire(self, priority: str) -> float:
+        rank = _PRIORITY_RANK.get(priority, _PRIORITY_RANK[PRIORITY_BATCH])
+        started = time.monotonic()
+        with self._lock:
+            self._grant_next()  # 健康後端數增加時，容量可能已經變大
+            if self._running < self.capacity and not self._heap:
+                self._running += 1
+                self._record_admit(0.0)
+                return started
+            if self._queued >= self.max_queue_size:
+                self._stats["rejected_full"] += 1
+                raise QueueFullError("生成佇列已滿，請稍後再試", retry_after=self._retry_after())
+            waiter = _Waiter()
+            heapq.heappush(self._heap, (rank, next(self._seq), waiter))
+            self._queued += 1
+
+        timeout = self.queue_timeouts.get(priority, self.queue_timeouts[PRIORITY_BATCH])
+        waiter.event.wait(timeout)
+        with self._lock:
+            if not waiter.granted:
+                waiter.cancelled = True
+                self._queued -= 1
+                self._stats["timed_out"] += 1
+                raise QueueTimeoutError(f"排隊超過 {timeout:.0f} 秒仍未輪到，請稍後再試", retry_after=self._retry_after())
+            self._record_admit((time.monotonic() - started) * 1000)
+        return time.monotonic()
+
+    def _record_admit(self, wait_ms: float):
+        self._stats["admitted"] += 1
+        self._stats["total_wait_ms"] += wait_ms
+        self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], wait_ms)
+
+    def _release(self, admitted_at: float):
+        service_s = time.monotonic() - admitted_at
+        with self._lock:
+            self._running -= 1
+            self._avg_service_s = service_s if self._avg_service_s is None else 0.8 * self._avg_service_s + 0.2 * service_s
+            self._grant_next()
+
+    @contextmanager
+    def slot(self, priority: str = PRIORITY_INTERACTIVE) -> Iterator[None]:
+        """取得一個生成名額，離開 with 區塊時歸還"""
+        admitted_at = self._acquire(priority)
+        try:
+            yield
+        finally:
+            self._release(admitted_at)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(running=self._running, queue_depth=self._queued, capacity=self.capacity, max_queue_size=self.max_queue_size)
+        stats["avg_wait_ms"] = round(stats.pop("total_wait_ms") / stats["admitted"], 1) if stats["admitted"] else 0.0
+        stats["max_wait_ms"] = round(stats["max_wait_ms"], 1)
+        return stats
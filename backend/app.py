@@ -3,14 +3,19 @@
 
 import os
 import sys
+import atexit
 import logging
 import json
 import uuid
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.exc import IntegrityError
 from dotenv import load_dotenv
 
 # --- 設置路徑和載入環境變數 ---
@@ -25,8 +30,12 @@ except Exception as e:
 
 # --- 匯入所有需要的服務 ---
 from llm_service import LLMService
+from admission_control import AdmissionRejectedError
+from history_cache import SessionHistoryCache
 from multimedia_service import MultimediaService
 from weather_service import TaiwanWeatherService
+from weather_sections import extract_cities
+from weather_fast_path import WeatherFastPath
 
 # --- 初始化 Flask 應用和服務 ---
 app = Flask(__name__)
@@ -39,14 +48,30 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 logger.info("正在初始化所有服務...")
-llm_service = LLMService()
+# 多個 Ollama 後端以逗號分隔，例如 OLLAMA_URLS=http://10.0.0.2:11434,http://10.0.0.3:11434
+# LLM_TOKENIZER 為與 Ollama 模型相同的 HuggingFace tokenizer 名稱 (例如 meta-llama/Meta-Llama-3.1-8B-Instruct)，未設定時以估算方式計數 token
+llm_service = LLMService(
+    ollama_urls=[url.strip() for url in os.getenv("OLLAMA_URLS", "").split(",") if url.strip()],
+    cache_db_path=str(project_root / "data" / "response_cache.db"),
+    tokenizer_name=os.getenv("LLM_TOKENIZER") or None
+)
+atexit.register(llm_service.close)
 multimedia_service = MultimediaService()
 weather_service = TaiwanWeatherService()
+# 簡單的天氣問題直接以排程器寫出的結構化資料回答，不佔用 GPU
+weather_fast_path = WeatherFastPath(str(project_root / "data" / "weather_structured.json"))
+# 活躍 session 的最近訊息快取，對話歷史由後端依 session_id 組裝
+history_cache = SessionHistoryCache(max_sessions=256, max_messages=20)
+# 滾動摘要: 未摘要的訊息超過 SUMMARY_TRIGGER_MESSAGES 則時，在背景把較舊的訊息併入摘要，只保留最近 SUMMARY_KEEP_RECENT 則原文
+SUMMARY_TRIGGER_MESSAGES = 12
+SUMMARY_KEEP_RECENT = 4
+summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-summary")
+_summaries_in_progress = set(); _summaries_lock = threading.Lock()
 logger.info("所有服務初始化完成。")
 
 # --- 資料庫模型 ---
 class Conversation(db.Model):
-    __tablename__='conversations';id=db.Column(db.Integer,primary_key=True);session_id=db.Column(db.String(255),unique=True,nullable=False,default=lambda:str(uuid.uuid4()));title=db.Column(db.String(500),nullable=True);created_at=db.Column(db.DateTime,default=datetime.utcnow);updated_at=db.Column(db.DateTime,default=datetime.utcnow,onupdate=datetime.utcnow);is_active=db.Column(db.Boolean,default=True);messages=db.relationship('Message',backref='conversation',lazy=True,cascade='all, delete-orphan')
+    __tablename__='conversations';id=db.Column(db.Integer,primary_key=True);session_id=db.Column(db.String(255),unique=True,nullable=False,default=lambda:str(uuid.uuid4()));title=db.Column(db.String(500),nullable=True);created_at=db.Column(db.DateTime,default=datetime.utcnow);updated_at=db.Column(db.DateTime,default=datetime.utcnow,onupdate=datetime.utcnow);is_active=db.Column(db.Boolean,default=True);summary=db.Column(db.Text,nullable=True);summarized_message_count=db.Column(db.Integer,nullable=False,default=0);messages=db.relationship('Message',backref='conversation',lazy=True,cascade='all, delete-orphan')
     def to_dict(self,include_messages=False):
         result={'id':self.id,'session_id':self.session_id,'title':self.title or self.get_auto_title(),'created_at':self.created_at.isoformat()if self.created_at else None,'updated_at':self.updated_at.isoformat()if self.updated_at else None,'is_active':self.is_active,'message_count':len(self.messages)};
         if include_messages:result['messages']=[msg.to_dict()for msg in self.messages];
@@ -58,23 +83,141 @@ class Conversation(db.Model):
         return f"對話 {self.created_at.strftime('%m-%d %H:%M')}"
 
 class Message(db.Model):
-    __tablename__='messages';id=db.Column(db.Integer,primary_key=True);conversation_id=db.Column(db.Integer,db.ForeignKey('conversations.id'),nullable=False);role=db.Column(db.String(50),nullable=False);content=db.Column(db.Text,nullable=False);message_metadata=db.Column(db.Text,nullable=True);created_at=db.Column(db.DateTime,default=datetime.utcnow)
+    __tablename__='messages';id=db.Column(db.Integer,primary_key=True);conversation_id=db.Column(db.Integer,db.ForeignKey('conversations.id'),nullable=False,index=True);role=db.Column(db.String(50),nullable=False);content=db.Column(db.Text,nullable=False);message_metadata=db.Column(db.Text,nullable=True);created_at=db.Column(db.DateTime,default=datetime.utcnow)
     def to_dict(self):return{'id':self.id,'conversation_id':self.conversation_id,'role':self.role,'content':self.content,'metadata':json.loads(self.message_metadata)if self.message_metadata else{},'created_at':self.created_at.isoformat()if self.created_at else None}
     def set_metadata(self,metadata_dict):self.message_metadata=json.dumps(metadata_dict,ensure_ascii=False)
 
-# [核心修正] 簡化城市提取，不再轉換為 "臺"
-def _extract_city_from_message(message):
-    if not weather_service: return None
-    # 使用簡稱列表進行匹配，並按長度排序以提高準確性
-    taiwan_cities = [
-        '台北', '新北', '桃園', '台中', '台南', '高雄',
-        '基隆', '新竹', '嘉義', '宜蘭', '花蓮', '台東', '苗栗', '彰化',
-        '南投', '雲林', '屏東', '澎湖', '金門', '連江'
-    ]
-    for city in sorted(taiwan_cities, key=len, reverse=True):
-        if city in message:
-            return city # 直接返回找到的簡稱，例如 "台北"
-    return None
+def _rag_filter(user_message, use_rag_dynamic):
+    """動態庫的天氣片段依城市切割 (metadata 的 city 為正式名稱，例如「臺北市」)，問到特定城市時只檢索這些城市"""
+    if not use_rag_dynamic: return None
+    cities = extract_cities(user_message)
+    if not cities: return None
+    return {'city': cities[0]} if len(cities) == 1 else {'city': {'$in': cities}}
+
+def _detect_rag_intent(user_message):
+    """智慧判斷：依問題內容決定要啟用的知識庫，回傳 (use_rag_static, use_rag_dynamic)"""
+    weather_keywords = ['天氣', '氣溫', '下雨', '預報', '颱風', '濕度', '氣壓']; is_weather_question = any(keyword in user_message for keyword in weather_keywords)
+    use_rag_static = True; use_rag_dynamic = False
+
+    if is_weather_question:
+        use_rag_dynamic = True
+        if len(user_message) < 20: use_rag_static = False
+    
+    logger.info(f"查詢意圖: 靜態庫-{'啟用' if use_rag_static else '停用'}, 動態庫-{'啟用' if use_rag_dynamic else '停用'}")
+    return use_rag_static, use_rag_dynamic
+
+def _load_session(session_id):
+    """
+    依 session_id 取得 history_cache 項目 (conversation_id、最近訊息、訊息總數、摘要)；找不到對話時回傳 None。
+    熱門 session 由 history_cache 命中時只以一次查詢確認快取仍是最新 (其他 worker 可能已寫入新訊息或摘要)，不必重新載入訊息。
+    """
+    if not session_id: return None
+    cached = history_cache.get(session_id)
+    if cached is not None and _is_cache_current(cached): return cached
+    conversation = Conversation.query.filter_by(session_id=session_id, is_active=True).first()
+    if not conversation: return None
+    total_count = Message.query.filter_by(conversation_id=conversation.id).count()
+    recent = Message.query.filter_by(conversation_id=conversation.id).order_by(Message.id.desc()).limit(history_cache.max_messages).all()
+    history = [{'role': msg.role, 'content': msg.content} for msg in reversed(recent)]
+    history_cache.set(session_id, conversation.id, history, total_count, conversation.summary, conversation.summarized_message_count or 0,
+                      recent[0].id if recent else None)
+    return history_cache.get(session_id)
+
+def _is_cache_current(cached):
+    """以一次查詢比對資料庫中該對話的訊息數、最後一則訊息的 id 與摘要涵蓋數 (messages.conversation_id 有索引)"""
+    messages = Message.query.filter(Message.conversation_id == cached['conversation_id'])
+    row = db.session.query(Conversation.is_active, Conversation.summarized_message_count,
+                           messages.with_entities(db.func.count(Message.id)).scalar_subquery(), messages.with_entities(db.func.max(Message.id)).scalar_subquery()
+                           ).filter(Conversation.id == cached['conversation_id']).first()
+    return (row is not None and bool(row[0]) and (row[1] or 0) == cached['summarized_count']
+            and row[2] == cached['total_count'] and row[3] == cached['last_message_id'])
+
+def _session_context(session):
+    """回傳 (conversation_id, 未摘要的對話歷史, 摘要)"""
+    if session is None: return None, [], None
+    return session['conversation_id'], SessionHistoryCache.unsummarized_messages(session), session['summary']
+
+def _ensure_conversation(conversation_id, session_id):
+    """
+    沿用既有對話，或建立新對話；回傳 (conversation_id, session_id, 是否為新對話)。
+    用戶端送來資料庫中不存在的 session_id (例如資料庫重置後 localStorage 裡的舊 ID) 時，以該 ID 建立對話，後續請求才接得上歷史。
+    同一個新 session_id 的兩個並發請求可能同時建立對話，較晚的一方違反唯一約束時改用已建立的對話。
+    """
+    if conversation_id: return conversation_id, session_id, False
+    reuse_id = session_id and not Conversation.query.filter_by(session_id=session_id).first()
+    conversation = Conversation(session_id=session_id) if reuse_id else Conversation(); db.session.add(conversation)
+    try:
+        db.session.flush()
+    except IntegrityError:
+        db.session.rollback()
+        existing = Conversation.query.filter_by(session_id=session_id).first()
+        if existing is None: raise
+        logger.info(f"對話 {session_id} 已由並發請求建立，沿用該對話")
+        return existing.id, existing.session_id, False
+    return conversation.id, conversation.session_id, True
+
+def _save_turn(conversation_id, session_id, user_message, llm_result):
+    """把一輪問答 (用戶訊息 + 助手回答) 在同一個交易寫入資料庫並更新 history_cache，回傳對話的 session_id"""
+    conversation_id, session_id, is_new_conversation = _ensure_conversation(conversation_id, session_id)
+    user_msg = Message(conversation_id=conversation_id, role='user', content=user_message); db.session.add(user_msg)
+    assistant_msg = Message(conversation_id=conversation_id, role='assistant', content=llm_result['response']); assistant_msg.set_metadata(llm_result); db.session.add(assistant_msg)
+    db.session.commit()
+    _remember_messages(session_id, conversation_id, [{'role': 'user', 'content': user_message}, {'role': 'assistant', 'content': llm_result['response']}], is_new_conversation, assistant_msg.id)
+    return session_id
+
+def _remember_messages(session_id, conversation_id, messages, is_new_conversation, last_message_id):
+    """訊息提交到資料庫後同步更新 history_cache (last_message_id 為最後一則寫入訊息的 id)，並視需要排程背景摘要"""
+    if is_new_conversation: history_cache.set(session_id, conversation_id, messages, last_message_id=last_message_id)
+    else: history_cache.append(session_id, messages, last_message_id)
+    _schedule_summary(session_id)
+
+def _schedule_summary(session_id):
+    session = history_cache.get(session_id)
+    if session is None or session['total_count'] - session['summarized_count'] <= SUMMARY_TRIGGER_MESSAGES: return
+    with _summaries_lock:
+        if session_id in _summaries_in_progress: return
+        _summaries_in_progress.add(session_id)
+    summary_executor.submit(_summarize_conversation, session_id, session['conversation_id'])
+
+def _summarize_conversation(session_id, conversation_id):
+    """背景工作: 把最近 SUMMARY_KEEP_RECENT 則以外的未摘要訊息併入 Conversation.summary"""
+    try:
+        with app.app_context():
+            conversation = db.session.get(Conversation, conversation_id)
+            if not conversation: return
+            summarized_count = conversation.summarized_message_count or 0
+            total_count = Message.query.filter_by(conversation_id=conversation_id).count()
+            to_fold = total_count - summarized_count - SUMMARY_KEEP_RECENT
+            if to_fold <= 0: return
+            messages = Message.query.filter_by(conversation_id=conversation_id).order_by(Message.id).offset(summarized_count).limit(to_fold).all()
+            summary = llm_service.summarize_conversation(conversation.summary, [{'role': m.role, 'content': m.content} for m in messages])
+            if not summary: return
+            conversation.summary = summary
+            conversation.summarized_message_count = summarized_count + len(messages)
+            db.session.commit()
+            history_cache.update_summary(session_id, summary, conversation.summarized_message_count)
+            logger.info(f"對話 {session_id} 已更新摘要 (涵蓋 {conversation.summarized_message_count} 則訊息)")
+    except Exception as e:
+        logger.error(f"更新對話摘要失敗: {e}", exc_info=True)
+    finally:
+        with _summaries_lock: _summaries_in_progress.discard(session_id)
+
+def _admission_rejected_response(e):
+    """生成佇列已滿 (429) 或排隊逾時 (503)，附上 Retry-After 讓用戶端退避"""
+    response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+    response.status_code = e.status_code
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+def _single_answer_events(result):
+    """把一次產生的完整回答 (例如天氣快速回答) 包裝成與 LLMService.stream_response 相同的事件序列"""
+    yield {'type': 'admitted'}
+    yield {'type': 'token', 'content': result['response']}
+    yield {'type': 'done', 'result': result}
+
+def _sse_event(payload):
+    """將字典編碼為一筆 Server-Sent Events 資料"""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
 
 # --- 核心聊天 API ---
 @app.route('/api/chat', methods=['POST'])
@@ -84,45 +227,172 @@ def chat():
         if not data: return jsonify({'error': '無效的 JSON 資料'}), 400
         user_message = data.get('message', '').strip()
         session_id = data.get('session_id')
-        conversation_history = data.get('conversation_history', [])
         if not user_message: return jsonify({'error': '訊息不能為空'}), 400
         
-        conversation = None
-        if session_id: conversation = Conversation.query.filter_by(session_id=session_id, is_active=True).first()
-        if not conversation: conversation = Conversation(); db.session.add(conversation); db.session.flush()
-        
-        user_msg = Message(conversation_id=conversation.id, role='user', content=user_message); db.session.add(user_msg)
+        # 對話歷史由後端依 session_id 組裝，不再信任用戶端傳來的 conversation_history
+        conversation_id, conversation_history, conversation_summary = _session_context(_load_session(session_id))
+        use_rag_static, use_rag_dynamic = _detect_rag_intent(user_message)
+        query_for_rag = user_message
         
-        # 智慧判斷
-        weather_keywords = ['天氣', '氣溫', '下雨', '預報', '颱風', '濕度', '氣壓']; is_weather_question = any(keyword in user_message for keyword in weather_keywords)
-        use_rag_static = True; use_rag_dynamic = False; query_for_rag = user_message
-
-        if is_weather_question:
-            use_rag_dynamic = True
-            if len(user_message) < 20: use_rag_static = False
-        
-        logger.info(f"查詢意圖: 靜態庫-{'啟用' if use_rag_static else '停用'}, 動態庫-{'啟用' if use_rag_dynamic else '停用'}")
-        
-        llm_result = llm_service.generate_response(
+        # 先生成再寫入資料庫: 避免在整個生成期間持有 SQLite 寫入鎖而使並發請求互相阻塞
+        llm_result = weather_fast_path.try_answer(user_message) or llm_service.generate_response(
             user_query=query_for_rag, 
             conversation_history=conversation_history,
+            conversation_summary=conversation_summary,
             use_rag_static=use_rag_static,
-            use_rag_dynamic=use_rag_dynamic
+            use_rag_dynamic=use_rag_dynamic,
+            rag_filter=_rag_filter(user_message, use_rag_dynamic)
         )
         
-        assistant_msg = Message(conversation_id=conversation.id, role='assistant', content=llm_result['response']); assistant_msg.set_metadata(llm_result); db.session.add(assistant_msg)
-        db.session.commit()
+        session_id = _save_turn(conversation_id, session_id, user_message, llm_result)
         
-        llm_result['session_id'] = conversation.session_id
+        llm_result['session_id'] = session_id
         return jsonify(llm_result)
         
+    except AdmissionRejectedError as e:
+        db.session.rollback(); logger.warning(f"聊天請求未被准入: {e}")
+        return _admission_rejected_response(e)
     except Exception as e:
         db.session.rollback(); logger.error(f"聊天 API 錯誤: {e}", exc_info=True)
         return jsonify({'error': f'處理請求時發生錯誤: {e}'}), 500
 
+# --- 串流聊天 API (Server-Sent Events) ---
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """
+    與 /api/chat 相同的請求格式，但以 text/event-stream 逐 token 回傳。
+    事件依序為: session -> token (多筆) -> done。用戶與助手訊息在生成結束後一起寫入資料庫，done 事件在寫入後才送出；
+    用戶端中途斷線時仍寫入兩則訊息，助手訊息為已產生的部分回答，metadata 標記 incomplete。
+    生成佇列已滿或排隊逾時時，與 /api/chat 相同回傳 429/503 與 Retry-After。
+    """
+    try:
+        data = request.get_json()
+        if not data: return jsonify({'error': '無效的 JSON 資料'}), 400
+        user_message = data.get('message', '').strip()
+        session_id = data.get('session_id')
+        if not user_message: return jsonify({'error': '訊息不能為空'}), 400
+
+        conversation_id, conversation_history, conversation_summary = _session_context(_load_session(session_id))
+        use_rag_static, use_rag_dynamic = _detect_rag_intent(user_message)
+        fast_result = weather_fast_path.try_answer(user_message)
+        events = _single_answer_events(fast_result) if fast_result else llm_service.stream_response(
+            user_query=user_message,
+            conversation_history=conversation_history,
+            conversation_summary=conversation_summary,
+            use_rag_static=use_rag_static,
+            use_rag_dynamic=use_rag_dynamic,
+            rag_filter=_rag_filter(user_message, use_rag_dynamic)
+        )
+        # 先取第一個事件: 完成檢索與准入判斷，未被准入時仍可回傳 429/503 而非開始串流
+        first_event = next(events)
+        # 對話在生成結束後才建立，先決定回傳給用戶端的 session_id (與 _ensure_conversation 建立對話時使用的相同)
+        if not conversation_id and (not session_id or Conversation.query.filter_by(session_id=session_id).first()): session_id = str(uuid.uuid4())
+    except AdmissionRejectedError as e:
+        db.session.rollback(); logger.warning(f"串流聊天請求未被准入: {e}")
+        return _admission_rejected_response(e)
+    except Exception as e:
+        db.session.rollback(); logger.error(f"串流聊天 API 錯誤: {e}", exc_info=True)
+        if 'events' in locals(): events.close() # 歸還已取得的生成名額
+        return jsonify({'error': f'處理請求時發生錯誤: {e}'}), 500
+
+    def generate():
+        llm_result = None; tokens = []
+        try:
+            yield _sse_event({'type': 'session', 'session_id': session_id})
+            for event in itertools.chain([first_event], events):
+                if event['type'] == 'token':
+                    tokens.append(event['content'])
+                    yield _sse_event(event)
+                elif event['type'] == 'done':
+                    llm_result = event['result']
+        finally:
+            # 用戶端斷線時 (GeneratorExit) 也會執行: 對話中不會留下沒有回覆的用戶訊息
+            events.close()
+            if llm_result is None:
+                logger.warning(f"串流在完成前中斷，保存部分回答 ({len(tokens)} 個 token)")
+                llm_result = {'response': ''.join(tokens).strip(), 'incomplete': True}
+            try:
+                _save_turn(conversation_id, session_id, user_message, llm_result)
+            except Exception as e:
+                db.session.rollback(); logger.error(f"儲存串流回應失敗: {e}", exc_info=True)
+                history_cache.invalidate(session_id)
+                llm_result['error'] = f'儲存回應時發生錯誤: {e}'
+        llm_result['session_id'] = session_id
+        yield _sse_event({'type': 'done', 'result': llm_result})
+
+    response = Response(stream_with_context(generate()), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# --- 批次問答 API (離線評估用，JSONL 進、JSONL 出) ---
+BATCH_MAX_CONCURRENCY = 16
+
+@app.route('/api/chat/batch', methods=['POST'])
+def chat_batch():
+    """
+    請求本體為 JSONL，每行一筆 {"message", "id"?, "use_rag_static"?, "use_rag_dynamic"?, "conversation_history"?}；
+    未指定 use_rag_* 時與 /api/chat 相同依問題內容判斷。
+    查詢參數: concurrency (同時生成筆數，預設 4)、create_conversations (預設 false，為 true 時每筆各自建立一個對話)。
+    以 application/x-ndjson 依完成順序串流回傳每筆結果，附 index/id 與 timings (retrieval_ms、generation_ms、total_ms)。
+    """
+    items = []
+    for line_no, line in enumerate(request.get_data(as_text=True).splitlines(), 1):
+        if not line.strip(): continue
+        try: entry = json.loads(line)
+        except ValueError: return jsonify({'error': f'第 {line_no} 行不是有效的 JSON'}), 400
+        message = (entry.get('message') or '').strip() if isinstance(entry, dict) else ''
+        if not message: return jsonify({'error': f'第 {line_no} 行缺少 message'}), 400
+        use_rag_static, use_rag_dynamic = _detect_rag_intent(message)
+        use_rag_static, use_rag_dynamic = entry.get('use_rag_static', use_rag_static), entry.get('use_rag_dynamic', use_rag_dynamic)
+        items.append({
+            'id': entry.get('id'), 'query': message, 'conversation_history': entry.get('conversation_history'),
+            'use_rag_static': use_rag_static, 'use_rag_dynamic': use_rag_dynamic, 'rag_filter': _rag_filter(message, use_rag_dynamic)
+        })
+    if not items: return jsonify({'error': '沒有任何查詢'}), 400
+    concurrency = max(1, min(request.args.get('concurrency', 4, type=int), BATCH_MAX_CONCURRENCY, llm_service.generation_queue.max_queue_size))
+    create_conversations = request.args.get('create_conversations', 'false').lower() in ('1', 'true', 'yes')
+    logger.info(f"批次問答: {len(items)} 筆，並行 {concurrency}，建立對話: {create_conversations}")
+
+    def generate():
+        results = llm_service.generate_batch(items, max_concurrency=concurrency)
+        try:
+            for outcome in results:
+                item, llm_result = items[outcome['index']], outcome['result']
+                record = {'index': outcome['index'], 'id': item['id'], 'message': item['query'], 'timings': outcome['timings']}
+                record.update({key: llm_result.get(key) for key in ('response', 'rag_used', 'sources', 'rag_scores', 'cache_hit', 'coalesced', 'prompt_tokens', 'error') if key in llm_result})
+                if create_conversations and not llm_result.get('error'):
+                    try:
+                        conversation = Conversation(); db.session.add(conversation); db.session.flush()
+                        db.session.add(Message(conversation_id=conversation.id, role='user', content=item['query']))
+                        assistant_msg = Message(conversation_id=conversation.id, role='assistant', content=llm_result['response']); assistant_msg.set_metadata(llm_result); db.session.add(assistant_msg)
+                        db.session.commit()
+                        record['session_id'] = conversation.session_id
+                    except Exception as e:
+                        db.session.rollback(); logger.error(f"儲存批次對話失敗: {e}", exc_info=True)
+                        record['error'] = f'儲存對話時發生錯誤: {e}'
+                yield json.dumps(record, ensure_ascii=False) + "\n"
+        finally:
+            results.close()
+
+    response = Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 # --- 所有其他 API 端點 ---
 @app.route('/api/status')
 def get_status(): return jsonify({'success': True, 'message': 'LLM Backend Service is running.'})
+@app.route('/api/llm/status')
+def get_llm_status():
+    try: return jsonify(llm_service.get_service_status())
+    except Exception as e: return jsonify({'error': str(e)}), 500
+@app.route('/api/llm/metrics')
+def get_llm_metrics():
+    try:
+        metrics = llm_service.get_metrics()
+        metrics['session_history_cache'] = history_cache.get_stats()
+        return jsonify(metrics)
+    except Exception as e: return jsonify({'error': str(e)}), 500
 @app.route('/api/conversations', methods=['GET'])
 def get_conversations():
     try:
@@ -131,7 +401,17 @@ def get_conversations():
     except Exception as e: return jsonify({'error': str(e)}), 500
 
 # --- 啟動與初始化 ---
+def _migrate_schema():
+    """為既有的 SQLite 資料庫補上新欄位 (db.create_all 不會修改已存在的資料表)"""
+    columns = {column['name'] for column in db.inspect(db.engine).get_columns('conversations')}
+    with db.engine.begin() as conn:
+        if 'summary' not in columns: conn.execute(db.text("ALTER TABLE conversations ADD COLUMN summary TEXT"))
+        if 'summarized_message_count' not in columns: conn.execute(db.text("ALTER TABLE conversations ADD COLUMN summarized_message_count INTEGER NOT NULL DEFAULT 0"))
+        # 讀取 history_cache 時以 conversation_id 查詢最後一則訊息
+        conn.execute(db.text("CREATE INDEX IF NOT EXISTS ix_messages_conversation_id ON messages (conversation_id)"))
+
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        _migrate_schema()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,64 @@
+# C:\llm_service\backend\batch_chat.py
+# 批次問答命令列工具: 把 JSONL 查詢檔送到 /api/chat/batch，結果逐行寫入輸出檔
+# 用法: python batch_chat.py questions.jsonl -o results.jsonl --concurrency 8
+# 輸入每行 {"message": "...", "id": "..."}；也接受每行一個純文字問題
+
+import argparse
+import json
+import sys
+import time
+
+import requests
+
+BASE_URL = "http://localhost:5000/api"
+
+
+def read_queries(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            if line.startswith('{'): yield line
+            else: yield json.dumps({"message": line}, ensure_ascii=False)
+
+
+def percentile(values, pct):
+    if not values: return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批次問答 (呼叫 /api/chat/batch)")
+    parser.add_argument("input", help="JSONL 查詢檔")
+    parser.add_argument("-o", "--output", help="結果 JSONL 檔 (預設輸出到 stdout)")
+    parser.add_argument("--url", default=BASE_URL, help=f"API 位址 (預設 {BASE_URL})")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時生成筆數")
+    parser.add_argument("--create-conversations", action="store_true", help="為每筆查詢建立對話記錄")
+    args = parser.parse_args()
+
+    body = "\n".join(read_queries(args.input)).encode('utf-8')
+    params = {"concurrency": args.concurrency, "create_conversations": str(args.create_conversations).lower()}
+    out = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    started = time.time(); totals = []; errors = 0
+    try:
+        with requests.post(f"{args.url}/chat/batch", data=body, params=params, headers={"Content-Type": "application/x-ndjson"}, stream=True, timeout=(5, None)) as response:
+            if response.status_code != 200:
+                print(f"[FAIL] 批次請求失敗: {response.status_code} - {response.text}", file=sys.stderr); return 1
+            for line in response.iter_lines(decode_unicode=True):
+                if not line: continue
+                out.write(line + "\n"); out.flush()
+                record = json.loads(line)
+                totals.append(record["timings"]["total_ms"])
+                if record.get("error"): errors += 1
+    finally:
+        if out is not sys.stdout: out.close()
+
+    elapsed = time.time() - started
+    print(f"[OK] 完成 {len(totals)} 筆 (錯誤 {errors} 筆)，耗時 {elapsed:.1f} 秒，"
+          f"每筆 p50 {percentile(totals, 50):.0f} ms / p95 {percentile(totals, 95):.0f} ms", file=sys.stderr)
+    return 0 if not errors else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
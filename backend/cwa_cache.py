@@ -0,0 +1,109 @@
+# C:\llm_service\backend\cwa_cache.py
+# 中央氣象署 API 的本地回應快取: 每個 (資料集, 查詢參數) 一個 JSON 檔，TTL 內直接使用，過期後以 ETag / Last-Modified 條件式請求重新驗證；
+# replay 模式只讀取錄製好的檔案、完全不連網，供測試與效能量測使用
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+import requests
+
+logger = logging.getLogger(__name__)
+
+CACHE_MODES = ("live", "replay")
+
+
+class CWAResponseCache:
+    """
+    - ttls: 資料集代碼 -> 秒數 (未列出的資料集用 default_ttl)；預報每 6 小時發布一次、觀測約每 10 分鐘更新一次
+    - stale_if_error: API 失敗或逾時時，仍可使用不超過這個秒數的舊回應 (撐過 CWA 短暫中斷)
+    - mode="replay": 只讀取 cache_dir 中的檔案 (live 模式寫出的檔案即可直接當作錄製資料)，找不到時回傳 None
+    快取鍵不含 Authorization，錄製的檔案不會帶有 API Key。
+    """
+
+    def __init__(self, cache_dir: str, ttls: Optional[Dict[str, int]] = None, default_ttl: int = 600,
+                 stale_if_error: int = 6 * 3600, mode: str = "live"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"不支援的快取模式: {mode} (可用: {', '.join(CACHE_MODES)})")
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.stale_if_error = stale_if_error
+        self.mode = mode
+        self._lock = threading.Lock()
+        self.stats = {"fresh_hits": 0, "revalidated": 0, "fetched": 0, "stale_served": 0, "replayed": 0, "misses": 0}
+
+    def _path(self, endpoint: str, params: Dict[str, str]) -> Path:
+        query = json.dumps({k: v for k, v in sorted(params.items()) if k != "Authorization"}, ensure_ascii=False)
+        return self.cache_dir / f"{endpoint}.{hashlib.sha256(query.encode('utf-8')).hexdigest()[:16]}.json"
+
+    def _read(self, path: Path) -> Optional[Dict[str, Any]]:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, path: Path, entry: Dict[str, Any]):
+        tmp_path = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+    def fetch(self, endpoint: str, params: Dict[str, str], request: Callable[[Dict[str, str]], requests.Response],
+              is_valid: Callable[[dict], bool]) -> Optional[dict]:
+        """
+        取得 endpoint 的 JSON 回應。request(headers) 負責實際發送請求 (附上條件式標頭)，is_valid(data) 判斷回應內容是否可用。
+        依序: replay 檔案 -> TTL 內的快取 -> 條件式請求 (304 沿用快取) -> 失敗時 stale_if_error 內的舊回應。
+        """
+        path = self._path(endpoint, params)
+        entry = self._read(path)
+
+        if self.mode == "replay":
+            self._count("replayed" if entry else "misses")
+            if not entry: logger.warning(f"[replay] 找不到錄製的回應: {path.name}")
+            return entry["data"] if entry else None
+
+        age = time.time() - entry["fetched_at"] if entry else None
+        if entry and age < self.ttls.get(endpoint, self.default_ttl):
+            self._count("fresh_hits")
+            return entry["data"]
+
+        headers = {}
+        if entry and entry.get("etag"): headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"): headers["If-Modified-Since"] = entry["last_modified"]
+        try:
+            response = request(headers)
+            if response.status_code == 304 and entry:
+                entry["fetched_at"] = time.time()
+                self._write(path, entry)
+                self._count("revalidated")
+                logger.info(f"API ({endpoint}) 資料未變更 (304)，沿用本地快取。")
+                return entry["data"]
+            response.raise_for_status()
+            data = response.json()
+            if not is_valid(data):
+                raise ValueError("回應內容無效 (success != true)")
+        except (requests.RequestException, ValueError) as e:
+            if entry and age < self.stale_if_error:
+                self._count("stale_served")
+                logger.warning(f"API ({endpoint}) 請求失敗 ({e})，改用 {age / 60:.0f} 分鐘前的本地快取。")
+                return entry["data"]
+            self._count("misses")
+            logger.error(f"API ({endpoint}) 請求失敗: {e}")
+            return None
+
+        self._write(path, {"endpoint": endpoint, "fetched_at": time.time(), "etag": response.headers.get("ETag"),
+                           "last_modified": response.headers.get("Last-Modified"), "data": data})
+        self._count("fetched")
+        return data
@@ -0,0 +1,89 @@
+# C:\llm_service\backend\history_cache.py
+# 活躍對話的最近訊息快取: 以 session_id 為鍵的有界 LRU，寫入資料庫後同步更新
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional
+
+
+class SessionHistoryCache:
+    """
+    每個 session 快取其 conversation_id、最近 max_messages 則訊息 ({"role", "content"})、
+    訊息總數、最後一則訊息的 id 與滾動摘要，最多快取 max_sessions 個 session。
+    - get: 回傳快取項目的副本；未快取時回傳 None，由呼叫端從資料庫載入後呼叫 set
+    - append / update_summary: 寫入資料庫後呼叫 (write-through)，熱門 session 因此不必重新載入訊息
+    快取只存在於單一行程: 多個 worker 時其他 worker 可能已寫入新訊息，呼叫端應以 last_message_id 與
+    summarized_count 向資料庫確認項目仍是最新 (一次查詢)，不一致時重新載入。
+    """
+
+    def __init__(self, max_sessions: int = 256, max_messages: int = 20):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self._sessions: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0}
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            self._stats["hits"] += 1
+            return dict(entry, messages=list(entry["messages"]))
+
+    def set(self, session_id: str, conversation_id: int, messages: List[Dict[str, str]], total_count: Optional[int] = None,
+            summary: Optional[str] = None, summarized_count: int = 0, last_message_id: Optional[int] = None):
+        with self._lock:
+            self._sessions[session_id] = {
+                "conversation_id": conversation_id,
+                "messages": [self._slim(m) for m in messages][-self.max_messages:],
+                "total_count": len(messages) if total_count is None else total_count,
+                "summary": summary,
+                "summarized_count": summarized_count,
+                "last_message_id": last_message_id,
+            }
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def append(self, session_id: str, messages: List[Dict[str, str]], last_message_id: Optional[int] = None):
+        """追加新訊息；session 未在快取中時不做事 (下次讀取會從資料庫完整載入)"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return
+            cached = entry["messages"]
+            cached.extend(self._slim(m) for m in messages)
+            del cached[:-self.max_messages]
+            entry["total_count"] += len(messages)
+            entry["last_message_id"] = last_message_id
+            self._sessions.move_to_end(session_id)
+
+    def update_summary(self, session_id: str, summary: str, summarized_count: int):
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                entry["summary"] = summary
+                entry["summarized_count"] = summarized_count
+
+    def invalidate(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["sessions"] = len(self._sessions)
+        return stats
+
+    @staticmethod
+    def unsummarized_messages(entry: Dict[str, Any]) -> List[Dict[str, str]]:
+        """尚未被摘要涵蓋的最近訊息"""
+        pending = entry["total_count"] - entry["summarized_count"]
+        return entry["messages"][-pending:] if pending > 0 else []
+
+    @staticmethod
+    def _slim(message: Dict[str, Any]) -> Dict[str, str]:
+        return {"role": message.get("role"), "content": message.get("content", "")}
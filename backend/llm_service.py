@@ -1,26 +1,82 @@
 # C:\llm_service\backend\llm_service.py
 # 版本: vFinal 3.6 - 加入回答後處理
 
-import requests
 import json
+import time
 import logging
-from typing import Dict, Any, Optional
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Dict, Any, Optional, Iterator, List
 import sys
 import os
 
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'rag_system', 'scripts'))
 from rag_service import RAGService
+from ollama_client import OllamaBackendPool, CircuitBreakerOpenError, NoHealthyBackendError
+from response_cache import ResponseCache, normalize_query, fingerprint
+from single_flight import SingleFlight
+from admission_control import GenerationQueue, AdmissionRejectedError, PRIORITY_INTERACTIVE, PRIORITY_BATCH
+from prompt_builder import TokenCounter, PromptBuilder
 
 class LLMService:
     def __init__(self, 
                  ollama_url: str = "http://localhost:11434",
+                 ollama_urls: Optional[List[str]] = None,
                  model_name: str = "llama3.1:8b",
-                 rag_enabled: bool = True):
-        self.ollama_url = ollama_url
+                 rag_enabled: bool = True,
+                 connect_timeout: float = 3.05,
+                 read_timeout: float = 120.0,
+                 max_retries: int = 2,
+                 pool_maxsize: int = 16,
+                 health_check_interval: float = 10.0,
+                 cache_enabled: bool = True,
+                 cache_max_entries: int = 1000,
+                 cache_ttl: float = 3600,
+                 cache_db_path: Optional[str] = None,
+                 max_concurrency_per_backend: int = 2,
+                 max_queue_size: int = 32,
+                 queue_timeouts: Optional[Dict[str, float]] = None,
+                 tokenizer_name: Optional[str] = None,
+                 context_window: int = 4096,
+                 response_reserve: int = 1024,
+                 context_share: float = 0.7,
+                 max_history_messages: int = 10):
+        # ollama_urls 提供多個後端時啟用負載平衡，否則只使用 ollama_url
+        self.ollama_urls = [url for url in (ollama_urls or []) if url] or [ollama_url]
+        self.ollama_url = self.ollama_urls[0]
         self.model_name = model_name
         self.rag_enabled = rag_enabled
         logging.basicConfig(level=logging.INFO)
         self.logger = logging.getLogger(__name__)
+        # 共用的後端池 (每個後端各自有連線池、重試與斷路器)
+        self.backend_pool = OllamaBackendPool(
+            self.ollama_urls,
+            health_check_interval=health_check_interval,
+            pool_maxsize=pool_maxsize,
+            connect_timeout=connect_timeout,
+            read_timeout=read_timeout,
+            max_retries=max_retries
+        )
+        # 准入控制: 同時生成數隨健康後端數調整，超出時依優先權排隊
+        self.generation_queue = GenerationQueue(
+            max_concurrency_per_backend=max_concurrency_per_backend,
+            backend_count_fn=self.backend_pool.healthy_count,
+            max_queue_size=max_queue_size,
+            queue_timeouts=queue_timeouts
+        )
+        # 回答快取 (cache_db_path 為 None 時只使用記憶體)
+        self.response_cache = ResponseCache(cache_max_entries, cache_ttl, cache_db_path) if cache_enabled else None
+        self._dynamic_version = None
+        # 合併相同的並發查詢，共用一次檢索與生成
+        self._inflight = SingleFlight()
+        # 依 token 預算組裝提示 (tokenizer_name 為 HuggingFace tokenizer 名稱，未設定時以估算方式計數)
+        self.context_window = context_window
+        self.prompt_builder = PromptBuilder(
+            TokenCounter(tokenizer_name),
+            context_window=context_window,
+            response_reserve=response_reserve,
+            context_share=context_share,
+            max_history_messages=max_history_messages
+        )
         if self.rag_enabled:
             try:
                 self.rag_service = RAGService()
@@ -31,74 +87,372 @@ class LLMService:
             self.rag_service = None
         self.logger.info(f"LLM 服務初始化完成 (RAG: {'啟用' if self.rag_enabled else '停用'})")
     
-    def call_ollama(self, prompt: str, system_prompt: str = None) -> Optional[str]:
+    def _ollama_options(self) -> Dict[str, Any]:
+        # num_ctx 與提示預算使用同一個 context_window，避免 Ollama 靜默截斷提示
+        return { "temperature": 0.7, "top_p": 0.9, "top_k": 40, "num_ctx": self.context_window }
+
+    @staticmethod
+    def _collect_stats(chunk: Dict[str, Any], stats: Optional[Dict[str, Any]]):
+        if stats is not None:
+            for key in ("prompt_eval_count", "eval_count", "total_duration", "prompt_eval_duration"):
+                if key in chunk: stats[key] = chunk[key]
+
+    def call_ollama(self, prompt: str, system_prompt: str = None, stats: Optional[Dict[str, Any]] = None) -> Optional[str]:
+        """stats 不為 None 時會填入 Ollama 回報的 prompt_eval_count / eval_count 等統計"""
         try:
-            data = { "model": self.model_name, "prompt": prompt, "stream": False, "options": { "temperature": 0.7, "top_p": 0.9, "top_k": 40 } }
+            data = { "model": self.model_name, "prompt": prompt, "stream": False, "options": self._ollama_options() }
             if system_prompt: data["system"] = system_prompt
-            response = requests.post(f"{self.ollama_url}/api/generate", json=data, timeout=60)
-            if response.status_code == 200: return response.json().get("response", "")
+            response = self.backend_pool.post("/api/generate", json=data)
+            if response.status_code == 200:
+                body = response.json(); self._collect_stats(body, stats)
+                return body.get("response", "")
             else: self.logger.error(f"Ollama API 錯誤: {response.status_code} - {response.text}"); return None
+        except (CircuitBreakerOpenError, NoHealthyBackendError) as e: self.logger.warning(str(e)); return None
         except Exception as e: self.logger.error(f"呼叫 Ollama API 失敗: {str(e)}"); return None
 
-    def generate_response(self, user_query: str, conversation_history: list = None, use_rag_static: bool = True, use_rag_dynamic: bool = False) -> Dict[str, Any]:
-        try:
-            self.logger.info(f"處理查詢: '{user_query}' (靜態RAG: {use_rag_static}, 動態RAG: {use_rag_dynamic})")
-            
-            result = { "response": "", "user_query": user_query, "rag_used": False, "rag_context": "", "sources": [] }
-            
-            rag_context = ""
-            use_any_rag = use_rag_static or use_rag_dynamic
-            
-            if self.rag_enabled and self.rag_service and use_any_rag:
+    def call_ollama_stream(self, prompt: str, system_prompt: str = None, stats: Optional[Dict[str, Any]] = None) -> Iterator[str]:
+        """以串流模式呼叫 Ollama，逐段產出 token 文字"""
+        data = { "model": self.model_name, "prompt": prompt, "stream": True, "options": self._ollama_options() }
+        if system_prompt: data["system"] = system_prompt
+        with self.backend_pool.stream("/api/generate", json=data) as response:
+            if response.status_code != 200:
+                raise RuntimeError(f"Ollama API 錯誤: {response.status_code} - {response.text}")
+            for line in response.iter_lines():
+                if not line: continue
+                chunk = json.loads(line)
+                if chunk.get("error"): raise RuntimeError(f"Ollama 串流錯誤: {chunk['error']}")
+                token = chunk.get("response", "")
+                if token: yield token
+                if chunk.get("done"): self._collect_stats(chunk, stats); break
+
+    def _prepare_generation(self, user_query: str, conversation_history: list, use_rag_static: bool, use_rag_dynamic: bool, conversation_summary: Optional[str] = None, rag_result: Optional[Dict[str, Any]] = None, rag_filter: Optional[Dict[str, Any]] = None):
+        """
+        執行 RAG 檢索 (或使用呼叫端預先批次檢索的 rag_result) 並依 token 預算組裝提示，回傳 (result, prompt, system_prompt)。
+        rag_filter 為動態知識庫的 metadata 篩選，例如 {"city": "臺北市"}。
+        """
+        result = { "response": "", "user_query": user_query, "rag_used": False, "rag_context": "", "sources": [] }
+        
+        chunks = []
+        use_any_rag = use_rag_static or use_rag_dynamic
+        
+        if self.rag_enabled and self.rag_service and use_any_rag:
+            if rag_result is None:
                 rag_result = self.rag_service.query(
                     user_query, 
                     use_static=use_rag_static,
-                    use_dynamic=use_rag_dynamic
+                    use_dynamic=use_rag_dynamic,
+                    metadata_filter=rag_filter
                 )
-                if rag_result.get("has_context"):
-                    rag_context = rag_result["context"]
-                    result["rag_used"] = True
-                    result["rag_context"] = rag_context
+            if rag_result.get("timings"): result["rag_timings"] = rag_result["timings"]
+            if rag_result.get("has_context"):
+                chunks = rag_result.get("chunks", [])
+        
+        if chunks:
+            system_prompt = "你是一個有用的AI助理。請根據以下提供的「背景資料」來回答用戶的問題。這些資料比你的內部知識更新，請優先使用。"
+            selected = {}
+            def render(selected_chunks, history):
+                selected["chunks"] = selected_chunks
+                return self._build_rag_prompt(user_query, RAGService.format_context(selected_chunks), history, conversation_summary)
+            prompt, report = self.prompt_builder.build(system_prompt, chunks, conversation_history, render)
+            used_chunks = selected["chunks"]
+            if used_chunks:
+                result["rag_used"] = True
+                result["rag_context"] = RAGService.format_context(used_chunks)
+                result["sources"] = list(dict.fromkeys(c["source"] for c in used_chunks if c.get("source")))
+                # 實際放進提示的片段與其檢索分數 (score 為向量距離，similarity 為餘弦相似度)
+                result["rag_scores"] = [{key: c.get(key) for key in ("collection", "source", "score", "similarity", "rrf_score", "bm25_score")} for c in used_chunks]
+        else:
+            system_prompt = "你是一個有用的AI助理。請用繁體中文回答用戶的問題。"
+            prompt, report = self.prompt_builder.build(
+                system_prompt, [], conversation_history, lambda _, history: self._build_simple_prompt(user_query, history, conversation_summary)
+            )
+        result["prompt_tokens"] = report
+        return result, prompt, system_prompt
+
+    def _current_dynamic_version(self) -> Optional[str]:
+        """取得動態知識庫版本；偵測到版本變更時主動清除舊的動態快取"""
+        if not (self.rag_enabled and self.rag_service): return None
+        version = self.rag_service.get_dynamic_version()
+        if version != self._dynamic_version:
+            if self._dynamic_version is not None and self.response_cache:
+                self.response_cache.invalidate_dynamic(version)
+            self._dynamic_version = version
+        return version
+
+    @staticmethod
+    def _history_for_key(conversation_history: list, conversation_summary: Optional[str]) -> list:
+        """快取與請求合併的鍵: 摘要也會影響回答，視為一則特殊的歷史訊息"""
+        history = list(conversation_history or [])
+        return [{"role": "summary", "content": conversation_summary}] + history if conversation_summary else history
+
+    def _cache_lookup(self, result: Dict[str, Any], conversation_history: list, use_rag_dynamic: bool):
+        """回傳 (cache_key, dynamic_version, 快取內容或 None)；conversation_history 須已含摘要 (見 _history_for_key)"""
+        if not self.response_cache: return None, None, None
+        cache_key = ResponseCache.make_key(result["user_query"], result["rag_context"], self.model_name, conversation_history)
+        dynamic_version = self._current_dynamic_version() if use_rag_dynamic else None
+        return cache_key, dynamic_version, self.response_cache.get(cache_key, dynamic_version)
+
+    def _cache_store(self, cache_key: str, dynamic_version: Optional[str], result: Dict[str, Any], use_rag_dynamic: bool):
+        if not (self.response_cache and cache_key): return
+        uses_dynamic = use_rag_dynamic and result["rag_used"]
+        self.response_cache.set(cache_key, {"response": result["response"]}, uses_dynamic=uses_dynamic, dynamic_version=dynamic_version)
+
+    def _flight_key(self, user_query: str, conversation_history: list, use_rag_static: bool, use_rag_dynamic: bool, conversation_summary: Optional[str], rag_filter: Optional[Dict[str, Any]]) -> str:
+        # 相同查詢、RAG 設定、篩選條件與對話歷史的並發請求共用一次檢索與生成
+        return "|".join([
+            normalize_query(user_query), str(use_rag_static), str(use_rag_dynamic), json.dumps(rag_filter, ensure_ascii=False, sort_keys=True),
+            fingerprint(json.dumps(self._history_for_key(conversation_history, conversation_summary), ensure_ascii=False, sort_keys=True))
+        ])
+
+    def generate_response(self, user_query: str, conversation_history: list = None, use_rag_static: bool = True, use_rag_dynamic: bool = False, priority: str = PRIORITY_INTERACTIVE, conversation_summary: Optional[str] = None, rag_result: Optional[Dict[str, Any]] = None, rag_filter: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        生成回答；生成佇列已滿或排隊逾時會拋出 AdmissionRejectedError，由 API 層轉為 429/503。
+        conversation_summary 為較早對話的滾動摘要，conversation_history 只需包含摘要之後的訊息。
+        rag_result 為預先檢索好的 RAGService.query() 結果 (批次處理時使用)，為 None 時即時檢索 (動態庫依 rag_filter 篩選)。
+        """
+        result, shared = self._inflight.do(
+            self._flight_key(user_query, conversation_history, use_rag_static, use_rag_dynamic, conversation_summary, rag_filter), lambda: self._generate_response(user_query, conversation_history, use_rag_static, use_rag_dynamic, priority, conversation_summary, rag_result, rag_filter)
+        )
+        if shared:
+            self.logger.info(f"查詢 '{user_query}' 與進行中的相同請求合併")
+            result["user_query"] = user_query
+        result["coalesced"] = shared
+        return result
+
+    def _generate_response(self, user_query: str, conversation_history: list = None, use_rag_static: bool = True, use_rag_dynamic: bool = False, priority: str = PRIORITY_INTERACTIVE, conversation_summary: Optional[str] = None, rag_result: Optional[Dict[str, Any]] = None, rag_filter: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        try:
+            self.logger.info(f"處理查詢: '{user_query}' (靜態RAG: {use_rag_static}, 動態RAG: {use_rag_dynamic})")
             
-            if rag_context:
-                prompt = self._build_rag_prompt(user_query, rag_context, conversation_history)
-                system_prompt = "你是一個有用的AI助理。請根據以下提供的「背景資料」來回答用戶的問題。這些資料比你的內部知識更新，請優先使用。"
-            else:
-                prompt = self._build_simple_prompt(user_query, conversation_history)
-                system_prompt = "你是一個有用的AI助理。請用繁體中文回答用戶的問題。"
+            result, prompt, system_prompt = self._prepare_generation(user_query, conversation_history, use_rag_static, use_rag_dynamic, conversation_summary, rag_result, rag_filter)
+
+            cache_key, dynamic_version, cached = self._cache_lookup(result, self._history_for_key(conversation_history, conversation_summary), use_rag_dynamic)
+            if cached:
+                self.logger.info("回答快取命中")
+                result.update(response=cached["response"], cache_hit=True, cached_at=cached["cached_at"])
+                return result
+            result["cache_hit"] = False
             
-            llm_response = self.call_ollama(prompt, system_prompt)
+            ollama_stats = {}
+            with self.generation_queue.slot(priority):
+                llm_response = self.call_ollama(prompt, system_prompt, stats=ollama_stats)
+            result["prompt_tokens"]["ollama_prompt_eval_count"] = ollama_stats.get("prompt_eval_count")
             
             if llm_response:
                 # [核心修正] 對 LLM 的回答進行後處理，統一用字
                 processed_response = llm_response.strip().replace("臺", "台")
                 result["response"] = processed_response
+                self._cache_store(cache_key, dynamic_version, result, use_rag_dynamic)
             else:
                 result["response"] = "抱歉，處理請求時發生錯誤。"
             
             return result
+        except AdmissionRejectedError:
+            raise
         except Exception as e:
             self.logger.error(f"生成回應失敗: {e}", exc_info=True)
             return { "response": "抱歉，發生內部錯誤。", "error": str(e) }
 
-    def _build_rag_prompt(self, user_query: str, context: str, conversation_history: list = None) -> str:
+    def generate_batch(self, items: List[Dict[str, Any]], max_concurrency: int = 4, retrieval_batch_size: int = 32) -> Iterator[Dict[str, Any]]:
+        """
+        批次問答 (離線評估、大量問答用)。items 為 {"query", "use_rag_static", "use_rag_dynamic", "conversation_history"?, "rag_filter"?} 的清單。
+        每 retrieval_batch_size 筆做一次批次檢索 (查詢向量一次編碼)；生成以 batch 優先權排隊，最多 max_concurrency 筆並行。
+        依完成順序產出 {"index", "result", "timings"}，index 為該筆在 items 中的位置。
+        """
+        executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="batch-generation")
+        pending = set()
+        try:
+            for start in range(0, len(items), retrieval_batch_size):
+                group = items[start:start + retrieval_batch_size]
+                for offset, (rag_result, retrieval_ms) in enumerate(self._retrieve_batch(group)):
+                    # 限制已送出但未完成的筆數，讓結果邊生成邊回傳，也不會一次塞滿生成佇列
+                    while len(pending) >= max_concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done: yield future.result()
+                    pending.add(executor.submit(self._generate_batch_item, start + offset, group[offset], rag_result, retrieval_ms))
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done: yield future.result()
+        finally:
+            # 呼叫端中途停止讀取 (例如連線中斷) 時，不再開始尚未執行的項目
+            for future in pending: future.cancel()
+            executor.shutdown(wait=False)
+
+    def _retrieve_batch(self, group: List[Dict[str, Any]]) -> List[tuple]:
+        """依 (靜態, 動態) 組合分組做批次檢索，回傳每筆的 (rag_result, 分攤後的檢索毫秒數)"""
+        results = [(None, 0.0)] * len(group)
+        if not (self.rag_enabled and self.rag_service): return results
+        by_flags = {}
+        for i, item in enumerate(group):
+            if item["use_rag_static"] or item["use_rag_dynamic"]:
+                by_flags.setdefault((item["use_rag_static"], item["use_rag_dynamic"]), []).append(i)
+        for (use_static, use_dynamic), indices in by_flags.items():
+            started = time.perf_counter()
+            try:
+                rag_results = self.rag_service.query_batch([group[i]["query"] for i in indices], use_static=use_static, use_dynamic=use_dynamic,
+                                                           metadata_filters=[group[i].get("rag_filter") for i in indices])
+            except Exception as e:
+                # 批次檢索失敗時退回逐筆檢索 (rag_result 為 None)
+                self.logger.error(f"批次檢索失敗: {e}", exc_info=True)
+                continue
+            per_item_ms = (time.perf_counter() - started) * 1000 / len(indices)
+            for i, rag_result in zip(indices, rag_results):
+                results[i] = (rag_result, per_item_ms)
+        return results
+
+    def _generate_batch_item(self, index: int, item: Dict[str, Any], rag_result: Optional[Dict[str, Any]], retrieval_ms: float, max_attempts: int = 3) -> Dict[str, Any]:
+        started = time.perf_counter()
+        for attempt in range(max_attempts):
+            try:
+                result = self.generate_response(
+                    item["query"], item.get("conversation_history"), item["use_rag_static"], item["use_rag_dynamic"],
+                    priority=PRIORITY_BATCH, rag_result=rag_result, rag_filter=item.get("rag_filter")
+                )
+                break
+            except AdmissionRejectedError as e:
+                if attempt == max_attempts - 1:
+                    result = { "response": "", "user_query": item["query"], "error": str(e) }
+                    break
+                time.sleep(e.retry_after)
+        generation_ms = (time.perf_counter() - started) * 1000
+        timings = { "retrieval_ms": round(retrieval_ms, 1), "generation_ms": round(generation_ms, 1), "total_ms": round(retrieval_ms + generation_ms, 1) }
+        return { "index": index, "result": result, "timings": timings }
+
+    def stream_response(self, user_query: str, conversation_history: list = None, use_rag_static: bool = True, use_rag_dynamic: bool = False, priority: str = PRIORITY_INTERACTIVE, conversation_summary: Optional[str] = None, rag_filter: Optional[Dict[str, Any]] = None) -> Iterator[Dict[str, Any]]:
+        """
+        generate_response 的串流版本。
+        先產出 {"type": "admitted"} (取得生成名額或命中快取後)，接著依序產出 {"type": "token", "content": ...} 事件，
+        最後產出 {"type": "done", "result": {...}}，其中 result 與 generate_response 的回傳格式相同。
+        未被准入時，取第一個事件就會拋出 AdmissionRejectedError，呼叫端可在送出回應標頭前處理。
+        相同的並發串流只呼叫一次 Ollama，其餘請求訂閱同一串 token 事件 (result["coalesced"] 為 True)。
+        """
+        flight_key = self._flight_key(user_query, conversation_history, use_rag_static, use_rag_dynamic, conversation_summary, rag_filter)
+        events = self._inflight.stream(
+            flight_key, lambda: self._stream_response(user_query, conversation_history, use_rag_static, use_rag_dynamic, priority, conversation_summary, rag_filter)
+        )
+        try:
+            for event, shared in events:
+                if event["type"] == "done":
+                    # 事件同時發布給跟隨者，不直接修改原本的 result
+                    event = dict(event, result=dict(event["result"], coalesced=shared))
+                    if shared:
+                        self.logger.info(f"串流查詢 '{user_query}' 與進行中的相同請求合併")
+                        event["result"]["user_query"] = user_query
+                yield event
+        finally:
+            events.close()
+
+    def _stream_response(self, user_query: str, conversation_history: list, use_rag_static: bool, use_rag_dynamic: bool, priority: str, conversation_summary: Optional[str], rag_filter: Optional[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        try:
+            self.logger.info(f"處理串流查詢: '{user_query}' (靜態RAG: {use_rag_static}, 動態RAG: {use_rag_dynamic})")
+            result, prompt, system_prompt = self._prepare_generation(user_query, conversation_history, use_rag_static, use_rag_dynamic, conversation_summary, rag_filter=rag_filter)
+            cache_key, dynamic_version, cached = self._cache_lookup(result, self._history_for_key(conversation_history, conversation_summary), use_rag_dynamic)
+        except Exception as e:
+            self.logger.error(f"準備串流生成失敗: {e}", exc_info=True)
+            yield { "type": "done", "result": { "response": "抱歉，發生內部錯誤。", "error": str(e) } }
+            return
+
+        if cached:
+            # 快取命中時整段回答一次送出
+            self.logger.info("回答快取命中")
+            result.update(response=cached["response"], cache_hit=True, cached_at=cached["cached_at"])
+            yield { "type": "admitted" }
+            yield { "type": "token", "content": cached["response"] }
+            yield { "type": "done", "result": result }
+            return
+        result["cache_hit"] = False
+
+        with self.generation_queue.slot(priority):
+            yield { "type": "admitted" }
+            yield from self._stream_tokens(result, prompt, system_prompt, cache_key, dynamic_version, use_rag_dynamic)
+
+    def _stream_tokens(self, result: Dict[str, Any], prompt: str, system_prompt: str, cache_key: str, dynamic_version: Optional[str], use_rag_dynamic: bool) -> Iterator[Dict[str, Any]]:
+        tokens = []
+        ollama_stats = {}
+        try:
+            for token in self.call_ollama_stream(prompt, system_prompt, stats=ollama_stats):
+                # 與 generate_response 相同的用字統一，逐 token 處理
+                token = token.replace("臺", "台")
+                tokens.append(token)
+                yield { "type": "token", "content": token }
+        except Exception as e:
+            self.logger.error(f"呼叫 Ollama 串流 API 失敗: {str(e)}")
+            result["error"] = str(e)
+
+        result["prompt_tokens"]["ollama_prompt_eval_count"] = ollama_stats.get("prompt_eval_count")
+        full_response = "".join(tokens).strip()
+        if full_response and "error" not in result:
+            result["response"] = full_response
+            self._cache_store(cache_key, dynamic_version, result, use_rag_dynamic)
+        else:
+            result["response"] = full_response if full_response else "抱歉，處理請求時發生錯誤。"
+        yield { "type": "done", "result": result }
+
+    def _build_rag_prompt(self, user_query: str, context: str, conversation_history: list = None, conversation_summary: str = None) -> str:
         prompt_parts = ["=== 背景資料 ===", context, "=" * 18, ""]
+        if conversation_summary: prompt_parts.extend(["--- 先前對話摘要 ---", conversation_summary, ""])
         if conversation_history:
             prompt_parts.append("--- 對話歷史 ---")
-            for msg in conversation_history[-3:]: prompt_parts.append(f"{'用戶' if msg.get('role') == 'user' else '助手'}: {msg.get('content', '')}")
+            for msg in conversation_history: prompt_parts.append(f"{'用戶' if msg.get('role') == 'user' else '助手'}: {msg.get('content', '')}")
             prompt_parts.append("")
         prompt_parts.append(f"用戶問題: {user_query}")
         prompt_parts.append("\n請根據上述背景資料和對話歷史，回答用戶的問題：")
         return "\n".join(prompt_parts)
 
-    def _build_simple_prompt(self, user_query: str, conversation_history: list = None) -> str:
+    def _build_simple_prompt(self, user_query: str, conversation_history: list = None, conversation_summary: str = None) -> str:
         prompt_parts = []
+        if conversation_summary: prompt_parts.extend(["--- 先前對話摘要 ---", conversation_summary, ""])
         if conversation_history:
             prompt_parts.append("--- 對話歷史 ---")
-            for msg in conversation_history[-3:]: prompt_parts.append(f"{'用戶' if msg.get('role') == 'user' else '助手'}: {msg.get('content', '')}")
+            for msg in conversation_history: prompt_parts.append(f"{'用戶' if msg.get('role') == 'user' else '助手'}: {msg.get('content', '')}")
             prompt_parts.append("")
         prompt_parts.append(f"用戶問題: {user_query}")
         return "\n".join(prompt_parts)
 
+    def summarize_conversation(self, previous_summary: Optional[str], messages: list, max_summary_tokens: int = 300) -> Optional[str]:
+        """
+        把較舊的對話訊息併入滾動摘要 (背景工作使用，以 batch 優先權排隊，不與互動請求搶名額)。
+        未被准入或生成失敗時回傳 None，呼叫端保留原摘要、下次再試。
+        """
+        system_prompt = "你是對話摘要助理。請用繁體中文把對話整理成精簡的摘要，保留用戶的需求、偏好、提到的地點與已得到的重要結論，不要加入對話中沒有的內容。"
+        prompt_parts = []
+        if previous_summary: prompt_parts.extend(["--- 目前的摘要 ---", previous_summary, ""])
+        prompt_parts.append("--- 新的對話 ---")
+        history_budget = max(0, self.prompt_builder.prompt_budget - self.prompt_builder.counter.count(system_prompt) - self.prompt_builder.counter.count(previous_summary or "") - max_summary_tokens)
+        for msg in messages: prompt_parts.append(f"{'用戶' if msg.get('role') == 'user' else '助手'}: {msg.get('content', '')}")
+        prompt = self.prompt_builder.counter.truncate("\n".join(prompt_parts), history_budget)
+        prompt += f"\n\n請將目前的摘要與新的對話合併成一份不超過 {max_summary_tokens} 字的摘要："
+        try:
+            with self.generation_queue.slot(PRIORITY_BATCH):
+                summary = self.call_ollama(prompt, system_prompt)
+        except AdmissionRejectedError as e:
+            self.logger.info(f"生成佇列忙碌，延後對話摘要: {e}")
+            return None
+        if not summary: return None
+        return self.prompt_builder.counter.truncate(summary.strip().replace("臺", "台"), max_summary_tokens)
+
+    def check_ollama_status(self) -> str:
+        """立即探測所有後端，回傳整體狀態"""
+        self.backend_pool.check_all()
+        healthy = self.backend_pool.healthy_count()
+        if healthy == len(self.backend_pool.backends): return "online"
+        return f"degraded ({healthy}/{len(self.backend_pool.backends)})" if healthy else "offline"
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """不做即時探測的執行指標 (佇列深度、等待時間、快取命中率等)，適合高頻輪詢"""
+        return {
+            "generation_queue": self.generation_queue.get_stats(),
+            "response_cache": self.response_cache.get_stats() if self.response_cache else None,
+            "request_coalescing": self._inflight.get_stats(),
+            "ollama_backends": self.backend_pool.get_stats()
+        }
+
+    def close(self):
+        """關閉後端連線池並釋放 RAG 知識庫佔用的共用資源"""
+        self.backend_pool.close()
+        if self.rag_service: self.rag_service.close()
+
     def get_service_status(self) -> Dict[str, Any]:
-        return { "ollama_status": self.check_ollama_status(), "current_model": self.model_name, "rag_enabled": self.rag_enabled }
\ No newline at end of file
+        status = { "ollama_status": self.check_ollama_status(), "current_model": self.model_name, "rag_enabled": self.rag_enabled }
+        if self.rag_service: status["rag_status"] = self.rag_service.get_system_status()
+        status.update(self.get_metrics())
+        return status
@@ -0,0 +1,365 @@
+# C:\llm_service\backend\ollama_client.py
+# 共用的 Ollama HTTP 用戶端: 連線池 + 重試 + 斷路器 + 多後端負載平衡
+
+import time
+import random
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Any, Optional, List, Iterator
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreakerOpenError(Exception):
+    """斷路器處於開啟狀態，請求被直接拒絕"""
+
+
+class CircuitBreaker:
+    """
+    簡單的三態斷路器 (closed -> open -> half_open)。
+    連續失敗達 failure_threshold 次後開啟，recovery_timeout 秒後放行一個探測請求；
+    探測成功即關閉，失敗則重新開啟。
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, recovery_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.recovery_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow_request(self) -> bool:
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.OPEN and time.monotonic() - self._opened_at < self.recovery_timeout:
+                return False
+            # 冷卻時間已過: 只放行一個探測請求
+            if self._probe_in_flight:
+                return False
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    logger.warning(f"斷路器開啟 (連續失敗 {self._failures} 次)，{self.recovery_timeout} 秒內將直接拒絕請求")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"state": self.state, "consecutive_failures": self._failures}
+
+
+class OllamaClient:
+    """
+    以 requests.Session 為基礎的 Ollama 用戶端，整個程序共用一個實例。
+    - 連線池: keep-alive 重用 TCP 連線
+    - 逾時: 連線與讀取逾時分開設定
+    - 重試: 連線錯誤 / 逾時 / 502-504 時有限次重試，退避時間加入隨機抖動 (full jitter)
+    - 斷路器: 後端確定故障時快速失敗，不再讓 worker 卡住
+    """
+    RETRYABLE_STATUS = {502, 503, 504}
+
+    def __init__(self,
+                 base_url: str = "http://localhost:11434",
+                 pool_connections: int = 4,
+                 pool_maxsize: int = 16,
+                 connect_timeout: float = 3.05,
+                 read_timeout: float = 120.0,
+                 max_retries: int = 2,
+                 backoff_base: float = 0.5,
+                 backoff_max: float = 4.0,
+                 failure_threshold: int = 5,
+                 recovery_timeout: float = 30.0):
+        self.base_url = base_url.rstrip("/")
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.circuit_breaker = CircuitBreaker(failure_threshold, recovery_timeout)
+
+        self.session = requests.Session()
+        # 重試由本類別自行處理 (需配合斷路器)，因此 adapter 本身不重試
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._stats_lock = threading.Lock()
+        self._stats = {"requests": 0, "failures": 0, "retries": 0, "rejected": 0}
+
+    def _count(self, key: str):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    def request(self, method: str, path: str, timeout: Optional[tuple] = None, **kwargs) -> requests.Response:
+        """
+        發送請求並回傳 requests.Response (狀態碼非 2xx 也會回傳，由呼叫端判斷)。
+        斷路器開啟時拋出 CircuitBreakerOpenError；重試用盡時拋出最後一次的 requests 例外。
+        串流請求 (stream=True) 只會在取得回應標頭之前重試。
+        """
+        if not self.circuit_breaker.allow_request():
+            self._count("rejected")
+            raise CircuitBreakerOpenError(f"Ollama 後端 {self.base_url} 暫時不可用 (斷路器開啟)")
+
+        url = f"{self.base_url}{path}"
+        timeout = timeout or (self.connect_timeout, self.read_timeout)
+        self._count("requests")
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                self._count("failures")
+                if attempt >= self.max_retries:
+                    self.circuit_breaker.record_failure()
+                    raise
+                error = f"{type(e).__name__}: {e}"
+            except Exception:
+                # 非網路錯誤不重試，但須釋放半開狀態下的探測名額
+                self.circuit_breaker.record_failure()
+                raise
+            else:
+                if response.status_code not in self.RETRYABLE_STATUS:
+                    self.circuit_breaker.record_success()
+                    return response
+                self._count("failures")
+                if attempt >= self.max_retries:
+                    self.circuit_breaker.record_failure()
+                    return response
+                error = f"HTTP {response.status_code}"
+                response.close()
+
+            delay = self._backoff(attempt)
+            self._count("retries")
+            logger.warning(f"Ollama 請求失敗 ({error})，{delay:.2f} 秒後重試 ({attempt + 1}/{self.max_retries})")
+            time.sleep(delay)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["circuit_breaker"] = self.circuit_breaker.get_stats()
+        return stats
+
+    def close(self):
+        self.session.close()
+
+
+class NoHealthyBackendError(Exception):
+    """後端池中沒有任何可用的 Ollama 實例"""
+
+
+class OllamaBackend:
+    """後端池中的單一 Ollama 實例及其執行統計"""
+
+    def __init__(self, client: OllamaClient):
+        self.client = client
+        self.url = client.base_url
+        self.healthy = True
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.avg_latency_ms = None  # 指數移動平均
+        self.last_health_check = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_latency_ms": round(self.avg_latency_ms, 1) if self.avg_latency_ms is not None else None,
+            "circuit_breaker": self.client.circuit_breaker.get_stats(),
+        }
+
+
+class OllamaBackendPool:
+    """
+    多個 Ollama 實例的負載平衡池。
+    - 路由: 選擇進行中請求數最少 (least outstanding requests) 的健康後端，平手時取平均延遲較低者
+    - 被動剔除: 連續失敗 eject_after_failures 次即標記為不健康
+    - 主動健康檢查: 背景執行緒定期探測 /api/tags，恢復的後端自動重新加入
+    """
+    LATENCY_EWMA_ALPHA = 0.2
+
+    def __init__(self,
+                 urls: List[str],
+                 health_check_interval: float = 10.0,
+                 eject_after_failures: int = 3,
+                 **client_kwargs):
+        if not urls:
+            raise ValueError("至少需要一個 Ollama 後端 URL")
+        self.backends = [OllamaBackend(OllamaClient(url, **client_kwargs)) for url in urls]
+        self.health_check_interval = health_check_interval
+        self.eject_after_failures = eject_after_failures
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._health_thread = None
+        if health_check_interval and health_check_interval > 0:
+            self._health_thread = threading.Thread(target=self._health_check_loop, name="ollama-health-check", daemon=True)
+            self._health_thread.start()
+
+    def _acquire(self, exclude: set) -> OllamaBackend:
+        with self._lock:
+            candidates = [b for b in self.backends if b.healthy and b.url not in exclude and b.client.circuit_breaker.state != CircuitBreaker.OPEN]
+            if not candidates:
+                raise NoHealthyBackendError("沒有可用的 Ollama 後端")
+            backend = min(candidates, key=lambda b: (b.in_flight, b.avg_latency_ms or 0.0))
+            backend.in_flight += 1
+            backend.requests += 1
+            return backend
+
+    def _release(self, backend: OllamaBackend, started: float, success: bool):
+        latency_ms = (time.monotonic() - started) * 1000
+        with self._lock:
+            backend.in_flight -= 1
+            if success:
+                backend.consecutive_failures = 0
+                if backend.avg_latency_ms is None:
+                    backend.avg_latency_ms = latency_ms
+                else:
+                    backend.avg_latency_ms += self.LATENCY_EWMA_ALPHA * (latency_ms - backend.avg_latency_ms)
+            else:
+                backend.errors += 1
+                backend.consecutive_failures += 1
+                if backend.healthy and backend.consecutive_failures >= self.eject_after_failures:
+                    backend.healthy = False
+                    logger.warning(f"Ollama 後端 {backend.url} 連續失敗 {backend.consecutive_failures} 次，已暫時剔除")
+
+    @contextmanager
+    def lease(self, exclude: Optional[set] = None) -> Iterator[OllamaBackend]:
+        """借出一個後端，離開 with 區塊時才歸還 (串流請求須在整個串流期間持有)"""
+        backend = self._acquire(exclude or set())
+        started = time.monotonic()
+        success = False
+        try:
+            yield backend
+            success = True
+        except GeneratorExit:
+            # 呼叫端提前結束串流 (例如瀏覽器斷線) 不算後端失敗
+            success = True
+            raise
+        finally:
+            self._release(backend, started, success)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        """非串流請求: 失敗時自動改送其他後端，每個後端最多嘗試一次"""
+        tried = set()
+        last_error = None
+        while len(tried) < len(self.backends):
+            try:
+                with self.lease(exclude=tried) as backend:
+                    tried.add(backend.url)
+                    response = backend.client.post(path, **kwargs)
+                    if response.status_code in OllamaClient.RETRYABLE_STATUS:
+                        raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+                    return response
+            except NoHealthyBackendError:
+                break
+            except (requests.RequestException, CircuitBreakerOpenError) as e:
+                last_error = e
+                logger.warning(f"Ollama 後端請求失敗: {e}，嘗試其他後端")
+        if last_error is not None:
+            raise last_error
+        raise NoHealthyBackendError("沒有可用的 Ollama 後端")
+
+    @contextmanager
+    def stream(self, path: str, **kwargs) -> Iterator[requests.Response]:
+        """串流請求: 在取得回應前可改送其他後端，取得後於整個串流期間持有該後端"""
+        tried = set()
+        while True:
+            started = False
+            try:
+                with self.lease(exclude=tried) as backend:
+                    tried.add(backend.url)
+                    response = backend.client.post(path, stream=True, **kwargs)
+                    started = True
+                    with response:
+                        yield response
+                    return
+            except (requests.RequestException, CircuitBreakerOpenError) as e:
+                if started or len(tried) >= len(self.backends):
+                    raise
+                logger.warning(f"Ollama 後端串流請求失敗: {e}，嘗試其他後端")
+
+    def _check_backend(self, backend: OllamaBackend):
+        # 直接使用 session 以繞過斷路器: 健康檢查本身就是恢復探測
+        try:
+            response = backend.client.session.get(f"{backend.url}/api/tags", timeout=(backend.client.connect_timeout, 5))
+            ok = response.status_code == 200
+            response.close()
+        except requests.RequestException:
+            ok = False
+        with self._lock:
+            backend.last_health_check = time.time()
+            if ok:
+                if not backend.healthy:
+                    logger.info(f"Ollama 後端 {backend.url} 已恢復，重新加入負載平衡")
+                backend.healthy = True
+                backend.consecutive_failures = 0
+            elif backend.healthy:
+                logger.warning(f"Ollama 後端 {backend.url} 健康檢查失敗，已暫時剔除")
+                backend.healthy = False
+        if ok:
+            backend.client.circuit_breaker.record_success()
+
+    def check_all(self):
+        for backend in self.backends:
+            self._check_backend(backend)
+
+    def _health_check_loop(self):
+        while not self._stop_event.wait(self.health_check_interval):
+            try:
+                self.check_all()
+            except Exception as e:
+                logger.error(f"Ollama 健康檢查發生錯誤: {e}")
+
+    def healthy_count(self) -> int:
+        return sum(1 for b in self.backends if b.healthy)
+
+    def get_stats(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [b.get_stats() for b in self.backends]
+
+    def close(self):
+        self._stop_event.set()
+        for backend in self.backends:
+            backend.client.close()
@@ -0,0 +1,165 @@
+# C:\llm_service\backend\prompt_builder.py
+# 依 token 預算組裝提示: 以模型 tokenizer 計數，在系統提示、檢索片段與對話歷史之間分配預算
+
+import re
+import logging
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# CJK 統一表意文字、假名、韓文與全形標點
+_CJK_PATTERN = re.compile(r"[\u3000-\u303f\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uff00-\uffef]")
+
+
+class TokenCounter:
+    """
+    計算文字的 token 數。
+    有設定 tokenizer_name 且能載入 transformers 時使用模型的 tokenizer；
+    否則退回估算: CJK 字元每字約 1 token，其他文字約每 4 個字元 1 token。
+    """
+
+    def __init__(self, tokenizer_name: Optional[str] = None):
+        self.tokenizer = None
+        self.name = "heuristic"
+        if tokenizer_name:
+            try:
+                from transformers import AutoTokenizer
+                self.tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+                self.name = tokenizer_name
+                logger.info(f"已載入 tokenizer: {tokenizer_name}")
+            except Exception as e:
+                logger.warning(f"無法載入 tokenizer '{tokenizer_name}'，改用估算方式計數: {e}")
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        cjk = len(_CJK_PATTERN.findall(text))
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """截斷文字使其不超過 max_tokens"""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        if self.tokenizer is not None:
+            ids = self.tokenizer.encode(text, add_special_tokens=False)[:max_tokens]
+            return self.tokenizer.decode(ids)
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            if self.count(text[:mid]) <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        return text[:low]
+
+
+class PromptBuilder:
+    """
+    在固定的 token 預算內組裝提示。
+    預算 = context_window - response_reserve；扣除系統提示與問題本身 (必要部分) 後，
+    剩餘額度依 context_share 分給檢索片段與對話歷史，一方用不完的額度會讓給另一方。
+    超出預算時先捨棄價值最低的部分: 排名最後的片段、最舊的對話。
+    """
+
+    def __init__(self,
+                 counter: TokenCounter,
+                 context_window: int = 4096,
+                 response_reserve: int = 1024,
+                 context_share: float = 0.7,
+                 max_history_messages: int = 10):
+        self.counter = counter
+        self.context_window = context_window
+        self.response_reserve = response_reserve
+        self.context_share = context_share
+        self.max_history_messages = max_history_messages
+
+    @property
+    def prompt_budget(self) -> int:
+        return self.context_window - self.response_reserve
+
+    def _select_chunks(self, chunks: List[Dict[str, Any]], budget: int, selected: Dict[int, Dict[str, Any]]) -> int:
+        """依價值 (rank) 由高到低挑選片段放入 selected (以原索引為鍵)，回傳已使用的 token 數"""
+        used = sum(c["tokens"] for c in selected.values())
+        order = sorted(range(len(chunks)), key=lambda i: chunks[i].get("rank", 0))
+        for index in order:
+            if index in selected:
+                continue
+            tokens = self.counter.count(chunks[index]["content"])
+            if used + tokens <= budget:
+                selected[index] = dict(chunks[index], tokens=tokens)
+                used += tokens
+        if order and not selected and budget > 0:
+            # 沒有任何片段放得下時，截斷最相關的片段而不是整個捨棄
+            best = order[0]
+            content = self.counter.truncate(chunks[best]["content"], budget)
+            if content:
+                selected[best] = dict(chunks[best], content=content, tokens=self.counter.count(content), truncated=True)
+                used += selected[best]["tokens"]
+        return used
+
+    def build(self,
+              system_prompt: str,
+              chunks: List[Dict[str, Any]],
+              conversation_history: Optional[List[dict]],
+              render: Callable[[List[Dict[str, Any]], List[dict]], str]) -> Tuple[str, Dict[str, Any]]:
+        """
+        render(chunks, history) 負責把選中的片段與歷史排成最終提示文字。
+        回傳 (prompt, report)，report 記錄各部分 token 數與被捨棄的數量。
+        """
+        history = list(conversation_history or [])[-self.max_history_messages:]
+        chunks = list(chunks or [])
+
+        fixed_tokens = self.counter.count(system_prompt) + self.counter.count(render([], []))
+        available = max(0, self.prompt_budget - fixed_tokens)
+        chunk_budget = int(available * self.context_share) if history else available
+        if not chunks:
+            chunk_budget = 0
+
+        selected: Dict[int, Dict[str, Any]] = {}
+        chunk_tokens = self._select_chunks(chunks, chunk_budget, selected)
+
+        # 歷史由新到舊加入，剩下的額度全部給歷史
+        history_budget = available - chunk_tokens
+        selected_history: List[dict] = []
+        history_tokens = 0
+        for msg in reversed(history):
+            tokens = self.counter.count(msg.get("content", "")) + 4  # 角色標籤與換行
+            if history_tokens + tokens > history_budget:
+                break
+            selected_history.insert(0, msg)
+            history_tokens += tokens
+
+        # 歷史用不完的額度再讓給片段
+        if len(selected) < len(chunks):
+            self._select_chunks(chunks, available - history_tokens, selected)
+
+        # 以原始順序 (知識庫分段內依相關度) 排列
+        selected_chunks = [selected[i] for i in sorted(selected)]
+        prompt = render(selected_chunks, selected_history)
+        total = self.counter.count(system_prompt) + self.counter.count(prompt)
+        # 分隔線等排版文字也會佔用 token: 仍超出時繼續捨棄最低價值的部分
+        while total > self.prompt_budget and (selected_chunks or selected_history):
+            if selected_history:
+                selected_history.pop(0)
+            else:
+                selected_chunks.remove(max(selected_chunks, key=lambda c: c.get("rank", 0)))
+            prompt = render(selected_chunks, selected_history)
+            total = self.counter.count(system_prompt) + self.counter.count(prompt)
+
+        report = {
+            "tokenizer": self.counter.name,
+            "budget": self.prompt_budget,
+            "system": self.counter.count(system_prompt),
+            "context": sum(c["tokens"] for c in selected_chunks),
+            "history": sum(self.counter.count(m.get("content", "")) for m in selected_history),
+            "total": total,
+            "chunks_used": len(selected_chunks),
+            "chunks_dropped": len(chunks) - len(selected_chunks),
+            "history_used": len(selected_history),
+            "history_dropped": len(history) - len(selected_history),
+        }
+        return prompt, report
@@ -0,0 +1,179 @@
+# C:\llm_service\backend\response_cache.py
+# LLM 回答快取: 以 (正規化查詢, RAG 背景資料指紋, 模型名稱) 為鍵，LRU + TTL，可選 SQLite 持久化
+
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Any, Optional, List
+
+logger = logging.getLogger(__name__)
+
+_TRAILING_PUNCTUATION = "?？!！。.,，~～ "
+
+
+def normalize_query(query: str) -> str:
+    """正規化查詢文字: 全半形統一、去除多餘空白與句尾標點、統一「臺/台」、英文小寫"""
+    text = unicodedata.normalize("NFKC", query or "")
+    text = re.sub(r"\s+", " ", text).strip().lower()
+    text = text.replace("臺", "台")
+    return text.rstrip(_TRAILING_PUNCTUATION)
+
+
+def fingerprint(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    執行緒安全的回答快取。
+    - 記憶體層: OrderedDict 實作 LRU，超過 max_entries 時淘汰最久未使用者；每筆項目有 TTL
+    - 磁碟層 (db_path 不為 None 時): SQLite，程序重啟後仍可命中
+    - 使用動態知識庫的項目會記錄當時的知識庫版本，版本變更 (天氣資料重建) 後自動失效
+    """
+
+    def __init__(self, max_entries: int = 1000, ttl_seconds: float = 3600, db_path: Optional[str] = None, max_disk_entries: int = 10000):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_disk_entries = max_disk_entries
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "disk_hits": 0, "expired": 0, "invalidated": 0}
+        self._conn = None
+        if db_path:
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(db_path, check_same_thread=False)
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS response_cache ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, "
+                "uses_dynamic INTEGER NOT NULL DEFAULT 0, kb_version TEXT)"
+            )
+            self._conn.commit()
+
+    @staticmethod
+    def make_key(user_query: str, rag_context: str, model_name: str, conversation_history: Optional[List[dict]] = None) -> str:
+        # 對話歷史會影響回答，因此一併納入指紋 (無歷史時為固定值)
+        history = json.dumps([[m.get("role"), m.get("content")] for m in (conversation_history or [])], ensure_ascii=False)
+        parts = [normalize_query(user_query), fingerprint(rag_context), model_name, fingerprint(history)]
+        return fingerprint("\x1f".join(parts))
+
+    def _is_valid(self, entry: Dict[str, Any], dynamic_version: Optional[str]) -> bool:
+        if time.time() - entry["created_at"] > self.ttl_seconds:
+            self._stats["expired"] += 1
+            return False
+        if entry["uses_dynamic"] and entry["kb_version"] != dynamic_version:
+            self._stats["invalidated"] += 1
+            return False
+        return True
+
+    def get(self, key: str, dynamic_version: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if self._is_valid(entry, dynamic_version):
+                    self._entries.move_to_end(key)
+                    self._stats["hits"] += 1
+                    return dict(entry["value"], cached_at=entry["created_at"])
+                del self._entries[key]
+                self._delete_from_disk(key)
+
+            entry = self._load_from_disk(key)
+            if entry is not None:
+                if self._is_valid(entry, dynamic_version):
+                    self._store_in_memory(key, entry)
+                    self._stats["hits"] += 1
+                    self._stats["disk_hits"] += 1
+                    return dict(entry["value"], cached_at=entry["created_at"])
+                self._delete_from_disk(key)
+
+            self._stats["misses"] += 1
+            return None
+
+    def set(self, key: str, value: Dict[str, Any], uses_dynamic: bool = False, dynamic_version: Optional[str] = None):
+        entry = {"value": value, "created_at": time.time(), "uses_dynamic": uses_dynamic, "kb_version": dynamic_version if uses_dynamic else None}
+        with self._lock:
+            self._store_in_memory(key, entry)
+            if self._conn is not None:
+                try:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO response_cache (key, value, created_at, uses_dynamic, kb_version) VALUES (?, ?, ?, ?, ?)",
+                        (key, json.dumps(value, ensure_ascii=False), entry["created_at"], int(uses_dynamic), entry["kb_version"])
+                    )
+                    self._conn.execute(
+                        "DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                        (self.max_disk_entries,)
+                    )
+                    self._conn.commit()
+                except sqlite3.Error as e:
+                    logger.error(f"寫入回答快取失敗: {e}")
+
+    def invalidate_dynamic(self, current_version: Optional[str] = None) -> int:
+        """移除所有使用動態知識庫且版本不符 (或全部，當 current_version 為 None) 的項目"""
+        with self._lock:
+            stale = [k for k, e in self._entries.items() if e["uses_dynamic"] and (current_version is None or e["kb_version"] != current_version)]
+            for k in stale:
+                del self._entries[k]
+            removed = len(stale)
+            if self._conn is not None:
+                try:
+                    if current_version is None:
+                        cursor = self._conn.execute("DELETE FROM response_cache WHERE uses_dynamic = 1")
+                    else:
+                        cursor = self._conn.execute("DELETE FROM response_cache WHERE uses_dynamic = 1 AND (kb_version IS NULL OR kb_version != ?)", (current_version,))
+                    self._conn.commit()
+                    removed = max(removed, cursor.rowcount)
+                except sqlite3.Error as e:
+                    logger.error(f"清除動態回答快取失敗: {e}")
+            self._stats["invalidated"] += removed
+        if removed:
+            logger.info(f"動態知識庫已更新，清除 {removed} 筆回答快取")
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM response_cache")
+                self._conn.commit()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["persistent"] = self._conn is not None
+        return stats
+
+    # --- 內部輔助 (呼叫端須持有 self._lock) ---
+    def _store_in_memory(self, key: str, entry: Dict[str, Any]):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _load_from_disk(self, key: str) -> Optional[Dict[str, Any]]:
+        if self._conn is None:
+            return None
+        try:
+            row = self._conn.execute("SELECT value, created_at, uses_dynamic, kb_version FROM response_cache WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"讀取回答快取失敗: {e}")
+            return None
+        if row is None:
+            return None
+        return {"value": json.loads(row[0]), "created_at": row[1], "uses_dynamic": bool(row[2]), "kb_version": row[3]}
+
+    def _delete_from_disk(self, key: str):
+        if self._conn is not None:
+            try:
+                self._conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.error(f"刪除回答快取失敗: {e}")
@@ -0,0 +1,153 @@
+# C:\llm_service\backend\single_flight.py
+# 單飛 (single-flight) 請求合併: 相同鍵的並發呼叫只執行一次，其餘呼叫等待並共用結果
+
+import copy
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterator, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class _StreamCall:
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.events = []
+        self.finished = False
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    同一時間、同一個鍵只會有一個呼叫真正執行 fn；
+    執行期間進來的相同鍵呼叫會阻塞等待，並取得結果的深拷貝 (呼叫端可各自修改)。
+    fn 執行完畢後鍵即被移除，之後的呼叫會重新執行 (快取由 ResponseCache 負責)。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _StreamCall] = {}
+        self._stats = {"executed": 0, "coalesced": 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """回傳 (結果, shared)；shared 為 True 表示結果來自其他並發呼叫"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats["coalesced"] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._stats["executed"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return copy.deepcopy(call.result), True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            if call.waiters:
+                logger.info(f"合併了 {call.waiters} 個相同的並發請求")
+            call.done.set()
+        return copy.deepcopy(call.result) if call.waiters else call.result, False
+
+    def stream(self, key: str, fn: Callable[[], Iterator[Any]]) -> Iterator[Tuple[Any, bool]]:
+        """
+        do() 的串流版本: 同一個鍵只有第一個呼叫會迭代 fn()，其餘呼叫訂閱同一串事件 (先補送已產生的事件，再逐一接收新事件)。
+        產出 (事件, shared)；跟隨者取得的事件為深拷貝。
+        發起者的用戶端中途斷線 (生成器被關閉) 時，若仍有跟隨者，會把剩餘事件生成完畢再結束。
+        """
+        with self._lock:
+            call = self._streams.get(key)
+            if call is not None:
+                call.waiters += 1
+                self._stats["coalesced"] += 1
+                leader = False
+            else:
+                call = _StreamCall()
+                self._streams[key] = call
+                self._stats["executed"] += 1
+                leader = True
+        return self._lead_stream(key, call, fn) if leader else self._follow_stream(call)
+
+    def _lead_stream(self, key: str, call: _StreamCall, fn: Callable[[], Iterator[Any]]) -> Iterator[Tuple[Any, bool]]:
+        def publish(event):
+            with call.cond:
+                call.events.append(event)
+                call.cond.notify_all()
+
+        iterator = None
+        try:
+            iterator = iter(fn())
+            for event in iterator:
+                publish(event)
+                try:
+                    yield event, False
+                except GeneratorExit:
+                    with self._lock:
+                        # 沒有跟隨者時立即移除鍵，之後的呼叫不會再加入這個即將中止的串流
+                        if not call.waiters:
+                            del self._streams[key]
+                    if call.waiters:
+                        logger.info(f"發起串流的用戶端已中斷，繼續生成給 {call.waiters} 個合併的請求")
+                        for event in iterator:
+                            publish(event)
+                    raise
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            if iterator is not None and hasattr(iterator, "close"):
+                iterator.close()
+            with self._lock:
+                if self._streams.get(key) is call:
+                    del self._streams[key]
+            if call.waiters:
+                logger.info(f"合併了 {call.waiters} 個相同的並發串流請求")
+            with call.cond:
+                call.finished = True
+                call.cond.notify_all()
+
+    @staticmethod
+    def _follow_stream(call: _StreamCall) -> Iterator[Tuple[Any, bool]]:
+        index = 0
+        while True:
+            with call.cond:
+                while index >= len(call.events) and not call.finished:
+                    call.cond.wait()
+                pending = call.events[index:]
+                index += len(pending)
+                finished = call.finished and index >= len(call.events)
+            for event in pending:
+                yield copy.deepcopy(event), True
+            if finished:
+                if call.error is not None:
+                    raise call.error
+                return
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls) + len(self._streams)
+        return stats
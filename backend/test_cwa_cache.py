@@ -0,0 +1,151 @@
+# C:\llm_service\backend\test_cwa_cache.py
+# CWA 回應快取與 replay 模式的離線單元測試 (不連網、不需要 API Key): python -m pytest backend/test_cwa_cache.py
+# test_fixtures/cwa/ 為錄製的 F-C0032-001 / O-A0003-001 回應 (live 模式寫出的快取檔格式)
+
+import os
+import sys
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+import requests
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from cwa_cache import CWAResponseCache
+
+FIXTURES_DIR = Path(__file__).parent / "test_fixtures" / "cwa"
+OK = {"success": "true", "records": {"value": 1}}
+
+
+class FakeResponse:
+    def __init__(self, status_code=200, data=None, headers=None):
+        self.status_code = status_code
+        self._data = data
+        self.headers = headers or {}
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"HTTP {self.status_code}")
+
+
+class FakeEndpoint:
+    """記錄每次請求的條件式標頭，依序回傳 responses (例外物件則拋出)"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.headers = []
+
+    def __call__(self, headers):
+        self.headers.append(dict(headers))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+def _is_valid(data):
+    return data.get("success") == "true"
+
+
+def _age(cache, endpoint, params, seconds):
+    """把快取檔的 fetched_at 往前調 seconds 秒"""
+    path = cache._path(endpoint, params)
+    entry = json.loads(path.read_text(encoding="utf-8"))
+    entry["fetched_at"] -= seconds
+    path.write_text(json.dumps(entry, ensure_ascii=False), encoding="utf-8")
+
+
+def test_fresh_entry_is_served_without_request(tmp_path):
+    cache = CWAResponseCache(str(tmp_path), ttls={"O-A0003-001": 300})
+    endpoint = FakeEndpoint(FakeResponse(data=OK, headers={"ETag": '"v1"'}))
+    assert cache.fetch("O-A0003-001", {}, endpoint, _is_valid) == OK
+    assert cache.fetch("O-A0003-001", {}, endpoint, _is_valid) == OK
+    assert len(endpoint.headers) == 1
+    assert cache.stats["fetched"] == 1 and cache.stats["fresh_hits"] == 1
+
+
+def test_expired_entry_is_revalidated_with_etag(tmp_path):
+    cache = CWAResponseCache(str(tmp_path), ttls={"O-A0003-001": 300})
+    endpoint = FakeEndpoint(FakeResponse(data=OK, headers={"ETag": '"v1"', "Last-Modified": "Mon, 21 Jul 2025 02:00:00 GMT"}), FakeResponse(status_code=304))
+    cache.fetch("O-A0003-001", {}, endpoint, _is_valid)
+    _age(cache, "O-A0003-001", {}, 301)
+    assert cache.fetch("O-A0003-001", {}, endpoint, _is_valid) == OK
+    assert endpoint.headers[1] == {"If-None-Match": '"v1"', "If-Modified-Since": "Mon, 21 Jul 2025 02:00:00 GMT"}
+    assert cache.stats["revalidated"] == 1
+    # 304 後重新計算 TTL
+    assert cache.fetch("O-A0003-001", {}, endpoint, _is_valid) == OK
+    assert len(endpoint.headers) == 2
+
+
+def test_changed_data_replaces_entry(tmp_path):
+    cache = CWAResponseCache(str(tmp_path), default_ttl=0)
+    newer = {"success": "true", "records": {"value": 2}}
+    endpoint = FakeEndpoint(FakeResponse(data=OK, headers={"ETag": '"v1"'}), FakeResponse(data=newer, headers={"ETag": '"v2"'}))
+    cache.fetch("F-C0032-001", {"locationName": "臺北市"}, endpoint, _is_valid)
+    assert cache.fetch("F-C0032-001", {"locationName": "臺北市"}, endpoint, _is_valid) == newer
+    assert cache.stats["fetched"] == 2
+
+
+def test_stale_entry_served_on_error_within_limit(tmp_path):
+    cache = CWAResponseCache(str(tmp_path), default_ttl=60, stale_if_error=3600)
+    endpoint = FakeEndpoint(FakeResponse(data=OK), requests.ConnectionError("down"), FakeResponse(data={"success": "false"}), requests.Timeout("slow"))
+    cache.fetch("O-A0003-001", {}, endpoint, _is_valid)
+    _age(cache, "O-A0003-001", {}, 120)
+    assert cache.fetch("O-A0003-001", {}, endpoint, _is_valid) == OK
+    assert cache.fetch("O-A0003-001", {}, endpoint, _is_valid) == OK  # success=false 也視為失敗
+    assert cache.stats["stale_served"] == 2
+    _age(cache, "O-A0003-001", {}, 3600)
+    assert cache.fetch("O-A0003-001", {}, endpoint, _is_valid) is None
+    assert cache.stats["misses"] == 1
+
+
+def test_cache_key_ignores_api_key(tmp_path):
+    cache = CWAResponseCache(str(tmp_path))
+    endpoint = FakeEndpoint(FakeResponse(data=OK))
+    cache.fetch("O-A0003-001", {"Authorization": "CWA-SECRET"}, endpoint, _is_valid)
+    assert cache._path("O-A0003-001", {"Authorization": "CWA-SECRET"}) == cache._path("O-A0003-001", {})
+    assert all("CWA-SECRET" not in path.read_text(encoding="utf-8") for path in tmp_path.iterdir())
+
+
+def test_replay_serves_fixture_without_request():
+    cache = CWAResponseCache(str(FIXTURES_DIR), default_ttl=0, mode="replay")
+    endpoint = FakeEndpoint()  # 沒有任何回應，被呼叫就會失敗
+    data = cache.fetch("O-A0003-001", {}, endpoint, _is_valid)
+    assert data["success"] == "true" and data["records"]["Station"]
+    assert cache.fetch("O-A0003-001", {"StationId": "NOPE"}, endpoint, _is_valid) is None
+    assert endpoint.headers == []
+    assert cache.stats["replayed"] == 1 and cache.stats["misses"] == 1
+
+
+def test_invalid_mode_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        CWAResponseCache(str(tmp_path), mode="offline")
+
+
+def test_weather_service_replay_offline(tmp_path, monkeypatch):
+    """TaiwanWeatherService 在 replay 模式下以錄製資料完成預報、測站查詢與並行下載，且不發出任何請求"""
+    replay_dir = tmp_path / "cwa"
+    shutil.copytree(FIXTURES_DIR, replay_dir)
+    monkeypatch.setenv("CWA_CACHE_MODE", "replay")
+    monkeypatch.setenv("CWA_CACHE_DIR", str(replay_dir))
+    monkeypatch.setenv("CWA_API_KEY", "")
+    from weather_service import TaiwanWeatherService
+
+    service = TaiwanWeatherService()
+    monkeypatch.setattr(service.session, "get", lambda *args, **kwargs: pytest.fail("replay 模式不應連網"))
+
+    fetched = service.fetch_all()
+    assert fetched["observations_ok"]
+    forecast = fetched["forecast"]
+    assert forecast["success"] and {r["location_name"] for r in forecast["data"]} == set(service.LOCATIONS_TO_QUERY)
+    taipei = service.get_current_weather("臺北")["data"]
+    assert taipei["station_id"] == "466920" and taipei["precipitation_mm"] == 0.0
+    assert service.get_current_weather("466910")["data"]["station_name"] == "鞍部"
+    assert service.get_current_weather("屏東")["data"]["temperature_c"] is None  # -99 為無效值
+    assert not service.get_current_weather("不存在")["success"]
+    assert service.cache.stats["replayed"] == 2
@@ -0,0 +1,83 @@
+# C:\llm_service\backend\test_llm_service_stream.py
+# 串流請求合併的離線單元測試 (不需要 Ollama 或 RAG 系統): python -m pytest backend/test_llm_service_stream.py
+
+import os
+import sys
+import threading
+import time
+import types
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _service(monkeypatch):
+    # 測試停用 RAG，只需要一個空的 rag_service 模組讓 llm_service 可以匯入
+    monkeypatch.setitem(sys.modules, "rag_service", types.SimpleNamespace(RAGService=None))
+    monkeypatch.delitem(sys.modules, "llm_service", raising=False)
+    from llm_service import LLMService
+    return LLMService(rag_enabled=False, cache_enabled=False, health_check_interval=0)
+
+
+def test_concurrent_streams_share_one_ollama_call(monkeypatch):
+    service = _service(monkeypatch)
+    calls = []
+    release = threading.Event()
+
+    def fake_stream(prompt, system_prompt=None, stats=None):
+        calls.append(prompt)
+        yield "臺北"
+        release.wait(5)
+        yield "晴天"
+
+    monkeypatch.setattr(service, "call_ollama_stream", fake_stream)
+    streams = 5
+    results = [None] * streams
+
+    def consume(i):
+        results[i] = list(service.stream_response(f"台北天氣？{'' if i else ' '}", use_rag_static=False))
+
+    threads = [threading.Thread(target=consume, args=(i,)) for i in range(streams)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.3)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(calls) == 1
+    for events in results:
+        assert [e["type"] for e in events] == ["admitted", "token", "token", "done"]
+        assert "".join(e["content"] for e in events if e["type"] == "token") == "台北晴天"
+    done = [events[-1]["result"] for events in results]
+    assert sorted(r["coalesced"] for r in done) == [False] + [True] * (streams - 1)
+    assert all(r["response"] == "台北晴天" for r in done)
+    assert service._inflight.get_stats()["in_flight"] == 0
+    service.close()
+
+
+def test_follower_finishes_when_leader_disconnects(monkeypatch):
+    service = _service(monkeypatch)
+    calls = []
+    release = threading.Event()
+
+    def fake_stream(prompt, system_prompt=None, stats=None):
+        calls.append(prompt)
+        yield "多雲"
+        release.wait(5)
+        yield "有雨"
+
+    monkeypatch.setattr(service, "call_ollama_stream", fake_stream)
+    leader = service.stream_response("高雄天氣", use_rag_static=False)
+    assert next(leader)["type"] == "admitted"
+    follower_events = []
+    follower = threading.Thread(target=lambda: follower_events.extend(service.stream_response("高雄天氣", use_rag_static=False)))
+    follower.start()
+    time.sleep(0.2)
+    release.set()
+    leader.close()
+    follower.join(5)
+
+    assert len(calls) == 1
+    assert follower_events[-1]["type"] == "done" and follower_events[-1]["result"]["response"] == "多雲有雨"
+    assert follower_events[-1]["result"]["coalesced"] is True
+    service.close()
@@ -0,0 +1,58 @@
+# C:\llm_service\backend\test_weather_fast_path.py
+# 天氣快速回答的離線單元測試: python -m pytest backend/test_weather_fast_path.py
+
+import os
+import sys
+import json
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "rag_system", "scripts"))
+
+from weather_fast_path import WeatherFastPath
+
+KAOHSIUNG = {
+    "location_name": "高雄市", "display_name": "高雄市", "station_name": "高雄",
+    "forecast": {"location_name": "高雄市", "weather_condition": "多雲時晴", "rain_probability": 20, "min_temperature": 27, "max_temperature": 33, "comfort_index": "悶熱"},
+    "observation": {"station_name": "高雄", "observation_time": "2025-07-21T10:00:00+08:00", "weather": "多雲", "temperature_c": 30.4,
+                    "relative_humidity_percent": 76.0, "precipitation_mm": 0.5},
+}
+TAIPEI_NO_DATA = {
+    "location_name": "臺北市", "station_name": "臺北", "observation": None,
+    "forecast": {"weather_condition": "N/A", "rain_probability": -1, "min_temperature": -99, "max_temperature": -99, "comfort_index": "N/A"},
+}
+
+
+def _fast_path(tmp_path, generated_at=None):
+    path = tmp_path / "weather_structured.json"
+    generated_at = generated_at or datetime.now()
+    path.write_text(json.dumps({"generated_at": generated_at.isoformat(timespec="seconds"), "cities": {"高雄市": KAOHSIUNG, "臺北市": TAIPEI_NO_DATA}},
+                               ensure_ascii=False), encoding="utf-8")
+    return WeatherFastPath(str(path))
+
+
+def test_simple_question_answered_from_structured_data(tmp_path):
+    result = _fast_path(tmp_path).try_answer("高雄天氣")
+    assert result["fast_path"] == "weather" and not result["rag_used"]
+    assert "30.4°C" in result["response"] and "降雨機率 20%" in result["response"] and "27°C 至 33°C" in result["response"]
+    assert "臺" not in result["response"]
+
+
+def test_common_phrasings_answered(tmp_path):
+    fast_path = _fast_path(tmp_path)
+    for message in ("高雄天氣如何", "高雄天氣如何？", "高雄天氣怎麼樣", "高雄今天天氣怎樣", "高雄現在幾度", "高雄冷不冷", "高雄熱不熱"):
+        result = fast_path.try_answer(message)
+        assert result is not None and result["fast_path"] == "weather", message
+
+
+def test_falls_back_to_llm(tmp_path):
+    fast_path = _fast_path(tmp_path)
+    for message in ("為什麼高雄這麼熱", "高雄明天會下雨嗎", "台北跟高雄天氣", "今天天氣", "新竹天氣", "台北天氣",
+                    "我下週要去高雄出差三天想知道那邊的天氣狀況",
+                    "高雄下雨怎麼辦", "高雄天氣怎麼會這麼熱"):
+        assert fast_path.try_answer(message) is None, message
+
+
+def test_stale_or_missing_data_falls_back(tmp_path):
+    assert _fast_path(tmp_path, datetime.now() - timedelta(hours=4)).try_answer("高雄天氣") is None
+    assert WeatherFastPath(str(tmp_path / "missing.json")).try_answer("高雄天氣") is None
@@ -0,0 +1,112 @@
+# C:\llm_service\backend\weather_fast_path.py
+# 天氣快速回答: 簡單的「某城市天氣」問題直接以排程器寫出的結構化資料套用範本回答，不經過向量檢索與 LLM
+
+import re
+import json
+import time
+import logging
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from weather_sections import extract_cities
+
+logger = logging.getLogger(__name__)
+
+WEATHER_KEYWORDS = ('天氣', '氣溫', '溫度', '幾度', '冷不冷', '熱不熱', '下雨', '降雨', '會不會雨')
+# 出現這些詞表示問題需要推理、建議或超出「目前 + 未來 12 小時」的資料範圍，交給 LLM
+# (「天氣如何」「天氣怎麼樣」只是詢問現況，所以只排除「怎麼辦/怎麼會」這類需要推理的說法)
+OPEN_ENDED_KEYWORDS = (
+    '為什麼', '為何', '怎麼辦', '怎麼會', '建議', '適合', '應該', '要不要', '穿', '帶傘', '比較', '差異', '明天', '後天', '週', '禮拜',
+    '颱風', '地震', '空氣', '紫外線', '歷史', '去年', '平均', '趨勢', '解釋', '介紹'
+)
+
+
+class WeatherFastPath:
+    """
+    讀取 data/weather_structured.json (以檔案 mtime 快取)，對意圖與城市都明確的簡短天氣問題產生範本回答。
+    以下情況回傳 None，由呼叫端照常交給 LLM: 問題太長或屬開放式、沒有或有多個城市、該城市沒有資料、資料超過 max_age。
+    """
+
+    def __init__(self, data_path: str, max_question_length: int = 20, max_age: timedelta = timedelta(hours=3)):
+        self.data_path = Path(data_path)
+        self.max_question_length = max_question_length
+        self.max_age = max_age
+        self._cache = None  # (mtime, data)
+
+    def _load(self) -> Optional[Dict[str, Any]]:
+        try:
+            mtime = self.data_path.stat().st_mtime
+        except OSError:
+            return None
+        if self._cache and self._cache[0] == mtime:
+            return self._cache[1]
+        try:
+            with open(self.data_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"讀取結構化天氣資料失敗: {e}")
+            return None
+        self._cache = (mtime, data)
+        return data
+
+    def _is_simple_question(self, message: str) -> bool:
+        text = re.sub(r"[\s，。？！?!,.~～]", "", message)
+        if not text or len(text) > self.max_question_length: return False
+        if not any(keyword in text for keyword in WEATHER_KEYWORDS): return False
+        return not any(keyword in text for keyword in OPEN_ENDED_KEYWORDS)
+
+    def try_answer(self, message: str) -> Optional[Dict[str, Any]]:
+        """可直接回答時回傳與 LLMService.generate_response 相同格式的結果 (附 fast_path / fast_path_ms)，否則回傳 None"""
+        started = time.perf_counter()
+        if not self._is_simple_question(message): return None
+        cities = extract_cities(message)
+        if len(cities) != 1: return None
+        data = self._load()
+        if not data: return None
+        try:
+            generated_at = datetime.fromisoformat(data["generated_at"])
+        except (KeyError, ValueError):
+            return None
+        if datetime.now() - generated_at > self.max_age:
+            logger.info(f"結構化天氣資料已過期 ({data['generated_at']})，改由 LLM 回答")
+            return None
+        record = data.get("cities", {}).get(cities[0])
+        if not record: return None
+
+        response = self.render(record, generated_at)
+        if not response: return None
+        logger.info(f"天氣快速回答: {cities[0]}")
+        return {
+            "response": response, "user_query": message, "rag_used": False, "rag_context": "", "sources": ["中央氣象署 (O-A0003-001、F-C0032-001)"],
+            "cache_hit": False, "fast_path": "weather", "fast_path_ms": round((time.perf_counter() - started) * 1000, 2)
+        }
+
+    @staticmethod
+    def render(record: Dict[str, Any], generated_at: datetime) -> Optional[str]:
+        """以範本組出回答；觀測與預報都沒有可用數值時回傳 None"""
+        lines = []
+        name = record["location_name"]
+        observation = record.get("observation")
+        if observation:
+            obs_time = (observation.get("observation_time") or "").split("T")[-1][:5]
+            values = []
+            if observation.get("weather") and observation["weather"] != "-99": values.append(observation["weather"])
+            if observation.get("temperature_c") is not None: values.append(f"氣溫 {observation['temperature_c']}°C")
+            if observation.get("relative_humidity_percent") is not None: values.append(f"相對濕度 {observation['relative_humidity_percent']}%")
+            if observation.get("precipitation_mm") is not None: values.append(f"降雨量 {observation['precipitation_mm']} mm")
+            if values:
+                lines.append(f"{name}目前天氣 ({observation.get('station_name')}站{' ' + obs_time + ' 觀測' if obs_time else ''})：{'，'.join(values)}。")
+        forecast = record.get("forecast") or {}
+        parts = [forecast.get("weather_condition")]
+        if forecast.get("rain_probability", -1) >= 0: parts.append(f"降雨機率 {forecast['rain_probability']}%")
+        if forecast.get("min_temperature", -99) > -99 and forecast.get("max_temperature", -99) > -99:
+            parts.append(f"氣溫 {forecast['min_temperature']}°C 至 {forecast['max_temperature']}°C")
+        parts.append(forecast.get("comfort_index"))
+        parts = [p for p in parts if p and p != "N/A"]
+        if parts:
+            lines.append(f"未來 12 小時預報：{'，'.join(parts)}。")
+        if not lines: return None
+        lines.append(f"(資料來源：中央氣象署，更新時間 {generated_at.strftime('%Y-%m-%d %H:%M')})")
+        # 與 LLM 回答的後處理一致，統一用「台」
+        return "\n".join(lines).replace("臺", "台")
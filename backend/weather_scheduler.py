@@ -19,8 +19,10 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(level
 logger = logging.getLogger(__name__)
 
 class WeatherScheduler:
-    def __init__(self):
+    def __init__(self, include_all_stations: bool = False):
         self.weather_service = TaiwanWeatherService()
+        # True 時摘要另外附上全台所有測站的即時觀測 (每個縣市一段)，不只對應表中的代表測站
+        self.include_all_stations = include_all_stations
         self.data_dir = project_root / 'data'
         self.data_dir.mkdir(exist_ok=True)
         
@@ -40,13 +42,19 @@ class WeatherScheduler:
         """執行更新，生成包含預報(含舒適度)和即時觀測的混合摘要"""
         logger.info("=== [排程器] 開始生成最新的混合天氣摘要 (預報+觀測) ===")
         try:
-            forecast_summary = self.weather_service.get_weather_summary()
+            # 預報與全台測站觀測同時下載 (觀測每個週期只下載一次，之後各城市的查詢都由服務內的測站索引回答)
+            fetched = self.weather_service.fetch_all()
+            forecast_summary = fetched["forecast"]
             
             if not forecast_summary.get("success"):
                 logger.error(f"[排程器] 獲取天气預報摘要失敗: {forecast_summary.get('error')}")
                 return
+            if not fetched["observations_ok"]:
+                logger.warning("[排程器] 即時觀測下載失敗，將沿用上一次的測站索引 (若有)")
 
             text_parts = ["=== 台灣主要地区即時天氣與未來12小時預報摘要 ==="]
+            # 與文字摘要同一份資料的結構化版本，供 API 的天氣快速回答直接套用範本 (見 weather_fast_path.py)
+            structured = {}
             
             for city_forecast in forecast_summary['data']:
                 location_name = city_forecast.get('location_name')
@@ -61,11 +69,14 @@ class WeatherScheduler:
                     display_name = '桃園市 (參考新屋站觀測)'
                 
                 text_parts.append(f"\n【{display_name}】")
+                structured[location_name] = {"location_name": location_name, "display_name": display_name, "station_name": station_name,
+                                             "forecast": city_forecast, "observation": None}
 
                 if station_name:
                     current_weather = self.weather_service.get_current_weather(station_name)
                     if current_weather.get("success"):
                         current_data = current_weather['data']
+                        structured[location_name]["observation"] = current_data
                         obs_time_str = current_data.get('observation_time', 'N/A').split('T')[1].split('+')[0]
                         temp = current_data.get('temperature_c', 'N/A')
                         rh = current_data.get('relative_humidity_percent', 'N/A')
@@ -89,7 +100,17 @@ class WeatherScheduler:
                     text_parts.append(f"    - 溫度範圍: {min_temp}°C 至 {max_temp}°C")
                 text_parts.append(f"    - 舒適度: {comfort}")
 
-            text_parts.append(f"\n\n資料來源：中央氣象署 (即時觀測 O-A0003-001 + 鄉鎮預報 F-C0032-001)\n報告生成時間：{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+            stations = []
+            if self.include_all_stations:
+                all_weather = self.weather_service.get_all_current_weather()
+                if all_weather.get("success"):
+                    stations = all_weather['data']
+                    text_parts.extend(self._format_station_sections(stations))
+                else:
+                    logger.warning(f"無法獲取全台測站即時天氣: {all_weather.get('error')}")
+
+            generated_at = datetime.now()
+            text_parts.append(f"\n\n資料來源：中央氣象署 (即時觀測 O-A0003-001 + 鄉鎮預報 F-C0032-001)\n報告生成時間：{generated_at.strftime('%Y-%m-%d %H:%M:%S')}")
             final_text = "\n".join(text_parts)
             
             llm_file = self.data_dir / 'weather_for_llm.txt'
@@ -97,10 +118,34 @@ class WeatherScheduler:
                 f.write(final_text)
             logger.info(f"成功生成 LLM 專用混合天氣摘要檔案: {llm_file}")
 
+            structured_file = self.data_dir / 'weather_structured.json'
+            tmp_file = structured_file.with_suffix('.tmp')
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump({"generated_at": generated_at.isoformat(timespec='seconds'), "cities": structured, "stations": stations}, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_file, structured_file)  # 原子替換，API 不會讀到寫到一半的檔案
+            logger.info(f"成功生成結構化天氣資料: {structured_file}")
+
         except Exception as e:
             logger.error(f"[排程器] 執行更新任务时发生严重错误: {e}", exc_info=True)
             
-        logger.info("=== [排程器] 混合天氣摘要更新完成 ===")
+        logger.info(f"=== [排程器] 混合天氣摘要更新完成 (CWA 快取統計: {self.weather_service.cache.stats}) ===")
+
+    @staticmethod
+    def _format_station_sections(stations):
+        """全台測站依縣市分段 (【縣市 各測站即時觀測】)，讓動態知識庫切割後仍帶有 city metadata"""
+        by_county = {}
+        for station in stations:
+            by_county.setdefault(station.get('county') or '其他', []).append(station)
+        parts = []
+        for county, county_stations in by_county.items():
+            parts.append(f"\n【{county} 各測站即時觀測】")
+            for station in county_stations:
+                obs_time = (station.get('observation_time') or 'N/A').split('T')[-1].split('+')[0]
+                weather = station.get('weather') if station.get('weather') not in (None, '-99') else 'N/A'
+                parts.append(f"    - {station.get('station_name')} ({station.get('town') or 'N/A'}) @ {obs_time}: {weather} | "
+                             f"溫度: {station.get('temperature_c', 'N/A')}°C | 濕度: {station.get('relative_humidity_percent', 'N/A')}% | "
+                             f"降雨: {station.get('precipitation_mm', 'N/A')}mm")
+        return parts
 
     def start_continuous_mode(self):
         """(舊功能) 啟動連續執行的排程器"""
@@ -118,7 +163,7 @@ class WeatherScheduler:
             time.sleep(60)
 
 if __name__ == "__main__":
-    scheduler = WeatherScheduler()
+    scheduler = WeatherScheduler(include_all_stations='--all-stations' in sys.argv)
 
     if len(sys.argv) > 1 and sys.argv[1] == 'update':
         logger.info("偵測到 'update' 參數，執行單次更新任務...")
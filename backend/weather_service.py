@@ -3,8 +3,11 @@
 
 import os
 import sys
+import time
 import logging
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, Any, List, Optional
 
@@ -14,6 +17,7 @@ sys.path.append(str(project_root / "backend"))
 
 # 這裡不應該有 "from weather_service import ..."
 # 這是造成錯誤的那一行，現在已經被刪除
+from cwa_cache import CWAResponseCache
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -32,42 +36,62 @@ class TaiwanWeatherService:
             logger.warning(f"[警告] 找不到 .env 檔案於 {env_path}，將嘗試從系統環境變數讀取。")
         
         self.api_key = os.getenv("CWA_API_KEY")
-        if not self.api_key:
+        # CWA_CACHE_MODE=replay: 只讀取 CWA_CACHE_DIR 中錄製的回應，不連網 (測試 / 效能量測用，不需要 API Key)
+        cache_mode = os.getenv("CWA_CACHE_MODE", "live")
+        if not self.api_key and cache_mode != "replay":
             logger.error("CWA_API_KEY 環境變數未設定！程式可能無法正常運作。")
             
         self.base_url = "https://opendata.cwa.gov.tw/api/v1/rest/datastore"
         self.api_endpoint_forecast = "F-C0032-001" 
         self.api_endpoint_current = "O-A0003-001"
+        # 本地回應快取: 預報 6 小時發布一次，TTL 30 分鐘；觀測約 10 分鐘更新一次，TTL 5 分鐘
+        self.cache = CWAResponseCache(
+            os.getenv("CWA_CACHE_DIR", str(project_root / "data" / "cwa_cache")),
+            ttls={self.api_endpoint_forecast: 1800, self.api_endpoint_current: 300},
+            mode=cache_mode,
+        )
+        self.session = requests.Session()
         
         self.LOCATIONS_TO_QUERY = [
             '臺北市', '新北市', '桃園市', '臺中市', '臺南市', '高雄市', '基隆市', '屏東縣'
         ]
 
+        # 即時觀測索引: O-A0003-001 每次回傳全台所有測站，一個更新週期只下載一次，再依測站名稱 / ID 查詢
+        # CWA 約每 10 分鐘更新一次觀測，索引超過 observation_ttl 秒才重新下載
+        # 下載失敗後 observation_retry_backoff 秒內的查詢不再重試 (沿用舊索引或直接回報失敗)，避免 CWA 故障時每次查詢都重新下載
+        self.observation_ttl = 600
+        self.observation_retry_backoff = 300
+        self._observation_lock = threading.Lock()
+        self._stations_by_name: Dict[str, Dict[str, Any]] = {}
+        self._stations_by_id: Dict[str, Dict[str, Any]] = {}
+        self._observations_fetched_at = None
+        self._observations_failed_at = None
+
     def _make_request(self, api_endpoint: str, extra_params: Optional[Dict[str, str]] = None) -> Optional[dict]:
-        """通用型的 API 請求函式"""
-        if not self.api_key: 
+        """通用型的 API 請求函式 (經過本地回應快取，見 cwa_cache.py)"""
+        params = dict(extra_params or {})
+        if not self.api_key and self.cache.mode != "replay":
             logger.error("API Key 未設定，無法發送請求。")
             return None
-        
+
         url = f"{self.base_url}/{api_endpoint}"
-        
-        params = {"Authorization": self.api_key}
-        if extra_params:
-            params.update(extra_params)
-        
-        try:
-            response = requests.get(url, params=params, timeout=30)
-            logger.info(f"正在請求 API URL: {response.url}")
-            response.raise_for_status()
-            data = response.json()
-            if data.get("success") == "true":
-                logger.info(f"成功從 API ({api_endpoint}) 獲取資料。")
-                return data
-            logger.warning(f"API ({api_endpoint}) 回應 success=false。")
-            return None
-        except requests.RequestException as e:
-            logger.error(f"API ({api_endpoint}) 請求失敗: {e}")
-            return None
+
+        def request(headers: Dict[str, str]) -> requests.Response:
+            response = self.session.get(url, params={"Authorization": self.api_key, **params}, headers=headers, timeout=(5, 30))
+            logger.info(f"正在請求 API ({api_endpoint})，HTTP {response.status_code}")
+            return response
+
+        data = self.cache.fetch(api_endpoint, params, request, lambda d: d.get("success") == "true")
+        if data:
+            logger.info(f"成功從 API ({api_endpoint}) 獲取資料。")
+        return data
+
+    def fetch_all(self) -> Dict[str, Any]:
+        """同時請求預報與即時觀測 (兩個資料集互不相依)，回傳 {"forecast": get_weather_summary() 的結果, "observations_ok": bool}"""
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix="cwa-fetch") as pool:
+            forecast = pool.submit(self.get_weather_summary)
+            observations = pool.submit(self.refresh_observations)
+            return {"forecast": forecast.result(), "observations_ok": observations.result()}
 
     def get_weather_summary(self) -> Dict[str, Any]:
         """生成所有指定地區的天氣預報摘要"""
@@ -111,25 +135,44 @@ class TaiwanWeatherService:
             
         return {"success": True, "data": summary_data}
 
-    def get_current_weather(self, station_name: str) -> Dict[str, Any]:
-        """獲取指定觀測站的即時天氣資料 (O-A0003-001)"""
+    def refresh_observations(self) -> bool:
+        """下載一次全台測站即時觀測並重建名稱 / ID 索引；失敗時保留舊索引並回傳 False"""
         all_station_data = self._make_request(self.api_endpoint_current)
-
-        if not all_station_data:
-            return {"success": False, "error": "無法從即時觀測 API 獲取有效資料"}
-        
-        stations = all_station_data.get("records", {}).get("Station", [])
+        stations = all_station_data.get("records", {}).get("Station", []) if all_station_data else []
         if not stations:
-            logger.error("即時觀測 API 回應成功，但未包含任何測站資料 (Station 陣列為空)。")
-            return {"success": False, "error": "即時觀測 API 回應中缺少測站資料"}
+            if all_station_data:
+                logger.error("即時觀測 API 回應成功，但未包含任何測站資料 (Station 陣列為空)。")
+            with self._observation_lock:
+                self._observations_failed_at = time.monotonic()
+            return False
+
+        by_name, by_id = {}, {}
+        for station in stations:
+            observation = self._parse_station(station)
+            if observation["station_name"]: by_name[observation["station_name"]] = observation
+            if observation["station_id"]: by_id[observation["station_id"]] = observation
+        with self._observation_lock:
+            self._stations_by_name, self._stations_by_id = by_name, by_id
+            self._observations_fetched_at = time.monotonic()
+            self._observations_failed_at = None
+        logger.info(f"已建立即時觀測索引: {len(by_id)} 個測站")
+        return True
+
+    def _ensure_observations(self) -> bool:
+        """索引不存在或超過 observation_ttl 時重新下載；上次下載失敗未滿 observation_retry_backoff 秒時不重試"""
+        now = time.monotonic()
+        with self._observation_lock:
+            fresh = self._observations_fetched_at is not None and now - self._observations_fetched_at < self.observation_ttl
+            backing_off = self._observations_failed_at is not None and now - self._observations_failed_at < self.observation_retry_backoff
+            has_index = bool(self._stations_by_id)
+        if fresh: return True
+        if backing_off: return has_index
+        return self.refresh_observations() or bool(self._stations_by_id)
+
+    @staticmethod
+    def _parse_station(station: Dict[str, Any]) -> Dict[str, Any]:
+        weather_elements = station.get("WeatherElement", {})
 
-        target_station = next((s for s in stations if s.get("StationName") == station_name), None)
-        
-        if not target_station:
-            return {"success": False, "error": f"找不到名為 '{station_name}' 的觀測站"}
-
-        weather_elements = target_station.get("WeatherElement", {})
-        
         def clean_value(value, is_precipitation=False):
             """處理無效值"""
             try:
@@ -142,12 +185,12 @@ class TaiwanWeatherService:
 
         now_precipitation = weather_elements.get("Now", {}).get("Precipitation", -99)
 
-        result = {
-            "station_name": target_station.get("StationName"),
-            "station_id": target_station.get("StationId"),
-            "observation_time": target_station.get("ObsTime", {}).get("DateTime"),
-            "county": target_station.get("GeoInfo", {}).get("CountyName"),
-            "town": target_station.get("GeoInfo", {}).get("TownName"),
+        return {
+            "station_name": station.get("StationName"),
+            "station_id": station.get("StationId"),
+            "observation_time": station.get("ObsTime", {}).get("DateTime"),
+            "county": station.get("GeoInfo", {}).get("CountyName"),
+            "town": station.get("GeoInfo", {}).get("TownName"),
             "weather": weather_elements.get("Weather"),
             "temperature_c": clean_value(weather_elements.get("AirTemperature")),
             "relative_humidity_percent": clean_value(weather_elements.get("RelativeHumidity")),
@@ -156,7 +199,25 @@ class TaiwanWeatherService:
             "precipitation_mm": clean_value(now_precipitation, is_precipitation=True),
         }
 
-        return {"success": True, "data": result}
+    def get_current_weather(self, station: str) -> Dict[str, Any]:
+        """獲取指定觀測站 (名稱或測站 ID) 的即時天氣資料 (O-A0003-001)，由記憶體中的測站索引回答"""
+        if not self._ensure_observations():
+            return {"success": False, "error": "無法從即時觀測 API 獲取有效資料"}
+
+        with self._observation_lock:
+            observation = self._stations_by_name.get(station) or self._stations_by_id.get(station)
+        if not observation:
+            return {"success": False, "error": f"找不到名為 '{station}' 的觀測站"}
+        return {"success": True, "data": dict(observation)}
+
+    def get_all_current_weather(self) -> Dict[str, Any]:
+        """所有測站的即時天氣資料 (依測站 ID 排序)"""
+        if not self._ensure_observations():
+            return {"success": False, "error": "無法從即時觀測 API 獲取有效資料"}
+
+        with self._observation_lock:
+            stations = [dict(self._stations_by_id[station_id]) for station_id in sorted(self._stations_by_id)]
+        return {"success": True, "data": stations}
 
 # --- 程式碼測試區 ---
 if __name__ == "__main__":
@@ -2,7 +2,6 @@
 
 window.chat = {
     currentSessionId: null,
-    conversationHistory: [],
 
     // 初始化，綁定事件並獲取或創建 session
     init: function() {
@@ -39,46 +38,57 @@ window.chat = {
         const typingIndicator = document.getElementById('typingIndicator');
         if (typingIndicator) typingIndicator.style.display = 'inline-block';
 
+        let assistantBubble = null;
+        let streamedText = '';
+
         try {
             // 準備請求的 JSON body，格式與您的 app.py 完全匹配
+            // 對話歷史由後端依 session_id 從資料庫組裝，只需傳送新訊息
             const requestBody = {
                 message: message, // 參數名改回 'message'
-                session_id: this.currentSessionId, // 傳送當前的 session_id
-                conversation_history: this.conversationHistory // 傳送對話歷史
+                session_id: this.currentSessionId // 傳送當前的 session_id
             };
 
-            const response = await fetch(`${window.LLMApp.apiBaseUrl}/chat`, {
+            // 使用串流端點，token 一到就顯示
+            const response = await fetch(`${window.LLMApp.apiBaseUrl}/chat/stream`, {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: { 'Content-Type': 'application/json', 'Accept': 'text/event-stream' },
                 body: JSON.stringify(requestBody),
             });
 
-            if (typingIndicator) typingIndicator.style.display = 'none';
-
             if (!response.ok) {
+                if (typingIndicator) typingIndicator.style.display = 'none';
                 const errorData = await response.json();
                 throw new Error(`伺服器錯誤: ${response.status}. ${errorData.error || '未知錯誤'}`);
             }
 
-            const result = await response.json();
-            
-            // 更新 session_id (如果是新對話，後端會回傳一個新的)
-            if (result.session_id && !this.currentSessionId) {
-                this.currentSessionId = result.session_id;
-                localStorage.setItem('llm_session_id', this.currentSessionId);
-                console.log('New session started:', this.currentSessionId);
-            }
-            
-            // 更新對話歷史
-            this.conversationHistory.push({ "role": "user", "content": message });
-            this.conversationHistory.push({ "role": "assistant", "content": result.response });
+            let result = null;
+            await this.readEventStream(response, (event) => {
+                if (event.type === 'session') {
+                    this.updateSessionId(event.session_id);
+                } else if (event.type === 'token') {
+                    if (!assistantBubble) {
+                        if (typingIndicator) typingIndicator.style.display = 'none';
+                        assistantBubble = this.addMessageToUI('assistant', '');
+                    }
+                    streamedText += event.content;
+                    this.setBubbleText(assistantBubble, streamedText);
+                } else if (event.type === 'done') {
+                    result = event.result;
+                }
+            });
 
-            // 保持歷史紀錄不要太長 (例如只保留最近10輪對話)
-            if (this.conversationHistory.length > 20) {
-                this.conversationHistory = this.conversationHistory.slice(-20);
-            }
+            if (typingIndicator) typingIndicator.style.display = 'none';
+            if (!result) throw new Error('串流在完成前中斷');
+
+            this.updateSessionId(result.session_id);
             
-            this.addMessageToUI('assistant', result.response);
+            // 以後端處理過的最終回應為準 (例如去除首尾空白)
+            if (assistantBubble) {
+                this.setBubbleText(assistantBubble, result.response);
+            } else {
+                this.addMessageToUI('assistant', result.response);
+            }
 
         } catch (error) {
             console.error('Fetch error:', error);
@@ -87,6 +97,44 @@ window.chat = {
         }
     },
 
+    // 讀取 text/event-stream 回應，每解析出一筆 data 事件就呼叫 onEvent
+    readEventStream: async function(response, onEvent) {
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder('utf-8');
+        let buffer = '';
+
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                const dataLines = rawEvent.split('\n')
+                    .filter(line => line.startsWith('data:'))
+                    .map(line => line.slice(5).trimStart());
+                if (dataLines.length) onEvent(JSON.parse(dataLines.join('\n')));
+            }
+        }
+    },
+
+    // 更新 session_id (如果是新對話，或原本的 session 已不存在，後端會回傳一個新的)
+    updateSessionId: function(sessionId) {
+        if (sessionId && sessionId !== this.currentSessionId) {
+            this.currentSessionId = sessionId;
+            localStorage.setItem('llm_session_id', this.currentSessionId);
+            console.log('New session started:', this.currentSessionId);
+        }
+    },
+
+    setBubbleText: function(bubble, text) {
+        bubble.innerHTML = text.replace(/\n/g, '<br>');
+        const messagesContainer = document.getElementById('chatMessages');
+        if (messagesContainer) messagesContainer.scrollTop = messagesContainer.scrollHeight;
+    },
+
     // 將訊息新增到 UI 的輔助函數
     addMessageToUI: function(sender, text) {
         const messagesContainer = document.getElementById('chatMessages');
@@ -109,5 +157,6 @@ window.chat = {
         
         messagesContainer.appendChild(messageEntry);
         messagesContainer.scrollTop = messagesContainer.scrollHeight;
+        return bubble;
     }
 };
\ No newline at end of file
@@ -16,6 +16,8 @@ logger = logging.getLogger(__name__)
 
 from document_loader import DocumentLoader
 from vector_store import VectorStoreManager
+from ingestion import ingest_directory
+from build_static_db import main as build_static_db
 
 # --- 配置 ---
 PROJECT_ROOT = Path(__file__).parent.parent.parent
@@ -24,8 +26,8 @@ DYNAMIC_DATA_DIR = str(PROJECT_ROOT / "data")
 STATIC_DB_DIR = str(PROJECT_ROOT / "rag_system" / "embeddings" / "static_db")
 DYNAMIC_DB_DIR = str(PROJECT_ROOT / "rag_system" / "embeddings" / "dynamic_db")
 
-def build_database(db_path: str, collection_name: str, source_dir: str, file_pattern: str = "*"):
-    """建立或重建單個知識庫的通用函數，增加 file_pattern 參數"""
+def build_database(db_path: str, collection_name: str, source_dir: str, file_pattern: str = "*", store_type: str = "chroma"):
+    """建立或重建單個知識庫的通用函數，增加 file_pattern 參數；store_type 見 VectorStoreManager"""
     logger.info("-" * 20)
     logger.info(f"開始處理知識庫: {collection_name}")
     logger.info(f"來源目錄: {source_dir}")
@@ -39,17 +41,19 @@ def build_database(db_path: str, collection_name: str, source_dir: str, file_pat
     
     vsm = VectorStoreManager(
         persist_directory=db_path,
-        collection_name=collection_name
+        collection_name=collection_name,
+        store_type=store_type,
+        embedding_parity_check=True  # 非 torch 嵌入後端第一次使用時在建置時比對一致性，API 啟動時直接沿用結果
     )
     
     # 使用 DocumentLoader 的一個新方法來載入特定模式的檔案
     loader = DocumentLoader(source_dir)
-    documents = loader.load_all_documents(file_pattern=file_pattern) # 傳入模式
-    
-    if documents:
-        vsm.add_documents(documents)
-    else:
+    # 行程池平行解析檔案，片段以固定大小批次嵌入並寫入 (見 ingestion.py)
+    report = ingest_directory(vsm, loader, file_pattern=file_pattern)
+
+    if not report["files"]:
         logger.warning(f"在 '{source_dir}' 中未找到符合 '{file_pattern}' 模式的檔案。")
+    vsm.mark_rebuilt() # 通知回答快取: 知識庫已更新
         
     stats = vsm.get_stats()
     logger.info(f"知識庫 '{collection_name}' 處理完成。統計: {stats}")
@@ -58,11 +62,11 @@ def build_database(db_path: str, collection_name: str, source_dir: str, file_pat
 def main():
     logger.info("="*50); logger.info("啟動 RAG 雙知識庫重建腳本"); logger.info("="*50)
     
-    # 1. 重建靜態知識庫 (處理所有支援檔案)
-    build_database(STATIC_DB_DIR, "static_docs", STATIC_DOCS_DIR, "*")
+    # 1. 增量更新靜態知識庫 (只重新嵌入有變動的檔案，見 build_static_db.py)
+    build_static_db()
     
     # 2. 重建動態知識庫 ([核心優化] 只處理所有以 _for_llm.txt 結尾的檔案)
-    build_database(DYNAMIC_DB_DIR, "dynamic_data", DYNAMIC_DATA_DIR, "*_for_llm.txt")
+    build_database(DYNAMIC_DB_DIR, "dynamic_data", DYNAMIC_DATA_DIR, "*_for_llm.txt", store_type="numpy")
     
     logger.info("="*50); logger.info("所有知識庫重建完成！"); logger.info("="*50)
 
@@ -20,6 +20,7 @@ logger = logging.getLogger(__name__)
 
 from document_loader import DocumentLoader
 from vector_store import VectorStoreManager
+from ingestion import ingest_directory
 
 # --- 配置 ---
 PROJECT_ROOT = Path(__file__).parent.parent.parent
@@ -44,16 +45,17 @@ def build_dynamic_database():
     
     vsm = VectorStoreManager(
         persist_directory=DYNAMIC_DB_DIR,
-        collection_name="dynamic_data"
+        collection_name="dynamic_data",
+        store_type="numpy" # 動態庫只有少量片段，使用記憶體向量庫 (見 numpy_store.py)
     )
     
     loader = DocumentLoader(DYNAMIC_DATA_DIR)
-    documents = loader.load_all_documents(file_pattern="weather_for_llm.txt") # 精準匹配
-    
-    if documents:
-        vsm.add_documents(documents)
-    else:
+    # 行程池平行解析檔案，片段以固定大小批次嵌入並寫入 (見 ingestion.py)
+    report = ingest_directory(vsm, loader, file_pattern="weather_for_llm.txt")
+
+    if not report["files"]:
         logger.warning(f"在 '{DYNAMIC_DATA_DIR}' 中未找到 'weather_for_llm.txt' 檔案。")
+    vsm.mark_rebuilt() # 通知回答快取: 動態知識庫已更新
         
     stats = vsm.get_stats()
     logger.info(f"動態知識庫 'dynamic_data' 處理完成。統計: {stats}")
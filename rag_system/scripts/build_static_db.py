@@ -1,6 +1,7 @@
 # C:\llm_service\rag_system\scripts\build_static_db.py
 """
 只做靜態資料庫更新(rag)
+預設為增量更新: 依 index_manifest.json 只嵌入新增或修改的檔案、刪除已移除檔案的片段；加上 --full 則完整重建
 """
 
 import sys
@@ -18,53 +19,62 @@ logger = logging.getLogger(__name__)
 
 from document_loader import DocumentLoader
 from vector_store import VectorStoreManager
+from index_manifest import IndexManifest, MANIFEST_FILENAME, sync_directory
+from sparse_index import sparse_index_path
 
 # --- 配置 ---
 PROJECT_ROOT = Path(__file__).parent.parent.parent
 STATIC_DOCS_DIR = str(PROJECT_ROOT / "rag_system" / "documents")
 STATIC_DB_DIR = str(PROJECT_ROOT / "rag_system" / "embeddings" / "static_db")
 
-def main():
+def main(full_rebuild: bool = False):
     logger.info("==================================================")
-    logger.info("RAG 靜態知識庫重建腳本啟動")
+    logger.info(f"RAG 靜態知識庫{'完整重建' if full_rebuild else '增量更新'}腳本啟動")
     logger.info("==================================================")
 
     try:
-        # 1. 刪除舊的靜態資料庫目錄
-        if os.path.exists(STATIC_DB_DIR):
-            logger.warning(f"正在刪除舊的靜態資料庫目錄: {STATIC_DB_DIR}")
-            shutil.rmtree(STATIC_DB_DIR)
-            time.sleep(0.5) # 給系統一點時間
-            logger.info("舊靜態資料庫目錄已成功刪除。")
-        else:
-            logger.info("靜態資料庫目錄不存在，無需刪除。")
+        # 1. 沒有 manifest 或 BM25 索引 (舊版建置或首次執行) 或指定 --full 時，刪除舊的靜態資料庫目錄後完整重建
+        manifest = IndexManifest(os.path.join(STATIC_DB_DIR, MANIFEST_FILENAME))
+        if manifest.exists and not os.path.exists(sparse_index_path(STATIC_DB_DIR, "static_docs")):
+            logger.warning("找不到 BM25 索引，將完整重建靜態知識庫。")
+            full_rebuild = True
+        if full_rebuild or not manifest.exists:
+            if os.path.exists(STATIC_DB_DIR):
+                logger.warning(f"正在刪除舊的靜態資料庫目錄: {STATIC_DB_DIR}")
+                shutil.rmtree(STATIC_DB_DIR)
+                time.sleep(0.5) # 給系統一點時間
+                logger.info("舊靜態資料庫目錄已成功刪除。")
+            manifest = IndexManifest(os.path.join(STATIC_DB_DIR, MANIFEST_FILENAME))
 
         # 2. 初始化靜態 VectorStoreManager
         logger.info("正在初始化靜態向量資料庫管理器...")
         static_vsm = VectorStoreManager(
             persist_directory=STATIC_DB_DIR,
-            collection_name="static_docs"
+            collection_name="static_docs",
+            embedding_parity_check=True  # 非 torch 嵌入後端第一次使用時在建置時比對一致性，API 啟動時直接沿用結果
         )
         logger.info("靜態 VectorStoreManager 初始化完成。")
 
-        # 3. 處理靜態文件目錄
+        # 3. 比對靜態文件目錄，只處理新增、修改與刪除的檔案
         logger.info(f"--- 正在處理靜態文檔目錄: {STATIC_DOCS_DIR} ---")
         static_loader = DocumentLoader(STATIC_DOCS_DIR)
-        static_documents = static_loader.load_all_documents(file_pattern="*") # 索引所有文件
-        
-        if static_documents:
-            logger.info(f"偵測到 {len(static_documents)} 個靜態文檔片段，準備加入知識庫...")
-            static_vsm.add_documents(static_documents)
-            logger.info(f"成功添加 {len(static_documents)} 個靜態文檔片段。")
+        report = sync_directory(static_vsm, static_loader, manifest, file_pattern="*") # 索引所有文件
+        logger.info(f"新增 {report['added']} 個、更新 {report['updated']} 個、移除 {report['removed']} 個、未變動 {report['unchanged']} 個檔案"
+                    f" (失敗 {report['failed']} 個；片段 +{report['chunks_added']} / -{report['chunks_deleted']})")
+        if report["added"] or report["updated"] or report["removed"]:
+            static_vsm.mark_rebuilt()
         else:
-            logger.warning(f"在 '{STATIC_DOCS_DIR}' 中未找到可處理的靜態檔案。")
+            logger.info("靜態文件沒有變動，知識庫維持原狀。")
 
         # 4. 顯示最終統計
         final_stats = static_vsm.get_stats()
-        logger.info(f"靜態知識庫重建完成！最終統計: {json.dumps(final_stats, indent=2, ensure_ascii=False)}")
+        logger.info(f"靜態知識庫更新完成！最終統計: {json.dumps(final_stats, indent=2, ensure_ascii=False)}")
+        return report
 
     except Exception as e:
-        logger.error(f"靜態知識庫重建腳本執行失敗: {e}", exc_info=True)
+        logger.error(f"靜態知識庫更新腳本執行失敗: {e}", exc_info=True)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    # python build_static_db.py        -> 增量更新
+    # python build_static_db.py --full -> 刪除後完整重建
+    main(full_rebuild="--full" in sys.argv[1:])
@@ -0,0 +1,90 @@
+# C:\llm_service\rag_system\scripts\chunk_selection.py
+# 檢索結果的後處理: 相關度門檻、MMR 多樣化挑選、合併同來源互相重疊的相鄰片段 (切割時有 200 字重疊)
+
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+def apply_threshold(chunks: List[Dict[str, Any]], min_similarity: Optional[float]) -> List[Dict[str, Any]]:
+    """去掉與查詢的餘弦相似度低於 min_similarity 的片段；BM25 有命中 (精確關鍵字) 的片段保留"""
+    if min_similarity is None: return chunks
+    return [c for c in chunks if c.get("bm25_score") or c.get("similarity") is None or c["similarity"] >= min_similarity]
+
+
+def attach_vectors(query_vector, chunks: List[Dict[str, Any]], vectors: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """為沒有向量的片段 (BM25 找到的) 補上 vectors[id]，並計算與查詢的餘弦相似度"""
+    query = np.asarray(query_vector, dtype=np.float32)
+    query /= max(float(np.linalg.norm(query)), 1e-12)
+    for chunk in chunks:
+        if chunk.get("vector") is None and chunk.get("id") in vectors:
+            vector = np.asarray(vectors[chunk["id"]], dtype=np.float32)
+            chunk["vector"] = vector
+            chunk["similarity"] = round(float(vector @ query / max(float(np.linalg.norm(vector)), 1e-12)), 4)
+    return chunks
+
+
+def mmr_select(query_vector, chunks: List[Dict[str, Any]], k: int, lambda_mult: float = 0.7, relevance_key: str = "similarity") -> List[Dict[str, Any]]:
+    """
+    Maximal marginal relevance: 每次挑選 lambda * 相關度 - (1 - lambda) * 與已選片段的最大相似度 最高的片段。
+    相關度取 chunk[relevance_key] 並正規化到 [0, 1]；片段需帶 "vector" (沒有向量的片段視為與其他片段不相似)。
+    回傳的片段依挑選順序重新編號 rank。
+    """
+    if len(chunks) <= 1 or lambda_mult >= 1.0:
+        return [dict(c, rank=n) for n, c in enumerate(chunks[:k])]
+    relevance = np.array([float(c.get(relevance_key) or 0.0) for c in chunks], dtype=np.float32)
+    span = relevance.max() - relevance.min()
+    relevance = (relevance - relevance.min()) / span if span > 0 else np.ones_like(relevance)
+    dim = len(query_vector)
+    vectors = np.stack([np.asarray(c["vector"], dtype=np.float32) if c.get("vector") is not None else np.zeros(dim, dtype=np.float32) for c in chunks])
+    vectors /= np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+
+    selected: List[int] = []
+    max_overlap = np.zeros(len(chunks), dtype=np.float32)
+    while len(selected) < min(k, len(chunks)):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_overlap
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        max_overlap = np.maximum(max_overlap, vectors @ vectors[best])
+    return [dict(chunks[i], rank=n) for n, i in enumerate(selected)]
+
+
+def _overlap_length(head: str, tail: str, min_overlap: int, max_overlap: int) -> int:
+    """head 的結尾與 tail 的開頭相同的最長長度 (不足 min_overlap 回傳 0)"""
+    for length in range(min(len(head), len(tail), max_overlap), min_overlap - 1, -1):
+        if head.endswith(tail[:length]):
+            return length
+    return 0
+
+
+def merge_overlapping(chunks: List[Dict[str, Any]], min_overlap: int = 30, max_overlap: int = 400) -> List[Dict[str, Any]]:
+    """
+    合併同一來源、內容首尾重疊的相鄰片段 (A 的結尾 = B 的開頭)，避免重疊的文字在提示中出現兩次。
+    合併後的片段保留較好的分數與名次 (rank 取較小者)，並以 merged 記錄合併了幾個片段。
+    """
+    merged = [dict(c) for c in chunks]
+    changed = True
+    while changed:
+        changed = False
+        for i, a in enumerate(merged):
+            for j, b in enumerate(merged):
+                if i == j or not a.get("source") or a.get("source") != b.get("source"): continue
+                length = _overlap_length(a["content"], b["content"], min_overlap, max_overlap)
+                if not length: continue
+                combined = dict(a, content=a["content"] + b["content"][length:], rank=min(a.get("rank", 0), b.get("rank", 0)),
+                                merged=a.get("merged", 1) + b.get("merged", 1))
+                for key, better in (("score", min), ("similarity", max), ("rrf_score", max), ("bm25_score", max)):
+                    values = [v for v in (a.get(key), b.get(key)) if v is not None]
+                    if values: combined[key] = better(values)
+                merged = [c for n, c in enumerate(merged) if n not in (i, j)] + [combined]
+                changed = True
+                break
+            if changed: break
+    merged.sort(key=lambda c: c.get("rank", 0))
+    return merged
+
+
+def finalize(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """去掉內部使用的向量，依目前順序重新編號 rank"""
+    return [dict({key: value for key, value in chunk.items() if key != "vector"}, rank=rank) for rank, chunk in enumerate(chunks)]
@@ -4,16 +4,33 @@
 import os
 import logging
 import json
-from typing import List
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import List, Iterator, Optional, Tuple
 from pathlib import Path
 
 from langchain_community.document_loaders import PyPDFLoader, TextLoader, UnstructuredWordDocumentLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
 
+from weather_sections import split_weather_sections
+
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 行程池工作者各自持有一個 DocumentLoader (切割器等物件不必每個檔案重建)
+_worker_loader = None
+
+def _init_worker(documents_dir: str):
+    global _worker_loader
+    _worker_loader = DocumentLoader(documents_dir)
+
+def _load_in_worker(file_path: str) -> Tuple[str, List[Document]]:
+    return _safe_load(_worker_loader, file_path)
+
+def _safe_load(loader: "DocumentLoader", file_path: str) -> Tuple[str, List[Document]]:
+    try: return file_path, loader.load_document(file_path)
+    except Exception as e: logger.error(f"處理檔案 {Path(file_path).name} 時發生嚴重錯誤: {e}"); return file_path, []
+
 class DocumentLoader:
     def __init__(self, documents_dir: str):
         self.documents_dir = Path(documents_dir)
@@ -30,7 +47,12 @@ class DocumentLoader:
         except Exception as e: logger.error(f"載入 PDF 失敗: {file_path}, {e}"); return []
 
     def _load_text(self, file_path: str) -> List[Document]:
-        try: loader = TextLoader(file_path, encoding='utf-8'); return loader.load_and_split(self.text_splitter)
+        try:
+            if Path(file_path).name.endswith("_for_llm.txt"):
+                # 天氣摘要依【城市】段落切割，每個城市一個片段 (見 weather_sections.py)
+                with open(file_path, 'r', encoding='utf-8') as f: sections = split_weather_sections(f.read(), file_path)
+                if sections: return sections
+            loader = TextLoader(file_path, encoding='utf-8'); return loader.load_and_split(self.text_splitter)
         except Exception as e: logger.error(f"載入 TXT 失敗: {file_path}, {e}"); return []
 
     def _load_docx(self, file_path: str) -> List[Document]:
@@ -83,4 +105,34 @@ class DocumentLoader:
                     continue
         
         logger.info(f"目錄掃描完成，共載入 {len(all_documents)} 個文檔片段。")
-        return all_documents
\ No newline at end of file
+        return all_documents
+
+    def list_files(self, file_pattern: str = "*") -> List[str]:
+        """目錄中符合模式且格式受支援的檔案 (依路徑排序)"""
+        return sorted(str(p) for p in self.documents_dir.rglob(file_pattern) if p.is_file() and p.suffix.lower() in self.supported_extensions)
+
+    def iter_file_documents(self, file_pattern: str = "*", paths: Optional[List[str]] = None, workers: Optional[int] = None,
+                            max_pending: Optional[int] = None) -> Iterator[Tuple[str, List[Document]]]:
+        """
+        串流載入: 以行程池平行解析、切割檔案，依完成順序產出 (檔案路徑, 片段清單)。
+        同時在處理或等待取用的檔案最多 max_pending 個 (預設為 workers 的 2 倍)，
+        呼叫端一邊嵌入已產出的片段，行程池一邊解析後續檔案，記憶體用量不隨語料大小成長。
+        """
+        paths = self.list_files(file_pattern) if paths is None else list(paths)
+        workers = max(1, workers or os.cpu_count() or 1)
+        if workers == 1 or len(paths) <= 1:
+            for path in paths:
+                yield _safe_load(self, path)
+            return
+
+        max_pending = max_pending or workers * 2
+        remaining = iter(paths)
+        with ProcessPoolExecutor(max_workers=min(workers, len(paths)), initializer=_init_worker, initargs=(str(self.documents_dir),)) as pool:
+            pending = {pool.submit(_load_in_worker, path) for _, path in zip(range(max_pending), remaining)}
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    next_path = next(remaining, None)
+                    if next_path is not None: pending.add(pool.submit(_load_in_worker, next_path))
+                    yield future.result()
+
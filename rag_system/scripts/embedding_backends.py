@@ -0,0 +1,158 @@
+# C:\llm_service\rag_system\scripts\embedding_backends.py
+# 可切換的嵌入模型執行後端: torch (sentence-transformers，預設) / onnx / onnx-int8 (onnxruntime，CPU 較快)
+# 用法: python embedding_backends.py onnx-int8  -> 與 torch 版本比對向量一致性 (結果存檔，服務啟動時直接沿用) 並量測速度
+
+import os
+import sys
+import json
+import time
+import logging
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+# 匯出的 ONNX 模型存放位置 (第一次使用時自動匯出，之後直接載入)
+ONNX_CACHE_DIR = Path(__file__).parent.parent / "embeddings" / "onnx_models"
+PARITY_TEXTS = [
+    "今天台北的天氣如何？",
+    "什麼是人工智能？",
+    "機器學習是人工智能的一個分支，讓電腦從資料中學習。",
+    "高雄市 明天白天 多雲時晴 氣溫 26 - 32 度 降雨機率 20%",
+    "How does a transformer model encode a sentence?",
+]
+
+
+def create_embeddings(model_name: str, backend: str = "torch", batch_size: int = 32, num_threads: Optional[int] = None):
+    """建立指定後端的嵌入模型 (皆提供 embed_documents / embed_query，輸出已正規化的向量)"""
+    if backend not in BACKENDS:
+        raise ValueError(f"未知的嵌入後端 '{backend}'，可用: {', '.join(BACKENDS)}")
+    if backend == "torch":
+        if num_threads:
+            import torch
+            torch.set_num_threads(num_threads)
+        from langchain_huggingface import HuggingFaceEmbeddings
+        return HuggingFaceEmbeddings(
+            model_name=model_name,
+            model_kwargs={'device': 'cpu'},
+            encode_kwargs={'normalize_embeddings': True, 'batch_size': batch_size}
+        )
+    return OnnxEmbeddings(model_name, quantize=backend == "onnx-int8", batch_size=batch_size, num_threads=num_threads)
+
+
+class OnnxEmbeddings:
+    """
+    以 onnxruntime 執行 sentence-transformers 模型 (mean pooling + L2 正規化，與原模型相同)。
+    quantize=True 時使用動態 int8 量化的權重。需要 optimum[onnxruntime]。
+    """
+
+    def __init__(self, model_name: str, quantize: bool = False, batch_size: int = 32, num_threads: Optional[int] = None, max_length: int = 128):
+        import onnxruntime
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.backend_name = "onnx-int8" if quantize else "onnx"
+        self.batch_size = batch_size
+        self.max_length = max_length
+        export_dir = ONNX_CACHE_DIR / model_name.replace("/", "__")
+        file_name = self._ensure_exported(model_name, export_dir, quantize)
+
+        session_options = onnxruntime.SessionOptions()
+        if num_threads:
+            session_options.intra_op_num_threads = num_threads
+        self.tokenizer = AutoTokenizer.from_pretrained(str(export_dir))
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            str(export_dir), file_name=file_name, session_options=session_options, provider="CPUExecutionProvider"
+        )
+        logger.info(f"ONNX 嵌入模型已載入: {export_dir / file_name} (batch_size={batch_size}, threads={num_threads or 'auto'})")
+
+    @staticmethod
+    def _ensure_exported(model_name: str, export_dir: Path, quantize: bool) -> str:
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+        if not (export_dir / "model.onnx").exists():
+            logger.info(f"第一次使用，正在把 {model_name} 匯出為 ONNX: {export_dir}")
+            ORTModelForFeatureExtraction.from_pretrained(model_name, export=True).save_pretrained(str(export_dir))
+            AutoTokenizer.from_pretrained(model_name).save_pretrained(str(export_dir))
+        if not quantize:
+            return "model.onnx"
+        if not (export_dir / "model_quantized.onnx").exists():
+            from optimum.onnxruntime import ORTQuantizer
+            from optimum.onnxruntime.configuration import AutoQuantizationConfig
+            logger.info("正在產生 int8 動態量化模型...")
+            quantizer = ORTQuantizer.from_pretrained(str(export_dir), file_name="model.onnx")
+            quantizer.quantize(save_dir=str(export_dir), quantization_config=AutoQuantizationConfig.avx2(is_static=False, per_channel=False))
+        return "model_quantized.onnx"
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            inputs = self.tokenizer(list(texts[i:i + self.batch_size]), padding=True, truncation=True, max_length=self.max_length, return_tensors="pt")
+            hidden = self.model(**inputs).last_hidden_state.detach().numpy()
+            mask = inputs["attention_mask"].numpy()[..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            vectors.extend(pooled.astype(np.float32).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def check_parity(candidate, reference, texts: Optional[List[str]] = None, threshold: float = 0.99) -> Dict[str, Any]:
+    """比對兩個嵌入模型在相同文字上的向量 (餘弦相似度)；min_cosine 低於 threshold 視為不一致"""
+    texts = texts or PARITY_TEXTS
+    a = np.asarray(candidate.embed_documents(texts), dtype=np.float32)
+    b = np.asarray(reference.embed_documents(texts), dtype=np.float32)
+    cosine = (a * b).sum(axis=1) / (np.linalg.norm(a, axis=1) * np.linalg.norm(b, axis=1))
+    return {"min_cosine": round(float(cosine.min()), 5), "mean_cosine": round(float(cosine.mean()), 5), "threshold": threshold, "passed": bool(cosine.min() >= threshold)}
+
+
+def parity_result_path(model_name: str, backend: str) -> Path:
+    return ONNX_CACHE_DIR / model_name.replace("/", "__") / f"parity_{backend}.json"
+
+
+def load_parity_result(model_name: str, backend: str) -> Optional[Dict[str, Any]]:
+    """之前存下的一致性檢查結果 (匯出的 ONNX 模型不變時結果也不變)，沒有時回傳 None"""
+    try:
+        with open(parity_result_path(model_name, backend), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_parity_result(model_name: str, backend: str, result: Dict[str, Any]):
+    path = parity_result_path(model_name, backend)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, ensure_ascii=False, indent=1)
+
+
+def _benchmark(embeddings, texts: List[str], rounds: int = 3) -> Dict[str, float]:
+    embeddings.embed_documents(texts[:2])  # 暖機
+    started = time.perf_counter()
+    for _ in range(rounds): embeddings.embed_documents(texts)
+    batch_s = (time.perf_counter() - started) / rounds
+    started = time.perf_counter()
+    for text in texts[:20]: embeddings.embed_query(text)
+    query_ms = (time.perf_counter() - started) * 1000 / min(20, len(texts))
+    return {"texts_per_sec": round(len(texts) / batch_s, 1), "query_ms": round(query_ms, 2)}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    backend = sys.argv[1] if len(sys.argv) > 1 else "onnx-int8"
+    threads = int(os.getenv("RAG_EMBEDDING_THREADS", "0")) or None
+    reference = create_embeddings(DEFAULT_MODEL, "torch", num_threads=threads)
+    candidate = create_embeddings(DEFAULT_MODEL, backend, num_threads=threads)
+    parity = check_parity(candidate, reference)
+    save_parity_result(DEFAULT_MODEL, backend, parity)
+    logger.info(f"一致性檢查 ({backend} vs torch): {parity} (已存檔: {parity_result_path(DEFAULT_MODEL, backend)})")
+    sample = PARITY_TEXTS * 40
+    logger.info(f"torch: {_benchmark(reference, sample)}")
+    logger.info(f"{backend}: {_benchmark(candidate, sample)}")
@@ -0,0 +1,200 @@
+# C:\llm_service\rag_system\scripts\embedding_cache.py
+# 嵌入向量快取:
+# - QueryEmbeddingCache: 查詢向量的記憶體 LRU 快取，熱門或重複的問題不必再經過嵌入模型
+# - DocumentEmbeddingCache: 文件片段向量的 SQLite 快取 (以內容雜湊與模型名稱為鍵)，重建索引時沒變的文字不必重新嵌入
+
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Any, List
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_query_text(text: str) -> str:
+    """全半形統一並合併多餘空白 (只做不影響語意的正規化)"""
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text or "")).strip()
+
+
+class QueryEmbeddingCache:
+    """
+    正規化查詢文字 -> float32 向量 的有界 LRU 快取，同一個嵌入模型的所有集合共用。
+    同時以筆數 (max_entries) 與記憶體 (max_bytes，只計算向量本身) 設上限，超出時淘汰最久未使用者。
+    """
+
+    def __init__(self, max_entries: int = 10000, max_bytes: int = 32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def embed(self, texts: List[str], encode: Callable[[List[str]], List[List[float]]]) -> List[List[float]]:
+        """回傳 texts 的向量；未命中的查詢以一次 encode 呼叫批次編碼後存入快取"""
+        keys = [normalize_query_text(t) for t in texts]
+        vectors: Dict[str, np.ndarray] = {}
+        with self._lock:
+            for key in keys:
+                vector = self._entries.get(key)
+                if vector is not None:
+                    self._entries.move_to_end(key)
+                    vectors[key] = vector
+            missing = list(dict.fromkeys(k for k in keys if k not in vectors))
+            misses = sum(1 for k in keys if k not in vectors)
+            self._stats["hits"] += len(keys) - misses
+            self._stats["misses"] += misses
+
+        if missing:
+            encoded = encode(missing)
+            with self._lock:
+                for key, vector in zip(missing, encoded):
+                    vectors[key] = self._store(key, np.asarray(vector, dtype=np.float32))
+        return [vectors[key].tolist() for key in keys]
+
+    def _store(self, key: str, vector: np.ndarray) -> np.ndarray:
+        # 呼叫端須持有 self._lock
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous.nbytes
+        self._entries[key] = vector
+        self._bytes += vector.nbytes
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self._stats["evictions"] += 1
+        return vector
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats.update(entries=len(self._entries), bytes=self._bytes, max_entries=self.max_entries, max_bytes=self.max_bytes)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+class DocumentEmbeddingCache:
+    """
+    持久化的片段向量快取，以 (模型名稱, 文字 SHA-256) 為鍵、float32 位元組為值存於 SQLite。
+    總大小超過 max_bytes 時淘汰最久未使用的項目 (降到上限的 90%)；多個行程 (API 與建置腳本) 可共用同一個檔案。
+    """
+
+    def __init__(self, db_path: str, max_bytes: int = 512 * 1024 * 1024):
+        self.db_path = db_path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "evictions": 0}
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, content_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "size INTEGER NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (model, content_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def embed(self, model: str, texts: List[str], encode: Callable[[List[str]], List[List[float]]], chunk_size: int = 500) -> List[List[float]]:
+        """回傳 texts 的向量；只有快取未命中的文字會以 encode 批次編碼，並寫回快取"""
+        hashes = [self.text_hash(t) for t in texts]
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for i in range(0, len(hashes), chunk_size):
+                part = list(set(hashes[i:i + chunk_size]))
+                rows = self._conn.execute(
+                    f"SELECT content_hash, vector FROM embeddings WHERE model = ? AND content_hash IN ({','.join('?' * len(part))})",
+                    [model] + part
+                ).fetchall()
+                found.update((h, np.frombuffer(blob, dtype=np.float32).tolist()) for h, blob in rows)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE model = ? AND content_hash = ?", [(now, model, h) for h in found])
+                self._conn.commit()
+
+        missing = {}
+        for h, text in zip(hashes, texts):
+            if h not in found: missing.setdefault(h, text)
+        with self._lock:
+            self._stats["hits"] += sum(1 for h in hashes if h in found)
+            self._stats["misses"] += len(missing)
+
+        if missing:
+            vectors = encode(list(missing.values()))
+            now = time.time()
+            rows = []
+            for h, vector in zip(missing, vectors):
+                blob = np.asarray(vector, dtype=np.float32).tobytes()
+                found[h] = np.frombuffer(blob, dtype=np.float32).tolist()
+                rows.append((model, h, blob, len(blob), now))
+            with self._lock:
+                try:
+                    self._conn.executemany("INSERT OR REPLACE INTO embeddings (model, content_hash, vector, size, last_used) VALUES (?, ?, ?, ?, ?)", rows)
+                    self._conn.commit()
+                    self._evict()
+                except sqlite3.Error as e:
+                    logger.error(f"寫入嵌入快取失敗: {e}")
+        return [found[h] for h in hashes]
+
+    def _evict(self):
+        # 呼叫端須持有 self._lock
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes: return
+        target = total - int(self.max_bytes * 0.9)
+        removed = 0; freed = 0
+        for model, content_hash, size in self._conn.execute("SELECT model, content_hash, size FROM embeddings ORDER BY last_used").fetchall():
+            if freed >= target: break
+            self._conn.execute("DELETE FROM embeddings WHERE model = ? AND content_hash = ?", (model, content_hash))
+            freed += size; removed += 1
+        self._conn.commit()
+        self._stats["evictions"] += removed
+        logger.info(f"嵌入快取超過上限，淘汰 {removed} 筆 ({freed / 1024 / 1024:.1f} MB)")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            entries, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM embeddings").fetchone()
+        stats.update(entries=entries, bytes=total, max_bytes=self.max_bytes, db_path=self.db_path)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+class CachedEmbeddings:
+    """
+    包裝嵌入模型給 Chroma 使用: embed_documents 先查 DocumentEmbeddingCache，只編碼未命中的片段；
+    embed_query 直接交給原模型 (查詢向量由 QueryEmbeddingCache 負責，不寫入磁碟)。
+    """
+
+    def __init__(self, base, cache: DocumentEmbeddingCache, model_name: str):
+        self.base = base
+        self.cache = cache
+        self.model_name = model_name
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.cache.embed(self.model_name, list(texts), self.base.embed_documents)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.base.embed_query(text)
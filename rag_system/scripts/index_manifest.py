@@ -0,0 +1,124 @@
+# C:\llm_service\rag_system\scripts\index_manifest.py
+# 增量索引: 以內容雜湊清單 (manifest) 記錄每個來源檔案的大小、mtime、SHA-256 與片段 ID，只重新嵌入新增或修改的檔案
+
+import os
+import json
+import hashlib
+import logging
+from pathlib import Path
+from typing import Dict, Any, List, Optional
+
+from ingestion import IngestionProgress
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILENAME = "index_manifest.json"
+# v2: chunk_ids 也包含與其他檔案共用 (內容相同) 的片段；v1 的 manifest 會觸發完整重建
+MANIFEST_VERSION = 2
+
+
+def file_sha256(path: Path, block_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IndexManifest:
+    """
+    manifest 存放在向量資料庫目錄中，格式:
+    {"version": 2, "files": {相對路徑: {"size", "mtime", "sha256", "chunk_ids": [...]}}}
+    內容相同的片段只存一份，chunk_ids 列出檔案用到的所有片段 (包括由其他檔案先建立的)，一個片段可能出現在多個檔案中。
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path)
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.exists = self.path.exists()
+        if self.exists:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                if data.get("version") == MANIFEST_VERSION:
+                    self.files = data.get("files", {})
+                else:
+                    logger.warning(f"manifest 版本不符，視為不存在: {self.path}")
+                    self.exists = False
+            except (OSError, ValueError) as e:
+                logger.warning(f"讀取 manifest 失敗，視為不存在: {e}")
+                self.exists = False
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"version": MANIFEST_VERSION, "files": self.files}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)  # 原子替換，中途中斷也不會留下半個檔案
+
+    def unreferenced(self, chunk_ids: List[str]) -> List[str]:
+        """chunk_ids 中已沒有任何檔案用到的片段 (呼叫前須先從 files 移除或更新該檔案的紀錄)"""
+        referenced = {chunk_id for entry in self.files.values() for chunk_id in entry.get("chunk_ids", [])}
+        return sorted(set(chunk_ids) - referenced)
+
+
+def sync_directory(vsm, loader, manifest: IndexManifest, file_pattern: str = "*", workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    比對 loader.documents_dir 與 manifest，只載入、切割、嵌入新增或內容有變動的檔案，並刪除已移除檔案的片段。
+    大小與 mtime 都沒變的檔案直接略過 (不計算雜湊)；mtime 變了但雜湊相同的檔案只更新 manifest。
+    跨檔案完全相同的片段只嵌入一份，由所有用到它的檔案共用；只有沒有任何檔案再用到時才刪除。
+    回傳報告 {"added", "updated", "removed", "unchanged", "failed", "chunks_added", "chunks_deleted"}。
+    """
+    report = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "failed": 0, "chunks_added": 0, "chunks_deleted": 0}
+    root = Path(loader.documents_dir)
+    current = {}
+    for path in root.rglob(file_pattern):
+        if path.is_file() and path.suffix.lower() in loader.supported_extensions:
+            current[path.relative_to(root).as_posix()] = path
+
+    for rel_path in sorted(set(manifest.files) - set(current)):
+        chunk_ids = manifest.unreferenced(manifest.files.pop(rel_path).get("chunk_ids", []))
+        vsm.delete_documents(chunk_ids)
+        report["removed"] += 1; report["chunks_deleted"] += len(chunk_ids)
+        logger.info(f"已移除: {rel_path} (刪除 {len(chunk_ids)} 個片段)")
+
+    changed = {}
+    for rel_path, path in sorted(current.items()):
+        stat = path.stat()
+        entry = manifest.files.get(rel_path)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            report["unchanged"] += 1
+            continue
+        sha256 = file_sha256(path)
+        if entry and entry["sha256"] == sha256:
+            entry.update(size=stat.st_size, mtime=stat.st_mtime)
+            report["unchanged"] += 1
+            continue
+        changed[str(path)] = (rel_path, stat, sha256, entry)
+
+    # 變動的檔案在行程池中平行解析，依完成順序逐檔嵌入並更新 manifest
+    progress = IngestionProgress()
+    for path, documents in loader.iter_file_documents(paths=list(changed), workers=workers):
+        rel_path, stat, sha256, entry = changed[path]
+        progress.update(files=1, chunks=len(documents))
+        if not documents:
+            # 載入失敗時保留舊片段，下次執行再試
+            report["failed"] += 1
+            logger.warning(f"無法載入 {rel_path}，保留原有片段")
+            continue
+        # 片段 ID 由相對路徑 (與 manifest 的鍵相同) 與內容雜湊決定: 沒變的片段已存在而不會重新嵌入，只需刪除不再出現的舊片段
+        chunk_ids = vsm.add_documents(documents, source_root=str(root))
+        manifest.files[rel_path] = {"size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256, "chunk_ids": chunk_ids}
+        if entry:
+            stale = manifest.unreferenced(entry["chunk_ids"])
+            vsm.delete_documents(stale)
+            report["chunks_deleted"] += len(stale)
+        report["updated" if entry else "added"] += 1
+        report["chunks_added"] += len(set(chunk_ids) - set(entry["chunk_ids"] if entry else []))
+        logger.info(f"{'已更新' if entry else '已新增'}: {rel_path} ({len(chunk_ids)} 個片段)")
+        manifest.save()  # 每個檔案完成後寫入，中斷時已完成的部分不必重做
+    if changed:
+        logger.info(f"處理 {len(changed)} 個變動的檔案 ({progress.rates()})")
+
+    manifest.save()
+    return report
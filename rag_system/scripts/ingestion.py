@@ -0,0 +1,64 @@
+# C:\llm_service\rag_system\scripts\ingestion.py
+# 串流匯入管線: 行程池解析切割 -> 有界的片段串流 -> 固定大小批次嵌入與寫入，並回報 files/sec、chunks/sec
+
+import time
+import logging
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionProgress:
+    """累計已處理的檔案與片段數，每 interval 秒輸出一次速率"""
+
+    def __init__(self, interval: float = 5.0):
+        self.interval = interval
+        self.started = time.perf_counter()
+        self._last_report = self.started
+        self.files = 0
+        self.chunks = 0
+
+    def update(self, files: int = 0, chunks: int = 0):
+        self.files += files
+        self.chunks += chunks
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            logger.info(f"匯入進度: {self.files} 個檔案、{self.chunks} 個片段 ({self.rates()})")
+
+    def rates(self) -> str:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return f"{self.files / elapsed:.1f} files/sec, {self.chunks / elapsed:.1f} chunks/sec"
+
+    def report(self) -> Dict[str, Any]:
+        elapsed = time.perf_counter() - self.started
+        return {
+            "files": self.files, "chunks": self.chunks, "elapsed_s": round(elapsed, 2),
+            "files_per_sec": round(self.files / elapsed, 2) if elapsed else 0.0,
+            "chunks_per_sec": round(self.chunks / elapsed, 2) if elapsed else 0.0
+        }
+
+
+def ingest_directory(vsm, loader, file_pattern: str = "*", batch_size: int = 256, workers: Optional[int] = None) -> Dict[str, Any]:
+    """
+    把 loader.documents_dir 中符合模式的檔案匯入 vsm。
+    檔案在行程池中平行解析 (DocumentLoader.iter_file_documents)，片段每滿 batch_size 個就嵌入並寫入，
+    同時只保留一個批次與有限個已解析檔案在記憶體中。回傳 {"files", "chunks", "stored", "elapsed_s", "files_per_sec", "chunks_per_sec"}。
+    """
+    progress = IngestionProgress()
+    batch = []
+    stored = 0
+    for _, documents in loader.iter_file_documents(file_pattern, workers=workers):
+        batch.extend(documents)
+        while len(batch) >= batch_size:
+            stored += len(vsm.add_documents(batch[:batch_size], source_root=str(loader.documents_dir)))
+            progress.update(chunks=batch_size)
+            del batch[:batch_size]
+        progress.update(files=1)
+    if batch:
+        stored += len(vsm.add_documents(batch, source_root=str(loader.documents_dir)))
+        progress.update(chunks=len(batch))
+    report = progress.report()
+    report["stored"] = stored
+    logger.info(f"匯入完成: {report['files']} 個檔案、{report['chunks']} 個片段 (寫入 {stored} 個)，耗時 {report['elapsed_s']} 秒 ({progress.rates()})")
+    return report
@@ -0,0 +1,171 @@
+# C:\llm_service\rag_system\scripts\numpy_store.py
+# 小型集合用的記憶體向量庫: 連續的正規化 float32 矩陣 + 精確內積 top-k，可選擇快照到磁碟 (vectors.npy + documents.json)
+
+import os
+import json
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain.schema import Document
+
+logger = logging.getLogger(__name__)
+
+
+def metadata_matches(metadata: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """Chroma where 篩選的子集: {"欄位": 值} 或 {"欄位": {"$in": [...]}}，多個欄位須同時符合"""
+    for key, condition in (where or {}).items():
+        value = metadata.get(key)
+        if isinstance(condition, dict) and "$in" in condition:
+            if value not in condition["$in"]: return False
+        elif value != condition:
+            return False
+    return True
+
+
+class NumpyVectorStore:
+    """
+    提供 VectorStoreManager 用到的 Chroma 介面子集 (add_documents / delete，以及 _collection.get / query / count)，
+    適合幾百到幾萬個片段、每小時整批重建的動態知識庫。
+    - 分數與 Chroma 預設的 l2 空間相同 (平方歐氏距離，越小越相關)；向量已正規化，等於 2 - 2 * 內積
+    - snapshot_dir 不為 None 時，每次異動後原子寫入快照；其他行程 (例如 API) 在快照更新後的下一次查詢自動重新載入
+    """
+
+    def __init__(self, embedding_function, snapshot_dir: Optional[str] = None, collection_name: str = "default_collection"):
+        self.embedding_function = embedding_function
+        self.collection_name = collection_name
+        self._lock = threading.RLock()
+        self._ids: List[str] = []
+        self._documents: List[Dict[str, Any]] = []
+        self._index: Dict[str, int] = {}
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._snapshot_mtime = None
+        self._vectors_path = self._documents_path = None
+        if snapshot_dir:
+            Path(snapshot_dir).mkdir(parents=True, exist_ok=True)
+            self._vectors_path = Path(snapshot_dir) / f"{collection_name}.vectors.npy"
+            self._documents_path = Path(snapshot_dir) / f"{collection_name}.documents.json"
+            self._reload_if_changed()
+
+    # 與 Chroma 相同的存取方式: vector_store._collection.get(...) / query(...) / count()
+    @property
+    def _collection(self) -> "NumpyVectorStore":
+        return self
+
+    def count(self) -> int:
+        self._reload_if_changed()
+        return len(self._ids)
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None, include: Optional[List[str]] = None) -> Dict[str, Any]:
+        """支援依 ids 查詢，或 where={"欄位": {"$in": [...]}} / {"欄位": 值} 的 metadata 篩選；include 可含 embeddings"""
+        self._reload_if_changed()
+        with self._lock:
+            if ids is not None:
+                rows = [self._index[i] for i in ids if i in self._index]
+            else:
+                rows = [row for row, doc in enumerate(self._documents) if metadata_matches(doc["metadata"], where)]
+            result = {"ids": [self._ids[r] for r in rows], "metadatas": [self._documents[r]["metadata"] for r in rows]}
+            if include and "embeddings" in include:
+                result["embeddings"] = [self._matrix[r].copy() for r in rows]
+            return result
+
+    def add_documents(self, documents: List[Document], ids: List[str]) -> List[str]:
+        """upsert: ID 已存在的片段以新內容取代"""
+        if not documents: return []
+        vectors = self._normalize(np.asarray(self.embedding_function.embed_documents([d.page_content for d in documents]), dtype=np.float32))
+        with self._lock:
+            if self._matrix.size == 0:
+                self._matrix = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+            new_rows = []
+            for doc, chunk_id, vector in zip(documents, ids, vectors):
+                entry = {"page_content": doc.page_content, "metadata": dict(doc.metadata)}
+                row = self._index.get(chunk_id)
+                if row is not None:
+                    self._documents[row] = entry
+                    self._matrix[row] = vector
+                else:
+                    self._index[chunk_id] = len(self._ids)
+                    self._ids.append(chunk_id); self._documents.append(entry); new_rows.append(vector)
+            if new_rows:
+                self._matrix = np.vstack([self._matrix, np.stack(new_rows)])
+            self._persist()
+        return list(ids)
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            remove = {self._index[i] for i in ids if i in self._index}
+            if not remove: return
+            keep = [row for row in range(len(self._ids)) if row not in remove]
+            self._ids = [self._ids[r] for r in keep]
+            self._documents = [self._documents[r] for r in keep]
+            self._matrix = np.ascontiguousarray(self._matrix[keep])
+            self._index = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+            self._persist()
+
+    def query(self, query_embeddings: List[List[float]], n_results: int = 10, where: Optional[Dict[str, Any]] = None,
+              include: Optional[List[str]] = None) -> Dict[str, List[list]]:
+        """與 chromadb Collection.query 相同的回傳格式 (每個查詢一個清單)；include 可含 embeddings"""
+        self._reload_if_changed()
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": []}
+        with self._lock:
+            rows = np.array([row for row, doc in enumerate(self._documents) if metadata_matches(doc["metadata"], where)], dtype=np.int64) if where \
+                else np.arange(len(self._ids))
+            for embedding in query_embeddings:
+                top = np.array([], dtype=np.int64); similarities = np.array([], dtype=np.float32)
+                if len(rows):
+                    query = self._normalize(np.asarray(embedding, dtype=np.float32)[None, :])[0]
+                    similarities = self._matrix[rows] @ query
+                    k = min(n_results, len(rows))
+                    top = np.argpartition(-similarities, k - 1)[:k]
+                    top = top[np.argsort(-similarities[top])]
+                result["ids"].append([self._ids[rows[t]] for t in top])
+                result["documents"].append([self._documents[rows[t]]["page_content"] for t in top])
+                result["metadatas"].append([self._documents[rows[t]]["metadata"] for t in top])
+                result["distances"].append([float(2.0 - 2.0 * similarities[t]) for t in top])
+                if include and "embeddings" in include:
+                    result["embeddings"].append([self._matrix[rows[t]].copy() for t in top])
+        return result
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        return np.ascontiguousarray(matrix / np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None), dtype=np.float32)
+
+    # --- 快照 ---
+    def _persist(self):
+        # 呼叫端須持有 self._lock
+        if self._vectors_path is None: return
+        tmp_vectors = self._vectors_path.with_name(self._vectors_path.name + ".tmp")
+        tmp_documents = self._documents_path.with_suffix(".tmp")
+        with open(tmp_vectors, 'wb') as f:
+            np.save(f, self._matrix)
+        with open(tmp_documents, 'w', encoding='utf-8') as f:
+            json.dump({"ids": self._ids, "documents": self._documents}, f, ensure_ascii=False)
+        # 先換向量再換文件: 讀取端以文件檔的 mtime 判斷是否重新載入
+        os.replace(tmp_vectors, self._vectors_path)
+        os.replace(tmp_documents, self._documents_path)
+        self._snapshot_mtime = self._documents_path.stat().st_mtime
+
+    def _reload_if_changed(self):
+        if self._documents_path is None: return
+        try:
+            mtime = self._documents_path.stat().st_mtime
+        except OSError:
+            return  # 快照不存在 (尚未建置或正在重建)，沿用記憶體中的資料
+        if mtime == self._snapshot_mtime: return
+        with self._lock:
+            try:
+                with open(self._documents_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                matrix = np.load(self._vectors_path)
+            except (OSError, ValueError) as e:
+                logger.warning(f"讀取向量快照失敗，沿用目前資料: {e}")
+                return
+            if len(matrix) != len(data["ids"]):
+                return  # 寫入進行到一半，下次查詢再載入
+            self._ids, self._documents = data["ids"], data["documents"]
+            self._matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+            self._index = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+            self._snapshot_mtime = mtime
+            logger.info(f"已載入向量快照 '{self.collection_name}' ({len(self._ids)} 個片段)")
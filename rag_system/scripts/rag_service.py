@@ -2,19 +2,31 @@
 # 版本: v5.0 - 純服務版 (無管理功能)
 
 import os
+import time
 import logging
-from typing import List, Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
 from pathlib import Path
 import sys
 import json
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
-from vector_store import VectorStoreManager
+from vector_store import VectorStoreManager, DEFAULT_MIN_SIMILARITY, DEFAULT_MMR_LAMBDA
+from chunk_selection import apply_threshold, attach_vectors, mmr_select, merge_overlapping, finalize
+from resource_registry import get_registry_stats
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class RAGService:
+    STATIC_SECTION = "相關專業知識"
+    DYNAMIC_SECTION = "相關即時資訊"
+    RRF_K = 60              # reciprocal-rank fusion 的平滑常數
+    HYBRID_CANDIDATES = 4   # 向量與 BM25 各取 k 的幾倍候選，再融合、過濾與挑選
+    MIN_SIMILARITY = DEFAULT_MIN_SIMILARITY  # 與查詢的餘弦相似度門檻 (BM25 有命中的片段不受限)
+    MMR_LAMBDA = DEFAULT_MMR_LAMBDA          # MMR 相關度權重，1.0 為不做多樣化
+    SEARCH_WORKERS = 8      # 平行檢索的執行緒數；每個請求最多佔用一個 (最後一個知識庫在呼叫端執行緒檢索)
+
     def __init__(self):
         project_root = Path(__file__).parent.parent.parent
         
@@ -35,39 +47,153 @@ class RAGService:
         try:
             self.dynamic_vsm = VectorStoreManager(
                 persist_directory=dynamic_db_path,
-                collection_name="dynamic_data"
+                collection_name="dynamic_data",
+                store_type="numpy"  # 快照由 build_dbs.py 寫入，更新後下一次查詢自動重新載入
             )
         except Exception as e:
             logger.error(f"載入動態知識庫失敗: {e}", exc_info=True)
             self.dynamic_vsm = None
             
+        # 同時檢索多個知識庫: 第一個知識庫交給執行緒池，最後一個在呼叫端執行緒檢索，同時處理的請求不會全部排在少數執行緒後面
+        self._search_executor = ThreadPoolExecutor(max_workers=self.SEARCH_WORKERS, thread_name_prefix="rag-search")
         logger.info("RAG 服務初始化完成。")
 
-    def query(self, query_text: str, k: int = 3, use_static: bool = True, use_dynamic: bool = True) -> Dict[str, Any]:
-        all_context_parts = []
-        
-        if use_static and self.static_vsm:
-            logger.info("正在查詢靜態知識庫...")
-            static_context = self.static_vsm.get_relevant_context(query_text, k=k)
-            if static_context:
-                all_context_parts.append("--- 相關專業知識 ---\n" + static_context)
-        
-        if use_dynamic and self.dynamic_vsm:
-            logger.info("正在查詢動態知識庫...")
-            dynamic_context = self.dynamic_vsm.get_relevant_context(query_text, k=k)
-            if dynamic_context:
-                all_context_parts.append("--- 相關即時資訊 ---\n" + dynamic_context)
-        
-        if not all_context_parts:
-            return {"has_context": False, "context": ""}
+    def query(self, query_text: str, k: int = 3, use_static: bool = True, use_dynamic: bool = True, hybrid: bool = True,
+              metadata_filter: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        回傳 {"has_context", "context", "chunks", "timings"}。
+        chunks 為各知識庫的候選片段 (含 section 標題與 rank)，供 LLMService 依 token 預算組裝提示；
+        context 則為全部片段串接後的文字；timings 為查詢編碼與各知識庫檢索的毫秒數。
+        hybrid=True 時每個知識庫的候選為向量檢索與 BM25 關鍵字檢索以 RRF 融合的結果 (片段附 rrf_score / bm25_score)。
+        候選經相似度門檻過濾、MMR 挑出最多 k 個不重複的片段，再合併同來源互相重疊的片段；每個片段附 score (向量距離) 與 similarity。
+        metadata_filter 只套用在動態知識庫 (例如 {"city": "臺北市"}，靜態文件沒有這些 metadata)；篩選後沒有任何片段時改為不篩選。
+        """
+        per_query, timings = self._search([query_text], k, use_static, use_dynamic, hybrid, [metadata_filter])
+        result = self._to_result(per_query[0])
+        result["timings"] = timings
+        return result
+
+    def query_batch(self, query_texts: List[str], k: int = 3, use_static: bool = True, use_dynamic: bool = True, hybrid: bool = True,
+                    metadata_filters: Optional[List[Optional[Dict[str, Any]]]] = None) -> List[Dict[str, Any]]:
+        """
+        query() 的批次版本: 所有查詢一次批次編碼，再逐筆以向量檢索；metadata_filters 為每筆查詢的動態庫篩選 (可為 None)。
+        回傳與 query_texts 等長、順序相同的結果清單。
+        """
+        if not query_texts: return []
+        per_query, _ = self._search(query_texts, k, use_static, use_dynamic, hybrid, metadata_filters)
+        return [self._to_result(chunks) for chunks in per_query]
+
+    def _search(self, query_texts: List[str], k: int, use_static: bool, use_dynamic: bool, hybrid: bool = True,
+                metadata_filters: Optional[List[Optional[Dict[str, Any]]]] = None):
+        """
+        查詢文字只編碼一次 (使用相同嵌入模型的知識庫共用向量)，再同時檢索所有啟用的知識庫
+        (最後一個在呼叫端執行緒，其餘交給執行緒池)。
+        回傳 (每個查詢的片段清單, timings)。
+        """
+        started = time.perf_counter()
+        targets = [(vsm, collection, section) for enabled, vsm, collection, section in (
+            (use_static, self.static_vsm, "static", self.STATIC_SECTION),
+            (use_dynamic, self.dynamic_vsm, "dynamic", self.DYNAMIC_SECTION)) if enabled and vsm]
+        timings = {}
+        metadata_filters = list(metadata_filters or []) + [None] * (len(query_texts) - len(metadata_filters or []))
+        vectors_by_model = {}
+        for vsm, _, _ in targets:
+            if vsm.embedding_key not in vectors_by_model:
+                vectors_by_model[vsm.embedding_key] = vsm.embed_queries(query_texts)
+        timings["embedding_ms"] = round((time.perf_counter() - started) * 1000, 1)
+
+        def search_collection(vsm, collection, section):
+            collection_started = time.perf_counter()
+            logger.info(f"正在查詢{'靜態' if collection == 'static' else '動態'}知識庫 ({len(query_texts)} 筆)...")
+            results = [
+                [dict(chunk, collection=collection, section=section) for chunk in self._select(vsm, text, vector, k, hybrid, where if collection == "dynamic" else None)]
+                for text, vector, where in zip(query_texts, vectors_by_model[vsm.embedding_key], metadata_filters)
+            ]
+            return results, round((time.perf_counter() - collection_started) * 1000, 1)
+
+        futures = {collection: self._search_executor.submit(search_collection, vsm, collection, section) for vsm, collection, section in targets[:-1]}
+        found_by_collection = {targets[-1][1]: search_collection(*targets[-1])} if targets else {}
+        found_by_collection.update({collection: future.result() for collection, future in futures.items()})
+        per_query = [[] for _ in query_texts]
+        # 依固定順序 (靜態在前) 合併，維持與逐一查詢時相同的片段順序
+        for _, collection, _ in targets:
+            results, elapsed_ms = found_by_collection[collection]
+            timings[f"{collection}_ms"] = elapsed_ms
+            for chunks, found in zip(per_query, results):
+                chunks.extend(found)
+        timings["total_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return per_query, timings
+
+    def _select(self, vsm: VectorStoreManager, text: str, vector: List[float], k: int, hybrid: bool, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """單一知識庫: 取候選 (依 where 篩選) -> (RRF 融合) -> 相似度門檻 -> MMR -> 合併重疊片段"""
+        candidates = k * self.HYBRID_CANDIDATES
+        pool = vsm.get_relevant_chunks_by_vector(vector, k=candidates, with_vectors=True, where=where)
+        if where and not pool:
+            # 沒有符合篩選的片段 (例如該城市不在資料中，或知識庫是舊版建置而沒有 metadata)
+            logger.info(f"沒有符合 {where} 的片段，改為不篩選")
+            where = None
+            pool = vsm.get_relevant_chunks_by_vector(vector, k=candidates, with_vectors=True)
+        relevance = "similarity"
+        if hybrid:
+            pool = self.fuse([pool, vsm.get_relevant_chunks_sparse(text, k=candidates, where=where)], candidates)
+            attach_vectors(vector, pool, vsm.get_vectors([c["id"] for c in pool if c.get("vector") is None and c.get("id")]))
+            relevance = "rrf_score"
+        pool = apply_threshold(pool, self.MIN_SIMILARITY)
+        return finalize(merge_overlapping(mmr_select(vector, pool, k, self.MMR_LAMBDA, relevance)))
+
+    @classmethod
+    def fuse(cls, rankings: List[List[Dict[str, Any]]], k: int) -> List[Dict[str, Any]]:
+        """
+        Reciprocal-rank fusion: 每個片段的分數為 sum(1 / (RRF_K + 名次))，以內容雜湊合併不同檢索方式找到的同一片段。
+        回傳前 k 個 (rank 依融合後的順序重新編號，保留向量距離 score 與 bm25_score)。
+        """
+        fused: Dict[str, Dict[str, Any]] = {}
+        for ranking in rankings:
+            for position, chunk in enumerate(ranking):
+                key = chunk.get("content_sha256") or chunk["content"]
+                entry = fused.get(key)
+                if entry is None:
+                    entry = fused[key] = dict(chunk, rrf_score=0.0)
+                else:
+                    for field, value in chunk.items():
+                        if entry.get(field) is None: entry[field] = value
+                entry["rrf_score"] += 1.0 / (cls.RRF_K + position + 1)
+        top = sorted(fused.values(), key=lambda c: c["rrf_score"], reverse=True)[:k]
+        return [dict(chunk, rank=rank, rrf_score=round(chunk["rrf_score"], 5)) for rank, chunk in enumerate(top)]
+
+    def _to_result(self, all_chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+        if not all_chunks:
+            return {"has_context": False, "context": "", "chunks": []}
         
         return {
             "has_context": True,
-            "context": "\n\n".join(all_context_parts)
+            "context": self.format_context(all_chunks),
+            "chunks": all_chunks
         }
+
+    @staticmethod
+    def format_context(chunks: List[Dict[str, Any]]) -> str:
+        """依知識庫分段串接片段，格式與舊版 query() 的 context 相同"""
+        sections = {}
+        for chunk in chunks:
+            sections.setdefault(chunk["section"], []).append(chunk["content"])
+        return "\n\n".join(f"--- {section} ---\n" + "\n\n---\n\n".join(parts) for section, parts in sections.items())
     
+    def get_dynamic_version(self) -> Optional[str]:
+        """動態知識庫目前的建置版本，每次重建天氣資料後都會改變"""
+        return self.dynamic_vsm.get_build_version() if self.dynamic_vsm else None
+
+    def close(self):
+        """釋放兩個知識庫對共用資源的參考"""
+        for vsm in (self.static_vsm, self.dynamic_vsm):
+            if vsm: vsm.close()
+        self._search_executor.shutdown(wait=False)
+
     def get_system_status(self) -> Dict[str, Any]:
+        vsm = self.static_vsm or self.dynamic_vsm
         return {
             "static_db": self.static_vsm.get_stats() if self.static_vsm else "Not loaded",
-            "dynamic_db": self.dynamic_vsm.get_stats() if self.dynamic_vsm else "Not loaded"
+            "dynamic_db": self.dynamic_vsm.get_stats() if self.dynamic_vsm else "Not loaded",
+            "query_embedding_cache": vsm.query_cache.get_stats() if vsm else None,
+            "shared_resources": get_registry_stats()
         }
\ No newline at end of file
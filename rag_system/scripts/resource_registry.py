@@ -0,0 +1,137 @@
+# C:\llm_service\rag_system\scripts\resource_registry.py
+# 行程內共用的嵌入模型與 Chroma 用戶端: 同一個模型只載入一次、同一個資料庫目錄只建立一個用戶端，以參考計數管理釋放
+
+import os
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class RefCountedRegistry:
+    """
+    以鍵管理共用資源: acquire 時不存在才呼叫 factory 建立，每次 acquire 計數加一；
+    release 使計數減一，歸零時移除並呼叫資源的 close() (若有)。
+    """
+
+    def __init__(self, kind: str):
+        self.kind = kind
+        self._lock = threading.Lock()
+        self._entries: Dict[str, list] = {}  # key -> [resource, refcount]
+
+    def acquire(self, key: str, factory: Callable[[], Any]) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                logger.info(f"建立共用{self.kind}: {key}")
+                entry = self._entries[key] = [factory(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] > 0:
+                return
+            del self._entries[key]
+        logger.info(f"釋放共用{self.kind}: {key}")
+        close = getattr(entry[0], "close", None)
+        if callable(close):
+            try:
+                close()
+            except Exception as e:
+                logger.warning(f"關閉{self.kind} '{key}' 失敗: {e}")
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {key: entry[1] for key, entry in self._entries.items()}
+
+
+_embeddings = RefCountedRegistry("嵌入模型")
+_chroma_clients = RefCountedRegistry("Chroma 用戶端")
+_query_caches = RefCountedRegistry("查詢向量快取")
+_document_caches = RefCountedRegistry("片段嵌入快取")
+
+
+def _embeddings_key(model_name: str, backend: str) -> str:
+    return model_name if backend == "torch" else f"{model_name}:{backend}"
+
+
+def acquire_embeddings(model_name: str, backend: str = "torch", batch_size: int = 32, num_threads: Optional[int] = None, parity_check: bool = False):
+    """
+    取得共用的嵌入模型。backend 為 onnx / onnx-int8 時，依存檔的一致性檢查結果 (與 torch 版本的向量比對) 決定是否使用，
+    不一致或無法載入 (例如未安裝 optimum) 時退回 torch，避免查詢向量與既有索引不相容。
+    還沒有檢查結果時: parity_check=True (建置腳本) 載入 torch 版本比對一次並存檔；否則 (API 啟動) 直接使用並提示執行檢查，
+    服務啟動時不會為了比對再載入一份 torch 模型。
+    """
+    def factory():
+        from embedding_backends import create_embeddings, check_parity, load_parity_result, save_parity_result
+        if backend != "torch":
+            try:
+                candidate = create_embeddings(model_name, backend, batch_size, num_threads)
+                parity = load_parity_result(model_name, backend)
+                if parity is None and parity_check:
+                    parity = check_parity(candidate, create_embeddings(model_name, "torch", batch_size, num_threads))
+                    save_parity_result(model_name, backend, parity)
+                if parity is None:
+                    logger.warning(f"嵌入後端 {backend} 尚未做一致性檢查，請執行 python embedding_backends.py {backend} 或建置腳本")
+                    return candidate
+                if parity["passed"]:
+                    logger.info(f"嵌入後端 {backend} 一致性檢查通過: {parity}")
+                    return candidate
+                logger.error(f"嵌入後端 {backend} 與 torch 的向量不一致 {parity}，改用 torch")
+            except Exception as e:
+                logger.error(f"無法載入嵌入後端 {backend}，改用 torch: {e}")
+        return create_embeddings(model_name, "torch", batch_size, num_threads)
+    return _embeddings.acquire(_embeddings_key(model_name, backend), factory)
+
+
+def release_embeddings(model_name: str, backend: str = "torch"):
+    _embeddings.release(_embeddings_key(model_name, backend))
+
+
+def acquire_query_cache(model_name: str, max_entries: int = 10000, max_bytes: int = 32 * 1024 * 1024):
+    """每個嵌入模型一份查詢向量快取 (大小以第一個取得者的設定為準)"""
+    def factory():
+        from embedding_cache import QueryEmbeddingCache
+        return QueryEmbeddingCache(max_entries=max_entries, max_bytes=max_bytes)
+    return _query_caches.acquire(model_name, factory)
+
+
+def release_query_cache(model_name: str):
+    _query_caches.release(model_name)
+
+
+def acquire_document_cache(db_path: str, max_bytes: int = 512 * 1024 * 1024):
+    """每個快取檔案一個 SQLite 連線 (大小上限以第一個取得者的設定為準)"""
+    key = os.path.abspath(db_path)
+    def factory():
+        from embedding_cache import DocumentEmbeddingCache
+        return DocumentEmbeddingCache(key, max_bytes=max_bytes)
+    return _document_caches.acquire(key, factory)
+
+
+def release_document_cache(db_path: str):
+    _document_caches.release(os.path.abspath(db_path))
+
+
+def acquire_chroma_client(persist_directory: str):
+    key = os.path.abspath(persist_directory)
+    def factory():
+        import chromadb
+        return chromadb.PersistentClient(path=key)
+    return _chroma_clients.acquire(key, factory)
+
+
+def release_chroma_client(persist_directory: str):
+    _chroma_clients.release(os.path.abspath(persist_directory))
+
+
+def get_registry_stats() -> Dict[str, Dict[str, int]]:
+    """目前共用中的資源與其參考數"""
+    return {"embeddings": _embeddings.get_stats(), "chroma_clients": _chroma_clients.get_stats(), "query_caches": _query_caches.get_stats(),
+            "document_caches": _document_caches.get_stats()}
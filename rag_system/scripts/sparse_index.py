@@ -0,0 +1,167 @@
+# C:\llm_service\rag_system\scripts\sparse_index.py
+# 稀疏檢索: 以 jieba 斷詞建立的 BM25 倒排索引，與向量庫一起在匯入時建立，補足地名、測站名稱與專有名詞的精確比對
+
+import os
+import re
+import json
+import math
+import logging
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import jieba
+
+from embedding_cache import normalize_query_text
+from numpy_store import metadata_matches
+
+logger = logging.getLogger(__name__)
+jieba.setLogLevel(logging.WARNING)
+
+# v2: 斷詞時統一「臺/台」；載入舊版索引時以儲存的內容重新斷詞
+SPARSE_INDEX_VERSION = 2
+
+
+def sparse_index_path(persist_directory: str, collection_name: str) -> str:
+    return str(Path(persist_directory) / f"{collection_name}.bm25.json")
+
+
+_CJK_RUN = re.compile(r"[\u4e00-\u9fff]{2,}")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    全半形正規化、轉小寫並統一「臺」為「台」(CWA 資料寫「臺北市」，使用者多半打「台北」) 後以 jieba 搜尋引擎模式斷詞
+    (去掉空白與標點)，再加上中文連續字的二字組。
+    jieba 的詞典以簡體為主，繁體地名常被切錯 (例如「台北市」-> 台 / 北市)，二字組讓「台北」「高雄」等查詢仍能命中。
+    """
+    text = normalize_query_text(text).lower().replace("臺", "台")
+    tokens = [token for token in jieba.lcut_for_search(text) if re.search(r"\w", token)]
+    for run in _CJK_RUN.findall(text):
+        tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    片段 ID -> (內容, metadata, 詞頻) 的 BM25 倒排索引，持久化為 JSON。
+    add / delete 只修改記憶體，save() 時才寫入 (建置腳本在 mark_rebuilt 時呼叫)；
+    其他行程 (API) 在檔案更新後的下一次查詢自動重新載入。
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = Path(path)
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._docs: Dict[str, Dict[str, Any]] = {}
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._total_length = 0
+        self._loaded_mtime = None
+        self._dirty = False
+        self._outdated = False  # 載入的是舊版本的檔案，save() 時即使沒有異動也寫回
+        self._reload_if_changed()
+
+    @property
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def add(self, ids: List[str], documents: List[Any]):
+        """upsert: ID 已存在時以新內容重新建立索引"""
+        with self._lock:
+            for chunk_id, doc in zip(ids, documents):
+                self._remove(chunk_id)
+                tf = dict(Counter(tokenize(doc.page_content)))
+                self._docs[chunk_id] = {"content": doc.page_content, "metadata": dict(doc.metadata), "tf": tf, "length": sum(tf.values())}
+                self._index(chunk_id)
+            self._dirty = True
+
+    def delete(self, ids: List[str]):
+        with self._lock:
+            for chunk_id in ids:
+                self._remove(chunk_id)
+            self._dirty = True
+
+    def _index(self, chunk_id: str):
+        # 呼叫端須持有 self._lock
+        entry = self._docs[chunk_id]
+        for term, count in entry["tf"].items():
+            self._postings.setdefault(term, {})[chunk_id] = count
+        self._total_length += entry["length"]
+
+    def _remove(self, chunk_id: str):
+        # 呼叫端須持有 self._lock
+        entry = self._docs.pop(chunk_id, None)
+        if entry is None: return
+        for term in entry["tf"]:
+            postings = self._postings.get(term)
+            if postings is None: continue
+            postings.pop(chunk_id, None)
+            if not postings: del self._postings[term]
+        self._total_length -= entry["length"]
+
+    def search(self, query: str, k: int = 10, where: Optional[Dict[str, Any]] = None) -> List[Tuple[Dict[str, Any], float]]:
+        """
+        回傳 [(片段 {"id", "content", "metadata"}, BM25 分數)]，分數由高到低，只包含至少命中一個詞的片段。
+        where 為 metadata 篩選 (格式同 Chroma，見 numpy_store.metadata_matches)；文件頻率仍以整個集合計算。
+        """
+        self._reload_if_changed()
+        terms = set(tokenize(query))
+        with self._lock:
+            n = len(self._docs)
+            if not n or not terms: return []
+            avg_length = self._total_length / n or 1.0
+            scores: Dict[str, float] = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings: continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    if where and not metadata_matches(self._docs[chunk_id]["metadata"], where): continue
+                    norm = tf + self.k1 * (1 - self.b + self.b * self._docs[chunk_id]["length"] / avg_length)
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+            top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [({"id": chunk_id, "content": self._docs[chunk_id]["content"], "metadata": self._docs[chunk_id]["metadata"]}, score) for chunk_id, score in top]
+
+    def save(self):
+        with self._lock:
+            if not self._dirty and not self._outdated and self.exists: return
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"version": SPARSE_INDEX_VERSION, "docs": self._docs}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+            self._loaded_mtime = self.path.stat().st_mtime
+            self._dirty = self._outdated = False
+        logger.info(f"已寫入 BM25 索引: {self.path} ({len(self._docs)} 個片段、{len(self._postings)} 個詞)")
+
+    def _reload_if_changed(self):
+        try:
+            mtime = self.path.stat().st_mtime
+        except OSError:
+            return  # 尚未建立 (或正在重建)，沿用記憶體中的資料
+        with self._lock:
+            if mtime == self._loaded_mtime or self._dirty: return
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"讀取 BM25 索引失敗，沿用目前資料: {e}")
+                return
+            self._docs, self._postings, self._total_length = data.get("docs", {}), {}, 0
+            if data.get("version") != SPARSE_INDEX_VERSION:
+                # 斷詞規則不同: 以儲存的片段內容重新斷詞 (建置腳本下次 save() 時寫回新版本)
+                logger.info(f"BM25 索引版本 {data.get('version')} 與目前版本 {SPARSE_INDEX_VERSION} 不同，重新斷詞: {self.path}")
+                for entry in self._docs.values():
+                    entry["tf"] = dict(Counter(tokenize(entry["content"])))
+                    entry["length"] = sum(entry["tf"].values())
+            self._outdated = data.get("version") != SPARSE_INDEX_VERSION
+            for chunk_id in self._docs:
+                self._index(chunk_id)
+            self._loaded_mtime = mtime
+
+    def get_stats(self) -> Dict[str, Any]:
+        self._reload_if_changed()
+        with self._lock:
+            return {"documents": len(self._docs), "terms": len(self._postings), "path": str(self.path)}
@@ -0,0 +1,55 @@
+# C:\llm_service\rag_system\scripts\test_chunk_selection.py
+# 檢索後處理 (門檻、MMR、重疊合併) 的離線單元測試: python -m pytest rag_system/scripts/test_chunk_selection.py
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from chunk_selection import apply_threshold, attach_vectors, finalize, merge_overlapping, mmr_select
+
+
+def test_threshold_keeps_bm25_hits():
+    chunks = [{"id": "a", "similarity": 0.8}, {"id": "b", "similarity": 0.1}, {"id": "c", "similarity": 0.1, "bm25_score": 3.2}]
+    assert [c["id"] for c in apply_threshold(chunks, 0.3)] == ["a", "c"]
+    assert apply_threshold(chunks, None) == chunks
+
+
+def test_attach_vectors_computes_similarity():
+    chunks = attach_vectors([1.0, 0.0], [{"id": "a"}, {"id": "b", "vector": np.array([0.0, 1.0])}], {"a": [3.0, 4.0]})
+    assert chunks[0]["similarity"] == 0.6
+    assert "similarity" not in chunks[1]
+
+
+def test_mmr_prefers_diverse_chunks():
+    query = [1.0, 0.0, 0.0]
+    chunks = [
+        {"id": "a", "similarity": 0.95, "vector": np.array([0.9, 0.43, 0.0])},
+        {"id": "a-copy", "similarity": 0.94, "vector": np.array([0.9, 0.43, 0.0])},
+        {"id": "b", "similarity": 0.80, "vector": np.array([0.8, 0.0, 0.6])},
+        {"id": "c", "similarity": 0.30, "vector": np.array([0.0, 0.0, 1.0])},
+    ]
+    selected = mmr_select(query, chunks, 2, lambda_mult=0.5)
+    assert [c["id"] for c in selected] == ["a", "b"]
+    assert [c["rank"] for c in selected] == [0, 1]
+    assert [c["id"] for c in mmr_select(query, chunks, 2, lambda_mult=1.0)] == ["a", "a-copy"]
+
+
+def test_merge_overlapping_neighbours():
+    overlap = "重疊的文字" * 8
+    chunks = [
+        {"source": "a.txt", "content": "開頭" + overlap, "rank": 1, "similarity": 0.5},
+        {"source": "a.txt", "content": overlap + "結尾", "rank": 0, "similarity": 0.7},
+        {"source": "b.txt", "content": overlap + "其他", "rank": 2, "similarity": 0.4},
+    ]
+    merged = merge_overlapping(chunks)
+    assert merged[0]["content"] == "開頭" + overlap + "結尾"
+    assert merged[0]["rank"] == 0 and merged[0]["similarity"] == 0.7 and merged[0]["merged"] == 2
+    assert merged[1]["source"] == "b.txt"
+
+
+def test_finalize_strips_vectors_and_renumbers():
+    chunks = finalize([{"id": "x", "rank": 5, "vector": np.zeros(2)}, {"id": "y", "rank": 9}])
+    assert [c["rank"] for c in chunks] == [0, 1] and all("vector" not in c for c in chunks)
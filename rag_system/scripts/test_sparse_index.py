@@ -0,0 +1,52 @@
+# C:\llm_service\rag_system\scripts\test_sparse_index.py
+# BM25 稀疏索引的離線單元測試 (不需要嵌入模型或向量庫): python -m pytest rag_system/scripts/test_sparse_index.py
+
+import os
+import sys
+import json
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from langchain.schema import Document
+
+from sparse_index import BM25Index, tokenize
+
+
+def _index(tmp_path, texts):
+    index = BM25Index(str(tmp_path / "test.bm25.json"))
+    index.add([f"id{i}" for i in range(len(texts))], [Document(page_content=text, metadata={"source": f"s{i}.txt"}) for i, text in enumerate(texts)])
+    return index
+
+
+def test_tokenize_folds_tai_variants():
+    assert set(tokenize("台北天氣")) & set(tokenize("臺北市"))
+    assert "臺" not in "".join(tokenize("臺北市即時天氣"))
+
+
+def test_search_matches_tai_variants(tmp_path):
+    index = _index(tmp_path, ["【臺北市】\n  [即時天氣 @ 04:10:00]\n    - 溫度: 28.1°C", "【高雄市】\n  [即時天氣 @ 04:10:00]\n    - 溫度: 30.2°C"])
+    assert [chunk["id"] for chunk, _ in index.search("台北", k=5)] == ["id0"]
+    assert [chunk["id"] for chunk, _ in index.search("臺北", k=5)] == ["id0"]
+    assert index.search("台北天氣", k=5)[0][0]["id"] == "id0"
+
+
+def test_search_where_filter(tmp_path):
+    index = _index(tmp_path, ["臺北市 溫度", "高雄市 溫度"])
+    hits = index.search("溫度", k=5, where={"source": {"$in": ["s1.txt"]}})
+    assert [chunk["id"] for chunk, _ in hits] == ["id1"]
+
+
+def test_save_reload_and_outdated_version(tmp_path):
+    index = _index(tmp_path, ["臺北市 多雲"])
+    index.save()
+    # 模擬舊版 (未統一「臺/台」) 的索引檔: 載入時應以內容重新斷詞
+    path = tmp_path / "test.bm25.json"
+    data = json.loads(path.read_text(encoding="utf-8"))
+    data["version"] = 1
+    data["docs"]["id0"]["tf"] = {"臺北市": 1}
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+    reloaded = BM25Index(str(path))
+    assert reloaded.search("台北", k=1)[0][0]["id"] == "id0"
+    reloaded.save()
+    assert json.loads(path.read_text(encoding="utf-8"))["version"] != 1
@@ -0,0 +1,25 @@
+# C:\llm_service\rag_system\scripts\test_weather_sections.py
+# 縣市名稱辨識的離線單元測試: python -m pytest rag_system/scripts/test_weather_sections.py
+
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from weather_sections import extract_cities, normalize_city
+
+
+def test_extract_cities_full_and_short_names():
+    assert extract_cities("台北跟高雄天氣") == ["臺北市", "高雄市"]
+    assert extract_cities("新竹縣和新竹的天氣") == ["新竹縣"]
+    assert extract_cities("嘉義天氣") == ["嘉義市"]
+    assert extract_cities("今天天氣") == []
+
+
+def test_short_name_needs_boundary():
+    assert extract_cities("新北投溫泉附近天氣") == []
+    assert extract_cities("台北新北投天氣") == ["臺北市"]
+    assert extract_cities("基隆路會下雨嗎") == []
+    assert extract_cities("新北天氣") == ["新北市"]
+    assert normalize_city("新北投") is None
+    assert normalize_city("屏東内埔 (參考屏東縣預報)") == "屏東縣"
@@ -2,78 +2,284 @@
 
 import os
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 from pathlib import Path
 import shutil
 import time
+import json
+import uuid
+import hashlib
+from datetime import datetime
 
 # LangChain imports
 from langchain.schema import Document
 from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+
+from resource_registry import (acquire_embeddings, release_embeddings, acquire_chroma_client, release_chroma_client,
+                               acquire_query_cache, release_query_cache, acquire_document_cache, release_document_cache)
+from embedding_cache import CachedEmbeddings
+from numpy_store import NumpyVectorStore
+from sparse_index import BM25Index, sparse_index_path
+from chunk_selection import apply_threshold, mmr_select, merge_overlapping, finalize
+
+STORE_TYPES = ("chroma", "numpy")
+# 檢索後處理的預設值: 餘弦相似度低於門檻的片段不送進提示；MMR 的 lambda 越小越重視多樣性 (1.0 等於不做 MMR)
+DEFAULT_MIN_SIMILARITY = 0.3
+DEFAULT_MMR_LAMBDA = 0.7
+# 片段嵌入的持久化快取 (放在各知識庫目錄之外，重建時刪除資料庫目錄也不會清掉)
+DEFAULT_EMBEDDING_CACHE_PATH = str(Path(__file__).parent.parent / "embeddings" / "embedding_cache.db")
 
 class VectorStoreManager:
-    def __init__(self, persist_directory: str, collection_name: str = "default_collection", embedding_model: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"):
+    def __init__(self, persist_directory: str, collection_name: str = "default_collection", embedding_model: str = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
+                 query_cache_entries: int = 10000, query_cache_mb: float = 32,
+                 embedding_cache_path: Optional[str] = DEFAULT_EMBEDDING_CACHE_PATH, embedding_cache_mb: float = 512,
+                 embedding_backend: Optional[str] = None, embedding_batch_size: Optional[int] = None, embedding_threads: Optional[int] = None,
+                 store_type: str = "chroma", embedding_parity_check: bool = False):
         """
         [修正] persist_directory 和 collection_name 變為必要/可選參數
+        query_cache_entries / query_cache_mb: 查詢向量 LRU 快取的筆數與記憶體上限 (同一模型的集合共用一份)
+        embedding_cache_path / embedding_cache_mb: 片段嵌入的 SQLite 快取位置與大小上限，embedding_cache_path 為 None 時停用
+        embedding_backend / embedding_batch_size / embedding_threads: 嵌入模型執行後端 (torch / onnx / onnx-int8)、批次大小與執行緒數，
+            未指定時讀取環境變數 RAG_EMBEDDING_BACKEND、RAG_EMBEDDING_BATCH_SIZE、RAG_EMBEDDING_THREADS
+        embedding_parity_check: 非 torch 後端還沒有存檔的一致性檢查結果時，是否載入 torch 版本比對一次 (建置腳本使用；API 啟動時不做)
+        store_type: "chroma" (預設，磁碟上的 Chroma/HNSW) 或 "numpy" (記憶體矩陣 + 精確搜尋，快照存於 persist_directory，適合每小時重建的小型集合)
         """
+        if store_type not in STORE_TYPES:
+            raise ValueError(f"未知的向量庫類型 '{store_type}'，可用: {', '.join(STORE_TYPES)}")
         self.persist_directory = persist_directory
         self.collection_name = collection_name
+        self.store_type = store_type
         self.embedding_model_name = embedding_model
+        self.embedding_backend = embedding_backend or os.getenv("RAG_EMBEDDING_BACKEND", "torch")
+        embedding_batch_size = embedding_batch_size or int(os.getenv("RAG_EMBEDDING_BATCH_SIZE", "32"))
+        embedding_threads = embedding_threads or int(os.getenv("RAG_EMBEDDING_THREADS", "0")) or None
         
         Path(self.persist_directory).mkdir(parents=True, exist_ok=True)
         
         logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
         self.logger = logging.getLogger(__name__)
         
-        self.logger.info(f"載入嵌入模型: {embedding_model}")
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=embedding_model,
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': True}
-        )
+        # 嵌入模型與 Chroma 用戶端由行程內的 registry 共用，多個集合不會重複載入模型
+        self.logger.info(f"載入嵌入模型: {embedding_model} (後端: {self.embedding_backend})")
+        self.embeddings = acquire_embeddings(embedding_model, self.embedding_backend, embedding_batch_size, embedding_threads, embedding_parity_check)
+        # 不同後端的向量有些微差異，快取以「模型:實際後端」區分 (載入失敗退回 torch 時即為模型名稱本身)
+        effective_backend = getattr(self.embeddings, "backend_name", "torch")
+        self.embedding_key = embedding_model if effective_backend == "torch" else f"{embedding_model}:{effective_backend}"
+        self.query_cache = acquire_query_cache(self.embedding_key, query_cache_entries, int(query_cache_mb * 1024 * 1024))
         
-        self.logger.info(f"初始化 ChromaDB: 目錄='{self.persist_directory}', 集合='{self.collection_name}'")
-        self.vector_store = Chroma(
-            collection_name=self.collection_name,
-            persist_directory=self.persist_directory,
-            embedding_function=self.embeddings
-        )
-
-    def add_documents(self, documents: List[Document], batch_size: int = 4000) -> List[str]:
+        # 加入文件時先查片段嵌入快取，只有沒看過的文字才送進模型
+        self.embedding_cache_path = embedding_cache_path
+        self.document_cache = acquire_document_cache(embedding_cache_path, int(embedding_cache_mb * 1024 * 1024)) if embedding_cache_path else None
+        embedding_function = CachedEmbeddings(self.embeddings, self.document_cache, self.embedding_key) if self.document_cache else self.embeddings
+        if store_type == "numpy":
+            self.logger.info(f"初始化記憶體向量庫: 快照目錄='{self.persist_directory}', 集合='{self.collection_name}'")
+            self.client = None
+            self.vector_store = NumpyVectorStore(embedding_function, snapshot_dir=self.persist_directory, collection_name=self.collection_name)
+        else:
+            self.logger.info(f"初始化 ChromaDB: 目錄='{self.persist_directory}', 集合='{self.collection_name}'")
+            self.client = acquire_chroma_client(self.persist_directory)
+            self.vector_store = Chroma(
+                collection_name=self.collection_name,
+                client=self.client,
+                persist_directory=self.persist_directory,
+                embedding_function=embedding_function
+            )
+        # 與向量庫同步維護的 BM25 倒排索引 (混合檢索用，見 sparse_index.py)
+        self.sparse_index = BM25Index(sparse_index_path(self.persist_directory, self.collection_name))
+        self._closed = False
+
+    def close(self):
+        """釋放對共用嵌入模型與 Chroma 用戶端的參考 (最後一個使用者釋放時才真正卸載)"""
+        if self._closed: return
+        self._closed = True
+        if self.client is not None: release_chroma_client(self.persist_directory)
+        if self.document_cache: release_document_cache(self.embedding_cache_path)
+        release_query_cache(self.embedding_key)
+        release_embeddings(self.embedding_model_name, self.embedding_backend)
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def source_key(source: Optional[str], source_root: Optional[str] = None) -> str:
+        """片段 ID 使用的來源鍵: source_root 之下的路徑轉為相對路徑 (與 manifest 的鍵相同)，資料目錄搬移或換機器後 ID 不變"""
+        if not source: return ""
+        if source_root is not None:
+            try: return Path(source).relative_to(source_root).as_posix()
+            except ValueError: pass
+        return str(source)
+
+    @staticmethod
+    def chunk_id(source: Optional[str], content_hash: str) -> str:
+        """穩定的片段 ID: 由來源鍵 (source_key) 與片段內容的 SHA-256 組成，不受行程或批次位置影響"""
+        return hashlib.sha256(f"{source or ''}\x1f{content_hash}".encode('utf-8')).hexdigest()
+
+    def _existing(self, ids: List[str], content_hashes: List[str]):
+        """回傳 (已存在的 ID 集合, 已存在的內容雜湊 -> 片段 ID)"""
+        collection = self.vector_store._collection
+        existing_ids = set(collection.get(ids=ids, include=[])["ids"]) if ids else set()
+        found = collection.get(where={"content_sha256": {"$in": content_hashes}}, include=["metadatas"]) if content_hashes else {"ids": [], "metadatas": []}
+        existing_hashes = {m.get("content_sha256"): chunk_id for chunk_id, m in zip(found["ids"], found["metadatas"]) if m}
+        return existing_ids, existing_hashes
+
+    def add_documents(self, documents: List[Document], batch_size: int = 4000, source_root: Optional[str] = None) -> List[str]:
+        """
+        以 upsert 語意加入片段，回傳這些文件在集合中對應的片段 ID。
+        source_root 為來源檔案的根目錄 (DocumentLoader.documents_dir)，片段 ID 以相對於它的路徑計算。
+        - ID 已存在 (相同來源、相同內容) 的片段視為已加入，不再重新嵌入
+        - 內容與集合中其他片段 (其他來源) 完全相同的片段不重複嵌入，回傳既有片段的 ID，
+          讓呼叫端 (增量索引的 manifest) 記錄每個檔案用到的所有片段，只在沒有檔案再用到時才刪除
+        - 本次文件中重複的內容只保留第一份
+        共用的片段只有一份 metadata，source 為最先建立它的檔案 (檢索結果的來源只會列出該檔案，
+        該檔案刪除後仍由其他檔案共用時也不會改寫)；要知道所有來源需查 manifest 中哪些檔案的 chunk_ids 包含此片段。
+        """
         if not documents: return []
-        total_docs = len(documents); all_ids = []
+        total_docs = len(documents); all_ids = []; skipped_existing = 0; skipped_duplicate = 0
         self.logger.info(f"準備將 {total_docs} 個文檔分批加入集合 '{self.collection_name}'，每批大小: {batch_size}")
-        for i in range(0, total_docs, batch_size):
-            batch_documents = documents[i:i + batch_size]
+
+        unique = []; seen_hashes = set()
+        for doc in documents:
+            content_hash = self.content_hash(doc.page_content)
+            if content_hash in seen_hashes:
+                skipped_duplicate += 1; continue
+            seen_hashes.add(content_hash)
+            doc.metadata = dict(doc.metadata, content_sha256=content_hash)
+            unique.append((self.chunk_id(self.source_key(doc.metadata.get("source"), source_root), content_hash), doc))
+
+        for i in range(0, len(unique), batch_size):
+            batch = unique[i:i + batch_size]
             try:
                 self.logger.info(f"正在處理批次 {i // batch_size + 1}...")
-                ids = [f"doc_{i+j}_{hash(doc.page_content)}" for j, doc in enumerate(batch_documents)]
-                self.vector_store.add_documents(documents=batch_documents, ids=ids)
-                all_ids.extend(ids)
+                existing_ids, existing_hashes = self._existing([chunk_id for chunk_id, _ in batch], [doc.metadata["content_sha256"] for _, doc in batch])
+                new = []; kept = []
+                for chunk_id, doc in batch:
+                    if chunk_id in existing_ids:
+                        skipped_existing += 1; all_ids.append(chunk_id); kept.append((chunk_id, doc))
+                    elif doc.metadata["content_sha256"] in existing_hashes:
+                        skipped_duplicate += 1; all_ids.append(existing_hashes[doc.metadata["content_sha256"]])
+                    else:
+                        new.append((chunk_id, doc))
+                if new:
+                    self.vector_store.add_documents(documents=[doc for _, doc in new], ids=[chunk_id for chunk_id, _ in new])
+                    all_ids.extend(chunk_id for chunk_id, _ in new)
+                # 已存在的片段也重新寫入稀疏索引 (斷詞很便宜)，索引檔遺失或過期時可自行補齊
+                self.sparse_index.add([chunk_id for chunk_id, _ in kept + new], [doc for _, doc in kept + new])
             except Exception as e:
                 self.logger.error(f"處理批次時發生錯誤: {e}", exc_info=True); continue
-        self.logger.info(f"所有批次處理完成，共成功添加 {len(all_ids)} / {total_docs} 個文檔。")
-        return all_ids
+        self.logger.info(f"所有批次處理完成，共 {len(all_ids)} / {total_docs} 個文檔在集合中 "
+                         f"(其中 {skipped_existing} 個已存在；另略過 {skipped_duplicate} 個重複片段)。")
+        return list(dict.fromkeys(all_ids))
     
-    def get_relevant_context(self, query: str, k: int = 3, max_length: int = 2000) -> str:
+    def delete_documents(self, ids: List[str], batch_size: int = 4000) -> int:
+        """依 ID 刪除片段 (增量索引移除或更新檔案時使用)"""
+        for i in range(0, len(ids), batch_size):
+            self.vector_store.delete(ids=ids[i:i + batch_size])
+        self.sparse_index.delete(ids)
+        return len(ids)
+
+    def get_relevant_chunks(self, query: str, k: int = 3, min_similarity: Optional[float] = DEFAULT_MIN_SIMILARITY,
+                            mmr_lambda: float = DEFAULT_MMR_LAMBDA, fetch_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        回傳最多 k 個相關片段 (依相關度排序，含 score / similarity)，不做長度截斷，交由提示組裝器依 token 預算取捨。
+        先取 fetch_k (預設 4k) 個候選，去掉相似度低於 min_similarity 者，以 MMR 挑出彼此不重複的 k 個，再合併互相重疊的相鄰片段。
+        """
+        try:
+            vector = self.embed_queries([query])[0]
+            candidates = apply_threshold(self.get_relevant_chunks_by_vector(vector, k=fetch_k or k * 4, with_vectors=True), min_similarity)
+            return finalize(merge_overlapping(mmr_select(vector, candidates, k, mmr_lambda)))
+        except Exception as e:
+            self.logger.error(f"搜索失敗: {e}"); return []
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """一次計算多個查詢的向量 (批次編碼比逐筆呼叫快得多)；先查詢向量快取，只編碼未命中的查詢"""
+        return self.query_cache.embed(list(queries), self.embeddings.embed_documents) if queries else []
+
+    def get_relevant_chunks_by_vector(self, embedding: List[float], k: int = 3, with_vectors: bool = False, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """
+        以預先計算好的查詢向量取前 k 個最近的片段 (不做門檻與 MMR)；where 為 metadata 篩選，例如 {"city": "臺北市"}。
+        score 為向量距離 (越小越相關)，similarity 為對應的餘弦相似度；with_vectors=True 時附上片段向量 (vector，供 MMR 使用)。
+        """
+        try:
+            include = ["documents", "metadatas", "distances"] + (["embeddings"] if with_vectors else [])
+            found = self.vector_store._collection.query(query_embeddings=[embedding], n_results=k, include=include, **({"where": where} if where else {}))
+            vectors = found.get("embeddings")
+            chunks = []
+            for rank, (chunk_id, text, metadata, distance) in enumerate(zip(found["ids"][0], found["documents"][0], found["metadatas"][0], found["distances"][0])):
+                metadata = metadata or {}
+                chunk = {"id": chunk_id, "content": text.strip(), "score": float(distance), "similarity": round(1.0 - float(distance) / 2, 4),
+                         "source": metadata.get("source"), "rank": rank, "content_sha256": metadata.get("content_sha256")}
+                if with_vectors: chunk["vector"] = vectors[0][rank]
+                chunks.append(chunk)
+            return chunks
+        except Exception as e:
+            self.logger.error(f"搜索失敗: {e}"); return []
+
+    def get_vectors(self, ids: List[str]) -> Dict[str, Any]:
+        """依片段 ID 取出已儲存的向量 (BM25 找到的片段做 MMR 時使用)"""
+        if not ids: return {}
         try:
-            results_with_scores = self.vector_store.similarity_search_with_score(query, k=k)
-            context_parts = []
-            current_length = 0
-            for doc, score in results_with_scores:
-                content = doc.page_content.strip()
-                if current_length + len(content) <= max_length:
-                    context_parts.append(content)
-                    current_length += len(content)
-                else: break
-            return "\n\n---\n\n".join(context_parts)
+            found = self.vector_store._collection.get(ids=list(ids), include=["embeddings"])
+            return dict(zip(found["ids"], found["embeddings"]))
         except Exception as e:
-            self.logger.error(f"搜索失敗: {e}"); return ""
+            self.logger.error(f"讀取片段向量失敗: {e}"); return {}
+
+    def get_relevant_chunks_sparse(self, query: str, k: int = 3, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """以 BM25 關鍵字比對回傳前 k 個片段 (bm25_score 越大越相關；score 為向量距離，此處為 None)"""
+        try:
+            return [
+                {"id": entry["id"], "content": entry["content"].strip(), "score": None, "bm25_score": round(score, 4), "source": entry["metadata"].get("source"),
+                 "rank": rank, "content_sha256": entry["metadata"].get("content_sha256")}
+                for rank, (entry, score) in enumerate(self.sparse_index.search(query, k=k, where=where))
+            ]
+        except Exception as e:
+            self.logger.error(f"BM25 搜索失敗: {e}"); return []
+
+    def get_relevant_context(self, query: str, k: int = 3, max_length: int = 2000, min_similarity: Optional[float] = DEFAULT_MIN_SIMILARITY) -> str:
+        """串接 get_relevant_chunks 挑出的片段 (已過門檻、去除重複與重疊)，直到 max_length 個字為止"""
+        context_parts = []
+        current_length = 0
+        for chunk in self.get_relevant_chunks(query, k=k, min_similarity=min_similarity):
+            content = chunk["content"]
+            if current_length + len(content) <= max_length:
+                context_parts.append(content)
+                current_length += len(content)
+            else: break
+        return "\n\n---\n\n".join(context_parts)
+
+    def mark_rebuilt(self) -> str:
+        """寫入 BM25 索引，並在資料庫目錄寫入新的建置版本標記，供回答快取等下游判斷知識庫是否已更新"""
+        self.sparse_index.save()
+        build_id = uuid.uuid4().hex
+        info = {"build_id": build_id, "built_at": datetime.now().isoformat(), "collection_name": self.collection_name}
+        with open(Path(self.persist_directory) / "build_info.json", 'w', encoding='utf-8') as f:
+            json.dump(info, f, ensure_ascii=False)
+        return build_id
+
+    def get_build_version(self) -> Optional[str]:
+        """讀取建置版本標記 (以檔案 mtime 快取，避免每次請求都解析 JSON)"""
+        marker = Path(self.persist_directory) / "build_info.json"
+        try:
+            mtime = marker.stat().st_mtime
+        except OSError:
+            return None
+        cached = getattr(self, "_build_version_cache", None)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        try:
+            with open(marker, 'r', encoding='utf-8') as f:
+                build_id = json.load(f).get("build_id")
+        except (OSError, ValueError):
+            return None
+        self._build_version_cache = (mtime, build_id)
+        return build_id
 
     def get_stats(self) -> Dict[str, Any]:
         try:
             count = self.vector_store._collection.count()
-            return { "total_documents": count, "embedding_model": self.embedding_model_name, "persist_directory": self.persist_directory, "collection_name": self.collection_name }
+            stats = { "total_documents": count, "store_type": self.store_type, "embedding_model": self.embedding_model_name, "embedding_backend": getattr(self.embeddings, "backend_name", "torch"), "persist_directory": self.persist_directory, "collection_name": self.collection_name }
+            stats["sparse_index"] = self.sparse_index.get_stats()
+            if self.document_cache: stats["embedding_cache"] = self.document_cache.get_stats()
+            return stats
         except Exception as e:
             self.logger.error(f"獲取統計信息失敗: {e}"); return {}
\ No newline at end of file
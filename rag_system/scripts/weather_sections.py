@@ -0,0 +1,74 @@
+# C:\llm_service\rag_system\scripts\weather_sections.py
+# 天氣摘要 (weather_for_llm.txt) 的城市切割: 每個【城市】段落一個片段，附 city / observation_time / report_time metadata
+
+import re
+from typing import List, Optional
+
+from langchain.schema import Document
+
+# 縣市正式名稱 (與中央氣象署資料相同，使用「臺」)
+TAIWAN_CITIES = [
+    "臺北市", "新北市", "桃園市", "臺中市", "臺南市", "高雄市", "基隆市", "新竹市", "新竹縣", "苗栗縣", "彰化縣",
+    "南投縣", "雲林縣", "嘉義市", "嘉義縣", "屏東縣", "宜蘭縣", "花蓮縣", "臺東縣", "澎湖縣", "金門縣", "連江縣"
+]
+
+# 簡稱 (例如「新竹」) 對應到清單中較前面的市。簡稱後面接著路/街或 _ALIAS_EXCLUDES 中的字時是其他地名
+# (例如「新北投」在臺北市、「基隆路」在臺北市)，不算提到該縣市
+_ALIASES = {}
+for _city in TAIWAN_CITIES: _ALIASES.setdefault(_city[:2], _city)
+_ALIAS_EXCLUDES = {"新北": "投"}
+_ALIAS_PATTERNS = {alias: re.compile(alias + f"(?![路街{_ALIAS_EXCLUDES.get(alias, '')}])") for alias in _ALIASES}
+
+_SECTION_HEADER = re.compile(r"^【(.+?)】\s*$", re.MULTILINE)
+_OBSERVATION_TIME = re.compile(r"\[即時天氣 @ ([^\]]+)\]")
+_REPORT_TIME = re.compile(r"報告生成時間[:：]\s*(.+)")
+
+
+def normalize_city(text: Optional[str]) -> Optional[str]:
+    """
+    把「台北」「臺北市」「屏東内埔 (參考屏東縣預報...)」等寫法對應到縣市正式名稱，找不到時回傳 None。
+    只有簡稱時 (例如「新竹」) 取清單中較前面的市。
+    """
+    if not text: return None
+    text = text.replace("台", "臺")
+    for city in TAIWAN_CITIES:
+        if city in text: return city
+    for alias, city in _ALIASES.items():
+        if _ALIAS_PATTERNS[alias].search(text): return city
+    return None
+
+
+def extract_cities(text: Optional[str]) -> List[str]:
+    """文字中提到的所有縣市 (正式名稱，依出現順序)；「新竹」「嘉義」等只有簡稱時對應到市"""
+    if not text: return []
+    text = text.replace("台", "臺")
+    found = {city: text.find(city) for city in TAIWAN_CITIES if city in text}
+    for alias, city in _ALIASES.items():
+        # 簡稱只在同簡稱的縣市都沒有以全名出現時才算 (例如「新竹縣」不再另外算成「新竹市」)
+        if any(other.startswith(alias) for other in found): continue
+        match = _ALIAS_PATTERNS[alias].search(text)
+        if match: found[city] = match.start()
+    return sorted(found, key=found.get)
+
+
+def split_weather_sections(text: str, source: str) -> List[Document]:
+    """
+    依【...】標題切割天氣摘要，每段 (含即時觀測與預報) 成為一個片段，並在內容末尾附上報告生成時間。
+    結尾的「資料來源」說明不屬於任何城市，不放進片段。沒有任何段落時回傳空清單。
+    """
+    report_match = _REPORT_TIME.search(text)
+    report_time = report_match.group(1).strip() if report_match else None
+    headers = list(_SECTION_HEADER.finditer(text))
+    documents = []
+    for i, header in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+        body = text[header.end():end].split("資料來源")[0].rstrip()
+        content = f"【{header.group(1)}】{body}" + (f"\n  (報告生成時間: {report_time})" if report_time else "")
+        metadata = {"source": source, "section": header.group(1)}
+        city = normalize_city(header.group(1))
+        if city: metadata["city"] = city
+        observation = _OBSERVATION_TIME.search(body)
+        if observation: metadata["observation_time"] = observation.group(1).strip()
+        if report_time: metadata["report_time"] = report_time
+        documents.append(Document(page_content=content, metadata=metadata))
+    return documents